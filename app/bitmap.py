@@ -0,0 +1,186 @@
+"""Compressed integer bitmaps"""
+from typing import Iterable, Iterator, Optional
+import numpy as np
+
+ARRAY_MAX = 4096
+CONTAINER_BITS = 1 << 16
+# Set bits in every byte value, for counting a bitset a byte at a time
+BYTE_POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint16)
+
+class Bitmap:
+    """Immutable roaring-style bitmap of unsigned 32-bit integers
+
+    Values are grouped by their high 16 bits into containers. A container with up
+    to ARRAY_MAX values is a sorted uint16 array; a denser one is a 65536-bit
+    bitset of uint64 words. Memory therefore follows the number of values rather
+    than the largest value, and AND, OR and AND NOT run one container pair at a
+    time in NumPy. Operations always return a new bitmap.
+    """
+
+    __slots__ = ('_containers',)
+
+    def __init__(self, containers: Optional[dict] = None):
+        self._containers = containers or {}
+
+    @classmethod
+    def from_values(cls, values: Iterable[int]) -> 'Bitmap':
+        """Bitmap of the given values; duplicates and order do not matter"""
+        values = np.unique(np.asarray(values, dtype=np.uint32))
+        if not len(values):
+            return cls()
+        highs = values >> 16
+        containers = {}
+        for chunk in np.split(values, np.flatnonzero(np.diff(highs)) + 1):
+            container = _normalize((chunk & 0xFFFF).astype(np.uint16))
+            if container is not None:
+                containers[int(chunk[0]) >> 16] = container
+        return cls(containers)
+
+    @classmethod
+    def union_all(cls, bitmaps: Iterable['Bitmap']) -> 'Bitmap':
+        """Union of many bitmaps, merging each container key once instead of pairwise"""
+        grouped = {}
+        for bitmap in bitmaps:
+            for high, container in bitmap._containers.items():
+                grouped.setdefault(high, []).append(container)
+        containers = {}
+        for high, parts in grouped.items():
+            if len(parts) == 1:
+                containers[high] = parts[0]
+                continue
+            arrays = [part for part in parts if not _is_bitset(part)]
+            if len(arrays) == len(parts) and sum(len(part) for part in arrays) <= ARRAY_MAX:
+                merged = np.unique(np.concatenate(arrays))
+            else:
+                flags = np.zeros(CONTAINER_BITS, dtype=bool)
+                for part in parts:
+                    if _is_bitset(part):
+                        flags |= _flags(part)
+                    else:
+                        flags[part] = True
+                merged = np.packbits(flags, bitorder='little').view(np.uint64)
+            containers[high] = _normalize(merged)
+        return cls(containers)
+
+    @classmethod
+    def from_range(cls, stop: int) -> 'Bitmap':
+        """Bitmap of 0 .. stop - 1"""
+        return cls.from_values(np.arange(stop, dtype=np.uint32))
+
+    def __and__(self, other: 'Bitmap') -> 'Bitmap':
+        containers = {}
+        for high in self._containers.keys() & other._containers.keys():
+            container = _normalize(_and(self._containers[high], other._containers[high]))
+            if container is not None:
+                containers[high] = container
+        return Bitmap(containers)
+
+    def __or__(self, other: 'Bitmap') -> 'Bitmap':
+        containers = dict(self._containers)
+        for high, container in other._containers.items():
+            mine = containers.get(high)
+            containers[high] = container if mine is None else _normalize(_or(mine, container))
+        return Bitmap(containers)
+
+    def __sub__(self, other: 'Bitmap') -> 'Bitmap':
+        containers = {}
+        for high, container in self._containers.items():
+            theirs = other._containers.get(high)
+            if theirs is not None:
+                container = _normalize(_and_not(container, theirs))
+            if container is not None:
+                containers[high] = container
+        return Bitmap(containers)
+
+    def __len__(self) -> int:
+        return sum(_cardinality(container) for container in self._containers.values())
+
+    def __contains__(self, value: int) -> bool:
+        container = self._containers.get(value >> 16)
+        if container is None:
+            return False
+        low = value & 0xFFFF
+        if _is_bitset(container):
+            return bool(int(container[low >> 6]) >> (low & 63) & 1)
+        index = np.searchsorted(container, low)
+        return index < len(container) and int(container[index]) == low
+
+    def __iter__(self) -> Iterator[int]:
+        for high in sorted(self._containers):
+            base = high << 16
+            for low in _values(self._containers[high]).tolist():
+                yield base | low
+
+    def to_array(self) -> np.ndarray:
+        """All values in ascending order"""
+        if not self._containers:
+            return np.zeros(0, dtype=np.uint32)
+        return np.concatenate([
+            (np.uint32(high) << np.uint32(16)) | _values(self._containers[high]).astype(np.uint32)
+            for high in sorted(self._containers)
+        ])
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the containers"""
+        return sum(container.nbytes for container in self._containers.values())
+
+def _is_bitset(container: np.ndarray) -> bool:
+    """Whether a container is a bitset rather than a sorted array"""
+    return container.dtype == np.uint64
+
+def _flags(bitset: np.ndarray) -> np.ndarray:
+    """One boolean per bit of a bitset container"""
+    return np.unpackbits(bitset.view(np.uint8), bitorder='little').view(bool)
+
+def _to_bitset(container: np.ndarray) -> np.ndarray:
+    """Container as a bitset"""
+    if _is_bitset(container):
+        return container
+    flags = np.zeros(CONTAINER_BITS, dtype=bool)
+    flags[container] = True
+    return np.packbits(flags, bitorder='little').view(np.uint64)
+
+def _values(container: np.ndarray) -> np.ndarray:
+    """Sorted low 16-bit values of a container"""
+    if _is_bitset(container):
+        return np.flatnonzero(_flags(container)).astype(np.uint16)
+    return container
+
+def _cardinality(container: np.ndarray) -> int:
+    """Number of values in a container"""
+    if _is_bitset(container):
+        return int(BYTE_POPCOUNT[container.view(np.uint8)].sum())
+    return len(container)
+
+def _normalize(container: np.ndarray) -> Optional[np.ndarray]:
+    """Container in its compact form for its cardinality, or None when empty"""
+    count = _cardinality(container)
+    if count == 0:
+        return None
+    if _is_bitset(container):
+        return _values(container) if count <= ARRAY_MAX else container
+    return _to_bitset(container) if count > ARRAY_MAX else container
+
+def _and(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Intersection of two containers"""
+    if _is_bitset(a) and _is_bitset(b):
+        return a & b
+    if not _is_bitset(a) and not _is_bitset(b):
+        return np.intersect1d(a, b, assume_unique=True)
+    array, bitset = (b, a) if _is_bitset(a) else (a, b)
+    return array[_flags(bitset)[array]]
+
+def _or(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Union of two containers"""
+    if not _is_bitset(a) and not _is_bitset(b) and len(a) + len(b) <= ARRAY_MAX:
+        return np.union1d(a, b)
+    return _to_bitset(a) | _to_bitset(b)
+
+def _and_not(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Values of the first container that are not in the second"""
+    if _is_bitset(a):
+        return a & ~_to_bitset(b)
+    if _is_bitset(b):
+        return a[~_flags(b)[a]]
+    return np.setdiff1d(a, b, assume_unique=True)
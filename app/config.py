@@ -31,6 +31,81 @@ class Settings:
     DB_POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", "30"))
     DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "3600"))
     
+    # Idempotency Keys
+    IDEMPOTENCY_TTL_SECONDS: int = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+    IDEMPOTENCY_CACHE_SIZE: int = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+    IDEMPOTENCY_WAIT_SECONDS: float = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "10"))
+    IDEMPOTENCY_LEASE_SECONDS: int = int(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "300"))
+    
+    # Remittance Ingestion
+    REMITTANCE_CHUNK_SIZE: int = int(os.getenv("REMITTANCE_CHUNK_SIZE", "5000"))
+    
+    # Pagination
+    PAYMENT_HISTORY_PAGE_SIZE: int = int(os.getenv("PAYMENT_HISTORY_PAGE_SIZE", "50"))
+    PAYMENT_HISTORY_MAX_PAGE_SIZE: int = int(os.getenv("PAYMENT_HISTORY_MAX_PAGE_SIZE", "500"))
+    PRESCRIPTION_PAGE_SIZE: int = int(os.getenv("PRESCRIPTION_PAGE_SIZE", "50"))
+    PRESCRIPTION_MAX_PAGE_SIZE: int = int(os.getenv("PRESCRIPTION_MAX_PAGE_SIZE", "500"))
+    CLINICAL_SEARCH_PAGE_SIZE: int = int(os.getenv("CLINICAL_SEARCH_PAGE_SIZE", "20"))
+    CLINICAL_SEARCH_MAX_PAGE_SIZE: int = int(os.getenv("CLINICAL_SEARCH_MAX_PAGE_SIZE", "100"))
+    
+    # Reporting
+    AGING_REPORT_CACHE_SECONDS: int = int(os.getenv("AGING_REPORT_CACHE_SECONDS", "300"))
+    INVENTORY_REPORT_CACHE_SECONDS: int = int(os.getenv("INVENTORY_REPORT_CACHE_SECONDS", "60"))
+    
+    # Demand Forecasting
+    FORECAST_HISTORY_DAYS: int = int(os.getenv("FORECAST_HISTORY_DAYS", "730"))
+    FORECAST_WINDOW_DAYS: int = int(os.getenv("FORECAST_WINDOW_DAYS", "28"))
+    FORECAST_SMOOTHING_ALPHA: float = float(os.getenv("FORECAST_SMOOTHING_ALPHA", "0.2"))
+    FORECAST_LEAD_TIME_DAYS: int = int(os.getenv("FORECAST_LEAD_TIME_DAYS", "7"))
+    FORECAST_SERVICE_LEVEL_Z: float = float(os.getenv("FORECAST_SERVICE_LEVEL_Z", "1.65"))
+    FORECAST_ITEM_CHUNK_SIZE: int = int(os.getenv("FORECAST_ITEM_CHUNK_SIZE", "5000"))
+    
+    # Sharded Inventory Counters
+    INVENTORY_COUNTER_SHARDS: int = int(os.getenv("INVENTORY_COUNTER_SHARDS", "8"))
+    INVENTORY_COUNTER_COMPACT_SECONDS: float = float(os.getenv("INVENTORY_COUNTER_COMPACT_SECONDS", "30"))
+    
+    # Inventory Expiry Sweep
+    INVENTORY_EXPIRY_SWEEP_SECONDS: int = int(os.getenv("INVENTORY_EXPIRY_SWEEP_SECONDS", "3600"))
+    INVENTORY_EXPIRY_HORIZON_DAYS: int = int(os.getenv("INVENTORY_EXPIRY_HORIZON_DAYS", "90"))
+    
+    # Medication Catalog
+    MEDICATION_CATALOG_REFRESH_SECONDS: float = float(os.getenv("MEDICATION_CATALOG_REFRESH_SECONDS", "60"))
+    MEDICATION_CATALOG_MISS_TTL_SECONDS: float = float(os.getenv("MEDICATION_CATALOG_MISS_TTL_SECONDS", "30"))
+    MEDICATION_CATALOG_MISS_CACHE_SIZE: int = int(os.getenv("MEDICATION_CATALOG_MISS_CACHE_SIZE", "10000"))
+    
+    # Prescription Expiry
+    PRESCRIPTION_EXPIRY_SWEEP_SECONDS: int = int(os.getenv("PRESCRIPTION_EXPIRY_SWEEP_SECONDS", "3600"))
+    PRESCRIPTION_EXPIRY_BATCH_SIZE: int = int(os.getenv("PRESCRIPTION_EXPIRY_BATCH_SIZE", "1000"))
+    
+    # Drug Interactions
+    DRUG_INTERACTION_RELOAD_SECONDS: float = float(os.getenv("DRUG_INTERACTION_RELOAD_SECONDS", "300"))
+    DRUG_INTERACTIONS_FILE: str = os.getenv("DRUG_INTERACTIONS_FILE", "")
+    
+    # Medical Record Versions
+    RECORD_VERSION_CACHE_SIZE: int = int(os.getenv("RECORD_VERSION_CACHE_SIZE", "256"))
+    RECORD_VERSION_CACHE_SECONDS: float = float(os.getenv("RECORD_VERSION_CACHE_SECONDS", "3600"))
+    
+    # Cohort Index
+    COHORT_INDEX_REFRESH_SECONDS: float = float(os.getenv("COHORT_INDEX_REFRESH_SECONDS", "300"))
+    COHORT_INDEX_BATCH_SIZE: int = int(os.getenv("COHORT_INDEX_BATCH_SIZE", "10000"))
+    
+    # Diagnosis Codes
+    DIAGNOSIS_CODES_FILE: str = os.getenv("DIAGNOSIS_CODES_FILE", "")
+    DIAGNOSIS_CODE_SEARCH_LIMIT: int = int(os.getenv("DIAGNOSIS_CODE_SEARCH_LIMIT", "10"))
+    DIAGNOSIS_CODE_SEARCH_MAX_LIMIT: int = int(os.getenv("DIAGNOSIS_CODE_SEARCH_MAX_LIMIT", "50"))
+    
+    # Inventory Snapshots
+    INVENTORY_CHECKPOINT_INTERVAL_SECONDS: int = int(os.getenv("INVENTORY_CHECKPOINT_INTERVAL_SECONDS", "86400"))
+    INVENTORY_CHECKPOINT_SETTLE_SECONDS: int = int(os.getenv("INVENTORY_CHECKPOINT_SETTLE_SECONDS", "60"))
+    INVENTORY_CHECKPOINT_RETENTION: int = int(os.getenv("INVENTORY_CHECKPOINT_RETENTION", "90"))
+    
+    # Transactional Outbox
+    OUTBOX_BATCH_SIZE: int = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+    OUTBOX_POLL_SECONDS: float = float(os.getenv("OUTBOX_POLL_SECONDS", "1"))
+    OUTBOX_CLAIM_SECONDS: int = int(os.getenv("OUTBOX_CLAIM_SECONDS", "60"))
+    OUTBOX_FILE_PATH: str = os.getenv("OUTBOX_FILE_PATH", "./outbox_events.ndjson")
+    OUTBOX_WEBHOOK_URL: Optional[str] = os.getenv("OUTBOX_WEBHOOK_URL")
+    
     # Logging
     LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
 
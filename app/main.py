@@ -1,8 +1,12 @@
 """FastAPI application factory and configuration"""
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import settings
+from app.database import SessionLocal
+from app.services.diagnosis_code_service import DiagnosisCodeService
+from app.services.medication_catalog_service import MedicationCatalogService
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime
@@ -88,6 +92,28 @@ departments_db = {}
 billing_db = {}
 inventory_db = {}
 
+def load_medication_catalog():
+    """Warm the medication catalog so the first prescription lookups are hits"""
+    db = SessionLocal()
+    try:
+        MedicationCatalogService(db).load()
+    except Exception as e:
+        # Lookups load the catalog on demand if the database is not ready yet
+        logger.warning(f"Medication catalog not loaded at startup: {e}")
+    finally:
+        db.close()
+
+def load_diagnosis_codes():
+    """Build the diagnosis code catalog so the first lookup does not pay for it"""
+    DiagnosisCodeService().catalog()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application startup and shutdown"""
+    load_medication_catalog()
+    load_diagnosis_codes()
+    yield
+
 def create_app() -> FastAPI:
     """Create and configure FastAPI application"""
     
@@ -95,7 +121,8 @@ def create_app() -> FastAPI:
         title=settings.APP_NAME,
         version=settings.APP_VERSION,
         debug=settings.DEBUG,
-        description="Comprehensive Hospital Management System"
+        description="Comprehensive Hospital Management System",
+        lifespan=lifespan
     )
     
     # Add CORS middleware
@@ -5,24 +5,29 @@ Base = declarative_base()
 
 from app.models.patient import Patient, PatientStatus
 from app.models.audit import PatientAuditLog
-from app.models.medical_record import MedicalRecord, Diagnosis, Treatment, ClinicalNote
+from app.models.medical_record import MedicalRecord, Diagnosis, Treatment, ClinicalNote, MedicalRecordRemoval
 from app.models.appointment import Appointment, AppointmentSlot, AppointmentStatus
 from app.models.staff import Staff, StaffRole, StaffStatus, StaffCredential, StaffAvailability
-from app.models.prescription import Prescription, PrescriptionItem, PrescriptionStatus
+from app.models.prescription import Prescription, PrescriptionItem, PrescriptionStatus, DrugInteraction, InteractionSeverity
 from app.models.billing import BillingRecord, BillingItem, Payment, BillingStatus, PaymentStatus
-from app.models.inventory import InventoryItem, InventoryTransaction, InventoryTransactionType
+from app.models.inventory import InventoryItem, InventoryTransaction, InventoryTransactionType, InventoryLot, InventoryQuarantine, InventoryStock, InventoryCounterShard, InventoryCheckpoint, InventorySnapshot
 from app.models.department import Department, DepartmentStaff
 from app.models.access_control import User, Role, AccessLog, UserRole, AccessLogAction
+from app.models.idempotency import IdempotencyRecord, IdempotencyStatus
+from app.models.outbox import OutboxEvent
 
 __all__ = [
     'Base',
     'Patient', 'PatientStatus', 'PatientAuditLog',
-    'MedicalRecord', 'Diagnosis', 'Treatment', 'ClinicalNote',
+    'MedicalRecord', 'Diagnosis', 'Treatment', 'ClinicalNote', 'MedicalRecordRemoval',
     'Appointment', 'AppointmentSlot', 'AppointmentStatus',
     'Staff', 'StaffRole', 'StaffStatus', 'StaffCredential', 'StaffAvailability',
-    'Prescription', 'PrescriptionItem', 'PrescriptionStatus',
+    'Prescription', 'PrescriptionItem', 'PrescriptionStatus', 'DrugInteraction', 'InteractionSeverity',
     'BillingRecord', 'BillingItem', 'Payment', 'BillingStatus', 'PaymentStatus',
-    'InventoryItem', 'InventoryTransaction', 'InventoryTransactionType',
+    'InventoryItem', 'InventoryTransaction', 'InventoryTransactionType', 'InventoryLot', 'InventoryQuarantine',
+    'InventoryStock', 'InventoryCounterShard', 'InventoryCheckpoint', 'InventorySnapshot',
     'Department', 'DepartmentStaff',
-    'User', 'Role', 'AccessLog', 'UserRole', 'AccessLogAction'
+    'User', 'Role', 'AccessLog', 'UserRole', 'AccessLogAction',
+    'IdempotencyRecord', 'IdempotencyStatus',
+    'OutboxEvent'
 ]
@@ -1,5 +1,5 @@
 """Billing models"""
-from sqlalchemy import Column, String, DateTime, ForeignKey, Numeric, Enum, Boolean
+from sqlalchemy import Column, String, DateTime, ForeignKey, Numeric, Enum, Boolean, Index, Integer, UniqueConstraint
 from sqlalchemy.sql import func
 from datetime import datetime
 import enum
@@ -25,6 +25,7 @@ class BillingRecord(Base):
     
     id = Column(String, primary_key=True, index=True)
     patient_id = Column(String, ForeignKey("patients.id"), nullable=False, index=True)
+    department_id = Column(String, ForeignKey("departments.id"), nullable=True, index=True)
     total_amount = Column(Numeric(10, 2), nullable=False)
     insurance_coverage = Column(Numeric(10, 2), default=0, nullable=False)
     patient_responsibility = Column(Numeric(10, 2), nullable=False)
@@ -32,6 +33,13 @@ class BillingRecord(Base):
     is_finalized = Column(Boolean, default=False, nullable=False)
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+    
+    __table_args__ = (
+        # Outstanding-balance scans (aging report) filter on status and bucket on created_at
+        Index('ix_billing_records_status_created_at', 'status', 'created_at'),
+        # Patient-level access path for payment history joins
+        Index('ix_billing_records_patient_id_id', 'patient_id', 'id'),
+    )
 
 class BillingItem(Base):
     """Billing item model"""
@@ -54,5 +62,14 @@ class Payment(Base):
     amount = Column(Numeric(10, 2), nullable=False)
     payment_method = Column(String, nullable=False)
     status = Column(Enum(PaymentStatus), default=PaymentStatus.PENDING, nullable=False)
+    # Source remittance file and line for payments posted from one, so a re-sent file posts nothing twice
+    remittance_id = Column(String, nullable=True)
+    remittance_line = Column(Integer, nullable=True)
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+    
+    __table_args__ = (
+        # Covers payment history: per-bill range scan in created_at order
+        Index('ix_payments_billing_id_created_at', 'billing_id', 'created_at', 'id'),
+        UniqueConstraint('remittance_id', 'remittance_line', name='uq_payments_remittance_line'),
+    )
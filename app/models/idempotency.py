@@ -0,0 +1,25 @@
+"""Idempotency key models"""
+from sqlalchemy import Column, String, DateTime, Text, Enum
+from sqlalchemy.sql import func
+import enum
+from app.models import Base
+
+class IdempotencyStatus(str, enum.Enum):
+    """Idempotency key status enumeration"""
+    IN_PROGRESS = "in_progress"
+    COMPLETED = "completed"
+
+class IdempotencyRecord(Base):
+    """Stored result of a request made with an idempotency key"""
+    __tablename__ = "idempotency_keys"
+    
+    scope = Column(String, primary_key=True)
+    key = Column(String, primary_key=True)
+    request_hash = Column(String, nullable=False)
+    status = Column(Enum(IdempotencyStatus), default=IdempotencyStatus.IN_PROGRESS, nullable=False)
+    response_body = Column(Text, nullable=True)
+    # Lease on an in-progress claim; a retry may take over once it is older than the lease
+    claimed_at = Column(DateTime, nullable=True)
+    claim_token = Column(String, nullable=True)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
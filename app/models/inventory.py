@@ -1,5 +1,5 @@
 """Inventory models"""
-from sqlalchemy import Column, String, DateTime, Integer, Numeric, Date, Enum
+from sqlalchemy import Column, String, DateTime, Integer, Numeric, Date, Enum, Boolean, ForeignKey, Index
 from sqlalchemy.sql import func
 from datetime import datetime
 import enum
@@ -11,6 +11,7 @@ class InventoryTransactionType(str, enum.Enum):
     CONSUME = "consume"
     ADJUST = "adjust"
     RETURN = "return"
+    TRANSFER = "transfer"
 
 class InventoryItem(Base):
     """Inventory item model"""
@@ -20,9 +21,15 @@ class InventoryItem(Base):
     name = Column(String, nullable=False, index=True)
     quantity = Column(Integer, nullable=False, default=0)
     unit_cost = Column(Numeric(10, 2), nullable=False)
-    expiration_date = Column(Date, nullable=True)
-    storage_location = Column(String, nullable=False)
+    expiration_date = Column(Date, nullable=True, index=True)
+    storage_location = Column(String, nullable=False, index=True)
+    category = Column(String, nullable=True, index=True)
     min_threshold = Column(Integer, default=10, nullable=False)
+    lot_tracked = Column(Boolean, default=False, nullable=False)
+    # Non-zero for hot items whose stock is split across InventoryCounterShard rows
+    shard_count = Column(Integer, default=0, nullable=False)
+    # Maintained by InventoryService on every stock change so low-stock reads hit the index
+    is_low_stock = Column(Boolean, default=False, nullable=False, index=True)
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
 
@@ -37,3 +44,93 @@ class InventoryTransaction(Base):
     timestamp = Column(DateTime, server_default=func.now(), nullable=False)
     user_id = Column(String, nullable=True)
     notes = Column(String, nullable=True)
+    location = Column(String, nullable=True)
+    # Shared by the paired legs of a transfer
+    reference_id = Column(String, nullable=True, index=True)
+    
+    __table_args__ = (
+        # Demand forecasting aggregates one item's transactions of one type over a date range
+        Index('ix_inventory_transactions_item_type_timestamp', 'item_id', 'transaction_type', 'timestamp'),
+        # Snapshot replay reads every transaction after a checkpoint cutoff
+        Index('ix_inventory_transactions_timestamp', 'timestamp'),
+    )
+
+class InventoryStock(Base):
+    """Quantity of one item held at one storage location
+
+    An item's location rows always sum to InventoryItem.quantity; the item's
+    storage_location is its home location, which movements without an explicit
+    location draw from and replenish.
+    """
+    __tablename__ = "inventory_stock"
+    
+    item_id = Column(String, ForeignKey("inventory_items.id"), primary_key=True)
+    location = Column(String, primary_key=True)
+    quantity = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+    
+    __table_args__ = (
+        # Per-location rollups are answered from the index without touching the table
+        Index('ix_inventory_stock_location_item_id_quantity', 'location', 'item_id', 'quantity'),
+    )
+
+class InventoryCounterShard(Base):
+    """One slice of a hot item's stock, so concurrent consumers update different rows
+
+    While an item is sharded its stock is the sum of its shards; the compactor
+    folds that sum back into InventoryItem.quantity and rebalances the shards.
+    """
+    __tablename__ = "inventory_counter_shards"
+    
+    item_id = Column(String, ForeignKey("inventory_items.id"), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    quantity = Column(Integer, nullable=False, default=0)
+
+class InventoryCheckpoint(Base):
+    """Point in time up to which per-item stock has been folded into snapshots"""
+    __tablename__ = "inventory_checkpoints"
+    
+    id = Column(String, primary_key=True, index=True)
+    cutoff = Column(DateTime, nullable=False, index=True)
+    previous_id = Column(String, ForeignKey("inventory_checkpoints.id"), nullable=True)
+    item_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+class InventorySnapshot(Base):
+    """Stock of one item at a checkpoint's cutoff"""
+    __tablename__ = "inventory_snapshots"
+    
+    checkpoint_id = Column(String, ForeignKey("inventory_checkpoints.id"), primary_key=True)
+    item_id = Column(String, primary_key=True)
+    quantity = Column(Integer, nullable=False)
+
+class InventoryLot(Base):
+    """Stock received under one lot number with its own expiry"""
+    __tablename__ = "inventory_lots"
+    
+    id = Column(String, primary_key=True, index=True)
+    item_id = Column(String, ForeignKey("inventory_items.id"), nullable=False)
+    lot_number = Column(String, nullable=True)
+    quantity = Column(Integer, nullable=False, default=0)
+    expiration_date = Column(Date, nullable=True)
+    received_at = Column(DateTime, server_default=func.now(), nullable=False)
+    
+    __table_args__ = (
+        # FEFO allocation is an ordered range read over one item's lots
+        Index('ix_inventory_lots_item_id_expiration_date', 'item_id', 'expiration_date'),
+        # The expiry sweep and expiring-soon view range-scan lots by date across items
+        Index('ix_inventory_lots_expiration_date', 'expiration_date'),
+    )
+
+class InventoryQuarantine(Base):
+    """Expired stock removed from usable inventory by the expiry sweep"""
+    __tablename__ = "inventory_quarantine"
+    
+    id = Column(String, primary_key=True, index=True)
+    item_id = Column(String, ForeignKey("inventory_items.id"), nullable=False, index=True)
+    lot_id = Column(String, ForeignKey("inventory_lots.id"), nullable=True)
+    quantity = Column(Integer, nullable=False)
+    expiration_date = Column(Date, nullable=True)
+    # Shared with the RETURN transactions that took the stock out of its locations
+    reference_id = Column(String, nullable=False)
+    quarantined_at = Column(DateTime, server_default=func.now(), nullable=False)
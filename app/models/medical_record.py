@@ -1,5 +1,6 @@
 """Medical record models"""
-from sqlalchemy import Column, String, DateTime, Integer, ForeignKey, Text, Enum
+from sqlalchemy import Column, String, DateTime, Integer, ForeignKey, Text, Enum, DDL, UniqueConstraint, event
+from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from datetime import datetime
 import enum
@@ -16,16 +17,26 @@ class MedicalRecord(Base):
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
 
+    __table_args__ = (
+        UniqueConstraint('patient_id', 'version', name='uq_medical_records_patient_version'),
+    )
+
+    diagnoses = relationship("Diagnosis", back_populates="record", order_by="Diagnosis.date_recorded")
+    treatments = relationship("Treatment", back_populates="record", order_by="Treatment.date_started")
+    clinical_notes = relationship("ClinicalNote", back_populates="record", order_by="ClinicalNote.created_at")
+
 class Diagnosis(Base):
     """Diagnosis model"""
     __tablename__ = "diagnoses"
     
     id = Column(String, primary_key=True, index=True)
     record_id = Column(String, ForeignKey("medical_records.id"), nullable=False, index=True)
-    diagnosis_code = Column(String, nullable=False)
+    diagnosis_code = Column(String, nullable=False, index=True)
     description = Column(Text, nullable=False)
     date_recorded = Column(DateTime, server_default=func.now(), nullable=False)
 
+    record = relationship("MedicalRecord", back_populates="diagnoses")
+
 class Treatment(Base):
     """Treatment model"""
     __tablename__ = "treatments"
@@ -37,6 +48,8 @@ class Treatment(Base):
     date_started = Column(DateTime, nullable=False)
     date_ended = Column(DateTime, nullable=True)
 
+    record = relationship("MedicalRecord", back_populates="treatments")
+
 class ClinicalNote(Base):
     """Clinical note model"""
     __tablename__ = "clinical_notes"
@@ -46,3 +59,51 @@ class ClinicalNote(Base):
     note_text = Column(Text, nullable=False)
     created_by = Column(String, nullable=False)
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+    record = relationship("MedicalRecord", back_populates="clinical_notes")
+
+class MedicalRecordRemoval(Base):
+    """Entry removed from a patient's record as of a version
+
+    Entries are never copied into later versions: a version holds only the
+    diagnoses, treatments and notes added in it plus these removals, and its full
+    contents are its ancestors' entries with the removals applied.
+    """
+    __tablename__ = "medical_record_removals"
+    
+    id = Column(String, primary_key=True, index=True)
+    record_id = Column(String, ForeignKey("medical_records.id"), nullable=False, index=True)
+    entry_type = Column(String, nullable=False)
+    entry_id = Column(String, nullable=False, index=True)
+    removed_by = Column(String, nullable=False)
+    removed_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+# Full-text search structures for each searchable column, created with its table.
+# SQLite gets an FTS5 external-content table over the rowid, which
+# ClinicalSearchService keeps in sync on insert; PostgreSQL gets a GIN expression
+# index that the database maintains itself.
+FULL_TEXT_COLUMNS = {
+    'clinical_notes': 'note_text',
+    'diagnoses': 'description'
+}
+
+def full_text_ddl(table_name: str, dialect: str) -> list:
+    """Statements creating the full-text structure for a table on a dialect"""
+    column = FULL_TEXT_COLUMNS[table_name]
+    if dialect == 'sqlite':
+        return [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {table_name}_fts USING fts5("
+            f"{column}, content='{table_name}', tokenize='porter unicode61')"
+        ]
+    if dialect == 'postgresql':
+        return [
+            f"CREATE INDEX IF NOT EXISTS ix_{table_name}_{column}_fts ON {table_name} "
+            f"USING gin (to_tsvector('english', {column}))"
+        ]
+    return []
+
+for _table in (ClinicalNote.__table__, Diagnosis.__table__):
+    for _dialect in ('sqlite', 'postgresql'):
+        for _statement in full_text_ddl(_table.name, _dialect):
+            event.listen(_table, 'after_create', DDL(_statement).execute_if(dialect=_dialect))
+    event.listen(_table, 'before_drop', DDL(f"DROP TABLE IF EXISTS {_table.name}_fts").execute_if(dialect='sqlite'))
@@ -0,0 +1,26 @@
+"""Transactional outbox models"""
+from sqlalchemy import Column, Integer, String, DateTime, Text, Index
+from sqlalchemy.sql import func
+from app.models import Base
+
+class OutboxEvent(Base):
+    """Domain event written in the same transaction as the change it describes"""
+    __tablename__ = "outbox_events"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    aggregate_type = Column(String, nullable=False)
+    aggregate_id = Column(String, nullable=False)
+    event_type = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)
+    created_at = Column(DateTime, server_default=func.now(), nullable=False)
+    published_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(String, nullable=True)
+    # Lease held by the relay delivering the event; sinks are called outside any transaction
+    claimed_until = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        # Relay polls unpublished events in insertion order
+        Index('ix_outbox_events_published_at_id', 'published_at', 'id'),
+        Index('ix_outbox_events_aggregate', 'aggregate_type', 'aggregate_id', 'id'),
+    )
@@ -1,5 +1,5 @@
 """Prescription models"""
-from sqlalchemy import Column, String, DateTime, ForeignKey, Integer, Numeric, Enum
+from sqlalchemy import Column, String, DateTime, ForeignKey, Integer, Numeric, Enum, Index, UniqueConstraint
 from sqlalchemy.sql import func
 from datetime import datetime
 import enum
@@ -12,6 +12,13 @@ class PrescriptionStatus(str, enum.Enum):
     EXPIRED = "expired"
     CANCELLED = "cancelled"
 
+class InteractionSeverity(str, enum.Enum):
+    """Drug interaction severity enumeration, mildest first"""
+    MINOR = "minor"
+    MODERATE = "moderate"
+    MAJOR = "major"
+    CONTRAINDICATED = "contraindicated"
+
 class Prescription(Base):
     """Prescription model"""
     __tablename__ = "prescriptions"
@@ -24,8 +31,19 @@ class Prescription(Base):
     frequency = Column(String, nullable=False)
     duration = Column(String, nullable=False)
     status = Column(Enum(PrescriptionStatus), default=PrescriptionStatus.ACTIVE, nullable=False)
+    # Parsed from duration at write time; NULL when the duration has no fixed length
+    expires_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+    
+    __table_args__ = (
+        # The expiry sweep range-scans active prescriptions by expiry
+        Index('ix_prescriptions_status_expires_at', 'status', 'expires_at'),
+        # Patient history filtered by status, read newest first with an id tie-break for keyset paging
+        Index('ix_prescriptions_patient_id_status_created_at', 'patient_id', 'status', 'created_at', 'id'),
+        # Cohort prescription filters read the patients on a medication by status
+        Index('ix_prescriptions_medication_id_status', 'medication_id', 'status', 'patient_id'),
+    )
 
 class PrescriptionItem(Base):
     """Prescription item model"""
@@ -37,3 +55,19 @@ class PrescriptionItem(Base):
     quantity = Column(Integer, nullable=False)
     unit_price = Column(Numeric(10, 2), nullable=False)
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+class DrugInteraction(Base):
+    """Known interaction between two medications, stored once per unordered pair"""
+    __tablename__ = "drug_interactions"
+    
+    id = Column(String, primary_key=True, index=True)
+    # medication_a_id sorts before medication_b_id
+    medication_a_id = Column(String, ForeignKey("inventory_items.id"), nullable=False)
+    medication_b_id = Column(String, ForeignKey("inventory_items.id"), nullable=False)
+    severity = Column(Enum(InteractionSeverity), nullable=False)
+    description = Column(String, nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+    
+    __table_args__ = (
+        UniqueConstraint('medication_a_id', 'medication_b_id', name='uq_drug_interactions_pair'),
+    )
@@ -0,0 +1,35 @@
+"""Keyset pagination helpers"""
+import base64
+from datetime import datetime
+from typing import Optional, Tuple
+from sqlalchemy import and_, or_
+
+def encode_cursor(created_at: datetime, row_id: str) -> str:
+    """Encode the sort key of the last row on a page as an opaque cursor"""
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        created_at, row_id = raw.split('|', 1)
+        return datetime.fromisoformat(created_at), row_id
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid pagination cursor: {cursor}")
+
+def keyset_before(created_column, id_column, cursor: Optional[str]):
+    """Filter for rows after the cursor in (created_at DESC, id DESC) order, or None"""
+    if not cursor:
+        return None
+    created_at, row_id = decode_cursor(cursor)
+    return or_(
+        created_column < created_at,
+        and_(created_column == created_at, id_column < row_id)
+    )
+
+def clamp_limit(limit: Optional[int], default: int, maximum: int) -> int:
+    """Bound a requested page size"""
+    if not limit or limit < 1:
+        return default
+    return min(limit, maximum)
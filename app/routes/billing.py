@@ -1,11 +1,18 @@
 """Billing and payment routes"""
-from fastapi import APIRouter, Depends, HTTPException, status
+import csv
+import io
+from fastapi import APIRouter, Depends, File, Header, HTTPException, UploadFile, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from datetime import datetime
 from decimal import Decimal
-from typing import List
+from typing import List, Optional
 from sqlalchemy.orm import Session
 from app.database import get_db
+from app.exceptions import ConflictError
+from app.models.billing import PaymentStatus
 from app.services.billing_service import BillingService
+from app.services.remittance_service import RemittanceService
 
 router = APIRouter(prefix="/billing", tags=["billing"])
 
@@ -20,6 +27,7 @@ class BillingRecordCreate(BaseModel):
     """Billing record creation schema"""
     patient_id: str
     items: List[BillingItemCreate]
+    department_id: Optional[str] = None
 
 class PaymentCreate(BaseModel):
     """Payment creation schema"""
@@ -27,17 +35,58 @@ class PaymentCreate(BaseModel):
     amount: Decimal
     payment_method: str
 
+class PaymentResponse(BaseModel):
+    """Payment response schema, for new and replayed payments alike"""
+    id: str
+    billing_id: str
+    amount: Decimal
+    payment_method: str
+    status: PaymentStatus
+    created_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
 @router.post("")
 def create_billing_record(billing: BillingRecordCreate, db: Session = Depends(get_db)):
     """Create a billing record"""
     try:
         service = BillingService(db)
         items = [item.dict() for item in billing.items]
-        created = service.create_billing_record(billing.patient_id, items)
+        created = service.create_billing_record(billing.patient_id, items, billing.department_id)
         return created
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
+@router.get("/reports/aging")
+def get_aging_report(group_by: str = 'patient', refresh: bool = False, db: Session = Depends(get_db)):
+    """Get accounts-receivable aging report grouped by patient or department"""
+    try:
+        service = BillingService(db)
+        return service.get_aging_report(group_by, use_cache=not refresh)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.get("/reports/aging/detail")
+def get_aging_detail(db: Session = Depends(get_db)):
+    """Stream per-bill aging detail as CSV"""
+    service = BillingService(db)
+    fields = ['billing_id', 'patient_id', 'department_id', 'patient_responsibility', 'balance', 'created_at', 'age_days', 'bucket']
+    
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fields)
+        writer.writeheader()
+        for row in service.iter_aging_detail():
+            writer.writerow(row)
+            if buffer.tell() > 65536:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    
+    return StreamingResponse(generate(), media_type="text/csv")
+
 @router.get("/{billing_id}")
 def get_billing_record(billing_id: str, db: Session = Depends(get_db)):
     """Get billing record by ID"""
@@ -54,13 +103,44 @@ def get_patient_billing(patient_id: str, db: Session = Depends(get_db)):
     db_records = db.query(BillingRecord).filter(BillingRecord.patient_id == patient_id).all()
     return db_records
 
-@router.post("/payments")
-def process_payment(payment: PaymentCreate, db: Session = Depends(get_db)):
-    """Process a payment"""
+@router.get("/patient/{patient_id}/payments")
+def get_payment_history(patient_id: str, limit: Optional[int] = None, cursor: Optional[str] = None,
+                        start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                        db: Session = Depends(get_db)):
+    """Get a page of the patient's payment history, newest first"""
+    try:
+        service = BillingService(db)
+        return service.get_payment_history_page(patient_id, start_date, end_date, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.post("/payments", response_model=PaymentResponse)
+def process_payment(payment: PaymentCreate, db: Session = Depends(get_db),
+                    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")):
+    """Process a payment, replaying the stored result for a repeated Idempotency-Key"""
     try:
         service = BillingService(db)
+        if idempotency_key:
+            return service.process_payment_idempotent(
+                payment.billing_id, payment.amount, payment.payment_method, idempotency_key
+            )
         created = service.process_payment(payment.billing_id, payment.amount, payment.payment_method)
         return created
+    except ConflictError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.post("/remittances")
+def ingest_remittance(file: UploadFile = File(...), file_format: Optional[str] = None,
+                      remittance_id: Optional[str] = None, db: Session = Depends(get_db)):
+    """Ingest an insurer remittance file (CSV or NDJSON); re-sending a file skips lines already posted"""
+    if not file_format:
+        file_format = 'ndjson' if (file.filename or '').lower().endswith(('.ndjson', '.jsonl')) else 'csv'
+    try:
+        service = RemittanceService(db)
+        stream = io.TextIOWrapper(file.file, encoding='utf-8', newline='')
+        return service.ingest(stream, file_format, remittance_id=remittance_id)
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
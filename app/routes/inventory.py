@@ -1,12 +1,15 @@
 """Inventory management routes"""
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from pydantic import BaseModel
 from decimal import Decimal
-from datetime import date
+from datetime import date, datetime
 from typing import List, Optional
 from sqlalchemy.orm import Session
 from app.database import get_db
 from app.services.inventory_service import InventoryService
+from app.services.forecasting_service import ForecastingService
+from app.services.inventory_snapshot_service import InventorySnapshotService
+from app.services.inventory_expiry_service import InventoryExpiryService
 
 router = APIRouter(prefix="/inventory", tags=["inventory"])
 
@@ -17,8 +20,54 @@ class InventoryItemCreate(BaseModel):
     unit_cost: Decimal
     expiration_date: Optional[date] = None
     storage_location: str
+    category: Optional[str] = None
     min_threshold: Optional[int] = 10
 
+class ConsumeLine(BaseModel):
+    """Single item in a batch consumption"""
+    item_id: str
+    quantity: int
+
+class ConsumeBatchRequest(BaseModel):
+    """Batch consumption schema"""
+    items: List[ConsumeLine]
+    mode: str = 'all_or_nothing'
+    user_id: Optional[str] = None
+
+class InventoryLotCreate(BaseModel):
+    """Lot receipt schema"""
+    quantity: int
+    expiration_date: Optional[date] = None
+    lot_number: Optional[str] = None
+    user_id: Optional[str] = None
+
+class InventoryLotResponse(BaseModel):
+    """Inventory lot response schema"""
+    id: str
+    item_id: str
+    lot_number: Optional[str]
+    quantity: int
+    expiration_date: Optional[date]
+    
+    class Config:
+        from_attributes = True
+
+class StockTransferRequest(BaseModel):
+    """Stock transfer schema"""
+    from_location: str
+    to_location: str
+    quantity: int
+    user_id: Optional[str] = None
+
+class LocationStockResponse(BaseModel):
+    """Stock of one item at one location"""
+    item_id: str
+    location: str
+    quantity: int
+    
+    class Config:
+        from_attributes = True
+
 class InventoryItemResponse(BaseModel):
     """Inventory item response schema"""
     id: str
@@ -27,11 +76,18 @@ class InventoryItemResponse(BaseModel):
     unit_cost: Decimal
     expiration_date: Optional[date]
     storage_location: str
+    category: Optional[str] = None
     min_threshold: int
+    shard_count: int = 0
     
     class Config:
         from_attributes = True
 
+class InventoryItemPage(BaseModel):
+    """One page of inventory items"""
+    items: List[InventoryItemResponse]
+    next_after_id: Optional[str]
+
 @router.post("", response_model=InventoryItemResponse, status_code=status.HTTP_201_CREATED)
 def add_inventory_item(item: InventoryItemCreate, db: Session = Depends(get_db)):
     """Add inventory item"""
@@ -42,6 +98,99 @@ def add_inventory_item(item: InventoryItemCreate, db: Session = Depends(get_db))
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
+@router.get("/low-stock", response_model=List[InventoryItemResponse])
+def get_low_stock_items(threshold: Optional[int] = None, db: Session = Depends(get_db)):
+    """Get low stock items"""
+    service = InventoryService(db)
+    items = service.get_low_stock_items(threshold)
+    return items
+
+@router.get("/expired", response_model=List[InventoryItemResponse])
+def get_expired_items(db: Session = Depends(get_db)):
+    """Get expired items"""
+    service = InventoryService(db)
+    items = service.get_expired_items()
+    return items
+
+@router.get("/expiring")
+def get_expiring_items(days: int = 30, db: Session = Depends(get_db)):
+    """Get items and lots expiring within the given number of days"""
+    try:
+        service = InventoryExpiryService(db)
+        return service.get_expiring_items(days)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.post("/expiry-sweep")
+def run_expiry_sweep(db: Session = Depends(get_db)):
+    """Quarantine expired stock and refresh the expiring-soon view"""
+    service = InventoryExpiryService(db)
+    return service.sweep()
+
+@router.get("/report")
+def get_inventory_report(refresh: bool = False, db: Session = Depends(get_db)):
+    """Get inventory summary with per-location and per-category breakdowns"""
+    service = InventoryService(db)
+    return service.get_inventory_report(use_cache=not refresh)
+
+@router.get("/report/items", response_model=InventoryItemPage)
+def get_inventory_report_items(
+    limit: int = Query(100, ge=1, le=1000),
+    after_id: Optional[str] = None,
+    storage_location: Optional[str] = None,
+    category: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Get inventory item detail one page at a time"""
+    service = InventoryService(db)
+    return service.get_inventory_items_page(limit, after_id, storage_location, category)
+
+@router.get("/locations")
+def get_location_totals(db: Session = Depends(get_db)):
+    """Get item count and units on hand per location"""
+    service = InventoryService(db)
+    return service.get_location_totals()
+
+@router.get("/locations/{location}")
+def get_location_stock(location: str, db: Session = Depends(get_db)):
+    """Get every item held at one location"""
+    service = InventoryService(db)
+    return service.get_location_stock(location)
+
+@router.get("/totals")
+def get_item_totals(name: str, db: Session = Depends(get_db)):
+    """Get facility-wide stock of items by name"""
+    service = InventoryService(db)
+    return service.get_item_totals(name)
+
+@router.get("/stock-as-of")
+def get_stock_as_of(as_of: datetime, item_id: Optional[List[str]] = Query(None), db: Session = Depends(get_db)):
+    """Get quantities on hand at a point in time (UTC)"""
+    service = InventorySnapshotService(db)
+    return {'as_of': as_of, 'stock': service.get_stock_as_of(as_of, item_id)}
+
+@router.post("/checkpoints", status_code=status.HTTP_201_CREATED)
+def take_checkpoint(db: Session = Depends(get_db)):
+    """Fold the transaction log into a new stock checkpoint"""
+    try:
+        service = InventorySnapshotService(db)
+        checkpoint = service.take_checkpoint()
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {'id': checkpoint.id, 'cutoff': checkpoint.cutoff, 'item_count': checkpoint.item_count}
+
+@router.get("/consistency")
+def check_consistency(db: Session = Depends(get_db)):
+    """Compare stock replayed from the transaction log with stored quantities"""
+    service = InventorySnapshotService(db)
+    return service.check_consistency()
+
+@router.post("/counters/compact")
+def compact_counters(db: Session = Depends(get_db)):
+    """Fold sharded counters back into item stock"""
+    service = InventoryService(db)
+    return {'items_compacted': service.compact_sharded_counters()}
+
 @router.get("/{item_id}", response_model=InventoryItemResponse)
 def get_inventory_item(item_id: str, db: Session = Depends(get_db)):
     """Get inventory item by ID"""
@@ -52,28 +201,116 @@ def get_inventory_item(item_id: str, db: Session = Depends(get_db)):
     return item
 
 @router.patch("/{item_id}/consume")
-def consume_inventory(item_id: str, quantity: int, db: Session = Depends(get_db)):
+def consume_inventory(item_id: str, quantity: int, location: Optional[str] = None, db: Session = Depends(get_db)):
     """Consume inventory"""
     try:
         service = InventoryService(db)
-        updated = service.consume_inventory(item_id, quantity)
+        updated = service.consume_inventory(item_id, quantity, location=location)
         return updated
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-@router.get("/low-stock", response_model=List[InventoryItemResponse])
-def get_low_stock_items(threshold: Optional[int] = None, db: Session = Depends(get_db)):
-    """Get low stock items"""
+@router.post("/consume-batch")
+def consume_batch(batch: ConsumeBatchRequest, db: Session = Depends(get_db)):
+    """Consume several inventory items in one transaction"""
+    try:
+        service = InventoryService(db)
+        report = service.consume_batch([line.dict() for line in batch.items], batch.mode, batch.user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if not report['committed']:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=report)
+    return report
+
+@router.post("/{item_id}/transfer", response_model=List[LocationStockResponse])
+def transfer_stock(item_id: str, transfer: StockTransferRequest, db: Session = Depends(get_db)):
+    """Move stock between locations"""
+    try:
+        service = InventoryService(db)
+        return service.transfer_stock(
+            item_id, transfer.from_location, transfer.to_location, transfer.quantity, transfer.user_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.get("/{item_id}/locations", response_model=List[LocationStockResponse])
+def get_item_locations(item_id: str, db: Session = Depends(get_db)):
+    """Get an item's stock at each location"""
     service = InventoryService(db)
-    items = service.get_low_stock_items(threshold)
-    return items
+    return service.get_item_locations(item_id)
 
-@router.get("/expired", response_model=List[InventoryItemResponse])
-def get_expired_items(db: Session = Depends(get_db)):
-    """Get expired items"""
+@router.post("/{item_id}/lots", response_model=InventoryLotResponse, status_code=status.HTTP_201_CREATED)
+def receive_lot(item_id: str, lot: InventoryLotCreate, db: Session = Depends(get_db)):
+    """Receive a shipment into a new lot"""
+    try:
+        service = InventoryService(db)
+        return service.receive_lot(item_id, lot.quantity, lot.expiration_date, lot.lot_number, lot.user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.post("/{item_id}/sharded-counter", response_model=InventoryItemResponse)
+def enable_sharded_counter(item_id: str, shards: Optional[int] = None, db: Session = Depends(get_db)):
+    """Split a hot item's stock across counter shards"""
+    try:
+        service = InventoryService(db)
+        return service.enable_sharded_counter(item_id, shards)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.delete("/{item_id}/sharded-counter", response_model=InventoryItemResponse)
+def disable_sharded_counter(item_id: str, db: Session = Depends(get_db)):
+    """Fold an item's counter shards back into its stock"""
+    try:
+        service = InventoryService(db)
+        return service.disable_sharded_counter(item_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.get("/{item_id}/available")
+def get_available_quantity(item_id: str, db: Session = Depends(get_db)):
+    """Get an item's current stock, including unfolded counter shards"""
+    try:
+        service = InventoryService(db)
+        return {'item_id': item_id, 'quantity': service.get_available_quantity(item_id)}
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+@router.get("/{item_id}/lots", response_model=List[InventoryLotResponse])
+def get_item_lots(item_id: str, include_empty: bool = False, db: Session = Depends(get_db)):
+    """Get an item's lots in first-expired-first-out order"""
     service = InventoryService(db)
-    items = service.get_expired_items()
-    return items
+    return service.get_item_lots(item_id, include_empty)
+
+@router.get("/{item_id}/allocation")
+def preview_allocation(item_id: str, quantity: int, db: Session = Depends(get_db)):
+    """Preview which lots a consumption would draw from"""
+    service = InventoryService(db)
+    allocations = service.allocate_fefo(item_id, quantity)
+    if allocations is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Insufficient unexpired lot stock: {item_id}")
+    return {'item_id': item_id, 'quantity': quantity, 'allocations': allocations}
+
+@router.get("/{item_id}/forecast")
+def forecast_item(item_id: str, method: str = 'ses', history_days: Optional[int] = None, db: Session = Depends(get_db)):
+    """Get an item's demand forecast and suggested reorder point"""
+    if not InventoryService(db).get_inventory_item(item_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Inventory item not found")
+    try:
+        service = ForecastingService(db)
+        forecasts = list(service.forecast(history_days=history_days, method=method, item_ids=[item_id]))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return forecasts[0]
+
+@router.post("/reorder-points")
+def apply_reorder_points(method: str = 'ses', history_days: Optional[int] = None, dry_run: bool = False,
+                         db: Session = Depends(get_db)):
+    """Recompute reorder points from consumption history and store them as minimum thresholds"""
+    try:
+        service = ForecastingService(db)
+        return service.apply_reorder_points(history_days=history_days, method=method, dry_run=dry_run)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 @router.get("", response_model=List[InventoryItemResponse])
 def list_inventory(db: Session = Depends(get_db)):
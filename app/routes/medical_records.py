@@ -1,11 +1,16 @@
 """Medical records routes"""
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from datetime import datetime
-from typing import List
+from typing import Any, Dict, List, Optional
 from sqlalchemy.orm import Session
 from app.database import get_db
 from app.services.medical_record_service import MedicalRecordService
+from app.services.clinical_search_service import ClinicalSearchService
+from app.services.record_version_service import RecordVersionService
+from app.services.cohort_service import CohortService
+from app.services.diagnosis_code_service import DiagnosisCodeService
 
 router = APIRouter(prefix="/medical-records", tags=["medical-records"])
 
@@ -25,6 +30,155 @@ class ClinicalNoteCreate(BaseModel):
     """Clinical note creation schema"""
     note_text: str
 
+class DiagnosisResponse(BaseModel):
+    """Diagnosis response schema"""
+    id: str
+    diagnosis_code: str
+    description: str
+    date_recorded: datetime
+    
+    class Config:
+        from_attributes = True
+
+class TreatmentResponse(BaseModel):
+    """Treatment response schema"""
+    id: str
+    treatment_type: str
+    description: str
+    date_started: datetime
+    date_ended: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+class ClinicalNoteResponse(BaseModel):
+    """Clinical note response schema"""
+    id: str
+    note_text: str
+    created_by: str
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+class FullMedicalRecordResponse(BaseModel):
+    """Medical record with its diagnoses, treatments and notes"""
+    id: str
+    patient_id: str
+    created_by: str
+    version: int
+    created_at: datetime
+    updated_at: datetime
+    diagnoses: List[DiagnosisResponse] = []
+    treatments: List[TreatmentResponse] = []
+    clinical_notes: List[ClinicalNoteResponse] = []
+    
+    class Config:
+        from_attributes = True
+
+class CohortQuery(BaseModel):
+    """Cohort expression, e.g. {"and": [{"code": "E11.*"}, {"prescription": "..."}]}"""
+    expression: Dict[str, Any]
+
+class SearchResult(BaseModel):
+    """One matching note or diagnosis"""
+    kind: str
+    id: str
+    record_id: str
+    patient_id: str
+    recorded_at: datetime
+    score: float
+    snippet: str
+
+class SearchPage(BaseModel):
+    """One page of ranked search results"""
+    query: str
+    results: List[SearchResult]
+    next_offset: Optional[int] = None
+
+@router.get("/search", response_model=SearchPage)
+def search_medical_records(q: str, patient_id: Optional[str] = None, start_date: Optional[datetime] = None,
+                           end_date: Optional[datetime] = None, kind: Optional[List[str]] = Query(None),
+                           limit: Optional[int] = None, offset: int = 0, db: Session = Depends(get_db)):
+    """Search clinical notes and diagnoses, best match first"""
+    try:
+        service = ClinicalSearchService(db)
+        return service.search(q, patient_id, start_date, end_date, kind, limit, offset)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.post("/search/rebuild")
+def rebuild_search_index(db: Session = Depends(get_db)):
+    """Create missing search indexes and re-index every note and diagnosis"""
+    service = ClinicalSearchService(db)
+    return service.rebuild_index()
+
+@router.get("/diagnosis-codes")
+def search_diagnosis_codes(q: str, limit: Optional[int] = None):
+    """Autocomplete diagnosis codes by code prefix or description words"""
+    service = DiagnosisCodeService()
+    return service.search(q, limit)
+
+@router.get("/diagnosis-codes/stats")
+def get_diagnosis_code_stats():
+    """Get diagnosis code catalog size and memory footprint"""
+    service = DiagnosisCodeService()
+    return service.stats()
+
+@router.post("/diagnosis-codes/reload")
+def reload_diagnosis_codes():
+    """Reload the diagnosis code catalog from the configured file"""
+    try:
+        service = DiagnosisCodeService()
+        return service.load()
+    except (ValueError, OSError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.post("/cohorts/count")
+def count_cohort(query: CohortQuery, db: Session = Depends(get_db)):
+    """Count patients matching a cohort expression"""
+    try:
+        service = CohortService(db)
+        return service.count(query.expression)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.post("/cohorts/patients")
+def stream_cohort(query: CohortQuery, db: Session = Depends(get_db)):
+    """Stream the IDs of patients matching a cohort expression, one per line"""
+    service = CohortService(db)
+    try:
+        patient_ids = service.iter_patient_ids(query.expression)
+        first = next(patient_ids, None)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    def generate():
+        if first is None:
+            return
+        batch = [first]
+        for patient_id in patient_ids:
+            batch.append(patient_id)
+            if len(batch) >= 1000:
+                yield '\n'.join(batch) + '\n'
+                batch = []
+        if batch:
+            yield '\n'.join(batch) + '\n'
+    
+    return StreamingResponse(generate(), media_type="text/plain")
+
+@router.get("/cohorts/stats")
+def get_cohort_index_stats(db: Session = Depends(get_db)):
+    """Get the size of the cohort index"""
+    service = CohortService(db)
+    return service.stats()
+
+@router.post("/cohorts/rebuild")
+def rebuild_cohort_index(db: Session = Depends(get_db)):
+    """Rebuild the cohort index from the database"""
+    service = CohortService(db)
+    return service.rebuild()
+
 @router.get("/patient/{patient_id}")
 def get_patient_medical_record(patient_id: str, db: Session = Depends(get_db)):
     """Get patient's medical record"""
@@ -34,6 +188,15 @@ def get_patient_medical_record(patient_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Medical record not found")
     return record
 
+@router.get("/patient/{patient_id}/full", response_model=FullMedicalRecordResponse)
+def get_full_medical_record(patient_id: str, version: Optional[int] = None, db: Session = Depends(get_db)):
+    """Get patient's medical record with diagnoses, treatments and notes"""
+    service = MedicalRecordService(db)
+    record = service.get_full_record(patient_id, version)
+    if not record:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Medical record not found")
+    return record
+
 @router.post("/patient/{patient_id}/diagnoses")
 def add_diagnosis(patient_id: str, diagnosis: DiagnosisCreate, db: Session = Depends(get_db)):
     """Add diagnosis to medical record"""
@@ -76,3 +239,47 @@ def get_medical_record_history(patient_id: str, db: Session = Depends(get_db)):
     service = MedicalRecordService(db)
     history = service.get_record_history(patient_id)
     return history
+
+@router.get("/patient/{patient_id}/history/full", response_model=List[FullMedicalRecordResponse])
+def get_full_medical_record_history(patient_id: str, db: Session = Depends(get_db)):
+    """Get every medical record version with its diagnoses, treatments and notes"""
+    service = MedicalRecordService(db)
+    return service.get_full_record_history(patient_id)
+
+
+@router.post("/patient/{patient_id}/versions", status_code=status.HTTP_201_CREATED)
+def create_medical_record_version(patient_id: str, user_id: str, db: Session = Depends(get_db)):
+    """Start a new medical record version"""
+    try:
+        service = RecordVersionService(db)
+        return service.create_version(patient_id, user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.get("/patient/{patient_id}/versions/{version}")
+def get_medical_record_version(patient_id: str, version: int, db: Session = Depends(get_db)):
+    """Get the full contents of a medical record version"""
+    try:
+        service = RecordVersionService(db)
+        return service.get_version(patient_id, version)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+@router.get("/patient/{patient_id}/diff")
+def diff_medical_record_versions(patient_id: str, from_version: int, to_version: int, db: Session = Depends(get_db)):
+    """Get entries added and removed between two medical record versions"""
+    try:
+        service = RecordVersionService(db)
+        return service.diff_versions(patient_id, from_version, to_version)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+
+@router.delete("/patient/{patient_id}/entries/{entry_type}/{entry_id}")
+def remove_medical_record_entry(patient_id: str, entry_type: str, entry_id: str, user_id: str,
+                                db: Session = Depends(get_db)):
+    """Remove a diagnosis, treatment or note from the latest version onwards"""
+    try:
+        service = RecordVersionService(db)
+        return service.remove_entry(patient_id, entry_type, entry_id, user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
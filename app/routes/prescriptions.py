@@ -1,13 +1,22 @@
 """Prescription management routes"""
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from pydantic import BaseModel
-from typing import List
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Optional
 from sqlalchemy.orm import Session
 from app.database import get_db
 from app.services.prescription_service import PrescriptionService
+from app.services.interaction_service import DrugInteractionService
 
 router = APIRouter(prefix="/prescriptions", tags=["prescriptions"])
 
+class PrescriptionItemCreate(BaseModel):
+    """Dispensable prescription item schema"""
+    medication_id: Optional[str] = None
+    quantity: int
+    unit_price: Optional[Decimal] = None
+
 class PrescriptionCreate(BaseModel):
     """Prescription creation schema"""
     patient_id: str
@@ -16,6 +25,38 @@ class PrescriptionCreate(BaseModel):
     dosage: str
     frequency: str
     duration: str
+    items: List[PrescriptionItemCreate] = []
+
+class DispenseRequest(BaseModel):
+    """Prescription dispense schema"""
+    user_id: Optional[str] = None
+    department_id: Optional[str] = None
+
+class DispenseBatchRequest(DispenseRequest):
+    """Batch dispense schema for ward medication rounds"""
+    prescription_ids: List[str]
+
+class MedicationValidationRequest(BaseModel):
+    """Bulk medication validation schema"""
+    medication_ids: List[str]
+
+class InteractionCreate(BaseModel):
+    """Drug interaction creation schema"""
+    medication_a_id: str
+    medication_b_id: str
+    severity: str
+    description: str
+
+class InteractionWarning(BaseModel):
+    """Interaction found between two medications"""
+    medication_id: str
+    interacts_with: str
+    severity: str
+    description: str
+
+class PatientListRequest(BaseModel):
+    """Patients to look up together, e.g. a ward list"""
+    patient_ids: List[str]
 
 class PrescriptionResponse(BaseModel):
     """Prescription response schema"""
@@ -27,10 +68,19 @@ class PrescriptionResponse(BaseModel):
     frequency: str
     duration: str
     status: str
+    expires_at: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+    interaction_warnings: List[InteractionWarning] = []
     
     class Config:
         from_attributes = True
 
+class PrescriptionPage(BaseModel):
+    """One page of a patient's prescriptions"""
+    patient_id: str
+    prescriptions: List[PrescriptionResponse]
+    next_cursor: Optional[str] = None
+
 @router.post("", response_model=PrescriptionResponse, status_code=status.HTTP_201_CREATED)
 def create_prescription(prescription: PrescriptionCreate, db: Session = Depends(get_db)):
     """Create a prescription"""
@@ -41,6 +91,67 @@ def create_prescription(prescription: PrescriptionCreate, db: Session = Depends(
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
+@router.post("/validate-medications")
+def validate_medications(request: MedicationValidationRequest, db: Session = Depends(get_db)):
+    """Check which medication IDs exist"""
+    service = PrescriptionService(db)
+    return service.validate_medications(request.medication_ids)
+
+@router.post("/expire")
+def expire_prescriptions(db: Session = Depends(get_db)):
+    """Expire active prescriptions whose duration has run out"""
+    service = PrescriptionService(db)
+    return {'expired': service.expire_prescriptions()}
+
+@router.post("/active", response_model=Dict[str, List[PrescriptionResponse]])
+def get_active_prescriptions_for_patients(request: PatientListRequest, db: Session = Depends(get_db)):
+    """Get active prescriptions for many patients with one query"""
+    service = PrescriptionService(db)
+    return service.get_active_prescriptions_for_patients(request.patient_ids)
+
+@router.post("/dispense-batch")
+def dispense_prescriptions(batch: DispenseBatchRequest, db: Session = Depends(get_db)):
+    """Dispense several prescriptions in one transaction"""
+    try:
+        service = PrescriptionService(db)
+        return service.dispense_prescriptions(batch.prescription_ids, batch.user_id, batch.department_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.post("/{prescription_id}/dispense")
+def dispense_prescription(prescription_id: str, request: DispenseRequest = DispenseRequest(),
+                          db: Session = Depends(get_db)):
+    """Fill a prescription: decrement stock, bill it and mark it filled"""
+    try:
+        service = PrescriptionService(db)
+        return service.dispense_prescription(prescription_id, request.user_id, request.department_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.post("/interactions", status_code=status.HTTP_201_CREATED)
+def add_interaction(interaction: InteractionCreate, db: Session = Depends(get_db)):
+    """Record a drug-drug interaction"""
+    try:
+        service = DrugInteractionService(db)
+        created = service.add_interaction(
+            interaction.medication_a_id, interaction.medication_b_id, interaction.severity, interaction.description
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {'id': created.id, 'severity': created.severity.value}
+
+@router.post("/interactions/check", response_model=List[InteractionWarning])
+def check_interactions(request: MedicationValidationRequest, db: Session = Depends(get_db)):
+    """Check a whole medication list for interactions, e.g. at admission"""
+    service = DrugInteractionService(db)
+    return service.check_medication_list(request.medication_ids)
+
+@router.get("/patient/{patient_id}/interactions", response_model=List[InteractionWarning])
+def check_patient_interactions(patient_id: str, medication_id: str, db: Session = Depends(get_db)):
+    """Check a medication against a patient's active prescriptions"""
+    service = DrugInteractionService(db)
+    return service.check_new_medication(patient_id, medication_id)
+
 @router.get("/{prescription_id}", response_model=PrescriptionResponse)
 def get_prescription(prescription_id: str, db: Session = Depends(get_db)):
     """Get prescription by ID"""
@@ -57,6 +168,24 @@ def get_patient_prescriptions(patient_id: str, db: Session = Depends(get_db)):
     prescriptions = service.get_patient_prescriptions(patient_id)
     return prescriptions
 
+@router.get("/patient/{patient_id}/history", response_model=PrescriptionPage)
+def get_prescription_history(patient_id: str, status_filter: Optional[List[str]] = Query(None, alias="status"),
+                             start_date: Optional[datetime] = None, end_date: Optional[datetime] = None,
+                             limit: Optional[int] = None, cursor: Optional[str] = None,
+                             db: Session = Depends(get_db)):
+    """Get a page of the patient's prescriptions, newest first"""
+    try:
+        service = PrescriptionService(db)
+        return service.get_prescriptions_page(patient_id, status_filter, start_date, end_date, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+@router.get("/patient/{patient_id}/active", response_model=List[PrescriptionResponse])
+def get_active_prescriptions(patient_id: str, db: Session = Depends(get_db)):
+    """Get patient's active, unexpired prescriptions"""
+    service = PrescriptionService(db)
+    return service.get_active_prescriptions(patient_id)
+
 @router.patch("/{prescription_id}/status")
 def update_prescription_status(prescription_id: str, status: str, db: Session = Depends(get_db)):
     """Update prescription status"""
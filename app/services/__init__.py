@@ -1,6 +1,10 @@
 """Services package"""
 from app.services.patient_service import PatientService
 from app.services.medical_record_service import MedicalRecordService
+from app.services.clinical_search_service import ClinicalSearchService
+from app.services.record_version_service import RecordVersionService
+from app.services.cohort_service import CohortService
+from app.services.diagnosis_code_service import DiagnosisCodeService
 from app.services.appointment_service import AppointmentService
 from app.services.staff_service import StaffService
 from app.services.prescription_service import PrescriptionService
@@ -8,15 +12,36 @@ from app.services.billing_service import BillingService
 from app.services.inventory_service import InventoryService
 from app.services.department_service import DepartmentService
 from app.services.access_control_service import AccessControlService
+from app.services.idempotency_service import IdempotencyService
+from app.services.remittance_service import RemittanceService
+from app.services.outbox_service import OutboxService, OutboxRelay
+from app.services.forecasting_service import ForecastingService
+from app.services.inventory_snapshot_service import InventorySnapshotService
+from app.services.inventory_expiry_service import InventoryExpiryService
+from app.services.medication_catalog_service import MedicationCatalogService
+from app.services.interaction_service import DrugInteractionService
 
 __all__ = [
     'PatientService',
     'MedicalRecordService',
+    'ClinicalSearchService',
+    'RecordVersionService',
+    'CohortService',
+    'DiagnosisCodeService',
     'AppointmentService',
     'StaffService',
     'PrescriptionService',
     'BillingService',
     'InventoryService',
     'DepartmentService',
-    'AccessControlService'
+    'AccessControlService',
+    'IdempotencyService',
+    'RemittanceService',
+    'OutboxService',
+    'OutboxRelay',
+    'ForecastingService',
+    'InventorySnapshotService',
+    'InventoryExpiryService',
+    'MedicationCatalogService',
+    'DrugInteractionService'
 ]
@@ -5,6 +5,7 @@ from typing import List, Optional
 from sqlalchemy.orm import Session
 from sqlalchemy import and_
 from app.models.appointment import Appointment, AppointmentSlot, AppointmentStatus
+from app.services.outbox_service import OutboxService
 import logging
 
 logger = logging.getLogger(__name__)
@@ -43,6 +44,7 @@ class AppointmentService:
         )
         
         self.db.add(appointment)
+        self._add_event(appointment, 'appointment.scheduled')
         self.db.commit()
         self.db.refresh(appointment)
         logger.info(f"Appointment scheduled: {appointment_id}")
@@ -82,6 +84,7 @@ class AppointmentService:
         
         appointment.status = AppointmentStatus.CANCELLED
         appointment.updated_at = datetime.utcnow()
+        self._add_event(appointment, 'appointment.cancelled')
         
         self.db.commit()
         self.db.refresh(appointment)
@@ -100,6 +103,7 @@ class AppointmentService:
         
         appointment.scheduled_time = new_time
         appointment.updated_at = datetime.utcnow()
+        self._add_event(appointment, 'appointment.rescheduled')
         
         self.db.commit()
         self.db.refresh(appointment)
@@ -129,3 +133,12 @@ class AppointmentService:
         ).first()
         
         return conflict is None
+    
+    def _add_event(self, appointment: Appointment, event_type: str):
+        """Record an appointment event in the current transaction"""
+        OutboxService(self.db).add_event('appointment', appointment.id, event_type, {
+            'patient_id': appointment.patient_id,
+            'doctor_id': appointment.doctor_id,
+            'scheduled_time': appointment.scheduled_time,
+            'status': appointment.status.value
+        })
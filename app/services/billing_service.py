@@ -1,22 +1,44 @@
 """Billing and payment processing service"""
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import List, Optional
+from typing import Iterator, List, Optional
+from sqlalchemy import case, func
 from sqlalchemy.orm import Session
+from app.cache import TTLCache
+from app.config import settings
+from app.pagination import encode_cursor, keyset_before, clamp_limit
 from app.models.billing import BillingRecord, BillingItem, Payment, BillingStatus, PaymentStatus
+from app.services.idempotency_service import IdempotencyService
+from app.services.outbox_service import OutboxService
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Aging buckets as (label, lower bound in days); a balance falls in the last bucket whose bound it reaches
+AGING_BUCKETS = [('0-30', 0), ('31-60', 31), ('61-90', 61), ('91-120', 91), ('120+', 121)]
+
+OUTSTANDING_STATUSES = (BillingStatus.PENDING, BillingStatus.FINALIZED)
+
+_aging_report_cache = TTLCache(settings.AGING_REPORT_CACHE_SECONDS, maxsize=64)
+
 class BillingService:
     """Service for billing and payment processing"""
     
     def __init__(self, db: Session):
         self.db = db
     
-    def create_billing_record(self, patient_id: str, items: List[dict]) -> BillingRecord:
+    def create_billing_record(self, patient_id: str, items: List[dict], department_id: str = None) -> BillingRecord:
         """Create a billing record"""
+        billing_record = self.stage_billing_record(patient_id, items, department_id)
+        
+        self.db.commit()
+        self.db.refresh(billing_record)
+        logger.info(f"Billing record created: {billing_record.id}")
+        return billing_record
+    
+    def stage_billing_record(self, patient_id: str, items: List[dict], department_id: str = None) -> BillingRecord:
+        """Add a billing record with its items and event to the caller's unit of work; the caller commits"""
         if not items:
             raise ValueError("Billing record must have at least one item")
         
@@ -33,6 +55,7 @@ class BillingService:
         billing_record = BillingRecord(
             id=billing_id,
             patient_id=patient_id,
+            department_id=department_id,
             total_amount=total_amount,
             insurance_coverage=insurance_coverage,
             patient_responsibility=patient_responsibility,
@@ -55,9 +78,13 @@ class BillingService:
             )
             self.db.add(billing_item)
         
-        self.db.commit()
-        self.db.refresh(billing_record)
-        logger.info(f"Billing record created: {billing_id}")
+        OutboxService(self.db).add_event('billing_record', billing_id, 'billing.created', {
+            'patient_id': patient_id,
+            'department_id': department_id,
+            'total_amount': total_amount,
+            'insurance_coverage': insurance_coverage,
+            'patient_responsibility': patient_responsibility
+        })
         return billing_record
     
     def get_billing_record(self, billing_id: str) -> Optional[BillingRecord]:
@@ -88,6 +115,40 @@ class BillingService:
     
     def process_payment(self, billing_id: str, amount: Decimal, payment_method: str) -> Payment:
         """Process a payment"""
+        payment = self._apply_payment(billing_id, amount, payment_method)
+        
+        self.db.commit()
+        self.db.refresh(payment)
+        logger.info(f"Payment processed: {payment.id}")
+        return payment
+    
+    def process_payment_idempotent(self, billing_id: str, amount: Decimal, payment_method: str,
+                                   idempotency_key: str) -> dict:
+        """Process a payment at most once per idempotency key"""
+        payload = {'billing_id': billing_id, 'amount': str(amount), 'payment_method': payment_method}
+        
+        def operation() -> dict:
+            payment = self._apply_payment(billing_id, amount, payment_method)
+            self.db.flush()
+            logger.info(f"Payment processed: {payment.id}")
+            return self.payment_to_dict(payment)
+        
+        return IdempotencyService(self.db).execute('billing.payments', idempotency_key, payload, operation)
+    
+    @staticmethod
+    def payment_to_dict(payment: Payment) -> dict:
+        """Serialize a payment for API responses"""
+        return {
+            'id': payment.id,
+            'billing_id': payment.billing_id,
+            'amount': str(payment.amount),
+            'payment_method': payment.payment_method,
+            'status': payment.status.value,
+            'created_at': payment.created_at.isoformat() if payment.created_at else None
+        }
+    
+    def _apply_payment(self, billing_id: str, amount: Decimal, payment_method: str) -> Payment:
+        """Add a payment and billing status change to the session without committing"""
         billing_record = self.get_billing_record(billing_id)
         if not billing_record:
             raise ValueError(f"Billing record not found: {billing_id}")
@@ -101,26 +162,69 @@ class BillingService:
             billing_id=billing_id,
             amount=amount,
             payment_method=payment_method,
-            status=PaymentStatus.COMPLETED
+            status=PaymentStatus.COMPLETED,
+            created_at=datetime.utcnow()
         )
         
         self.db.add(payment)
         
-        # Update billing record status if fully paid
-        if amount >= billing_record.patient_responsibility:
+        # Update billing record status once its payments cover the patient responsibility
+        paid = self.get_paid_totals([billing_id]).get(billing_id, Decimal('0'))
+        if paid + amount >= billing_record.patient_responsibility:
             billing_record.status = BillingStatus.PAID
         
-        self.db.commit()
-        self.db.refresh(payment)
-        logger.info(f"Payment processed: {payment_id}")
+        OutboxService(self.db).add_event('billing_record', billing_id, 'payment.completed', {
+            'payment_id': payment_id,
+            'amount': amount,
+            'payment_method': payment_method,
+            'billing_status': billing_record.status.value
+        })
+        
         return payment
     
-    def get_payment_history(self, patient_id: str) -> List[Payment]:
-        """Get payment history for a patient"""
-        payments = self.db.query(Payment).join(BillingRecord).filter(
+    def get_paid_totals(self, billing_ids) -> dict:
+        """Sum of completed payments per billing ID, in one grouped query"""
+        if not billing_ids:
+            return {}
+        rows = self.db.query(Payment.billing_id, func.sum(Payment.amount)).filter(
+            Payment.billing_id.in_(billing_ids),
+            Payment.status == PaymentStatus.COMPLETED
+        ).group_by(Payment.billing_id).all()
+        return {billing_id: Decimal(str(total)) for billing_id, total in rows}
+    
+    def get_payment_history(self, patient_id: str, start_date: datetime = None, end_date: datetime = None,
+                            limit: int = None, cursor: str = None) -> List[Payment]:
+        """Get payment history for a patient, newest first"""
+        query = self.db.query(Payment).join(BillingRecord).filter(
             BillingRecord.patient_id == patient_id
-        ).order_by(Payment.created_at.desc()).all()
-        return payments
+        )
+        if start_date:
+            query = query.filter(Payment.created_at >= start_date)
+        if end_date:
+            query = query.filter(Payment.created_at < end_date)
+        after_cursor = keyset_before(Payment.created_at, Payment.id, cursor)
+        if after_cursor is not None:
+            query = query.filter(after_cursor)
+        
+        query = query.order_by(Payment.created_at.desc(), Payment.id.desc())
+        if limit:
+            query = query.limit(limit)
+        return query.all()
+    
+    def get_payment_history_page(self, patient_id: str, start_date: datetime = None, end_date: datetime = None,
+                                 limit: int = None, cursor: str = None) -> dict:
+        """Get one page of a patient's payment history with a cursor for the next page"""
+        limit = clamp_limit(limit, settings.PAYMENT_HISTORY_PAGE_SIZE, settings.PAYMENT_HISTORY_MAX_PAGE_SIZE)
+        payments = self.get_payment_history(patient_id, start_date, end_date, limit + 1, cursor)
+        
+        has_more = len(payments) > limit
+        payments = payments[:limit]
+        next_cursor = encode_cursor(payments[-1].created_at, payments[-1].id) if has_more else None
+        return {
+            'patient_id': patient_id,
+            'payments': payments,
+            'next_cursor': next_cursor
+        }
     
     def calculate_charges(self, services: List[dict]) -> dict:
         """Calculate charges for services"""
@@ -147,7 +251,137 @@ class BillingService:
         billing_record.status = BillingStatus.FINALIZED
         billing_record.updated_at = datetime.utcnow()
         
+        OutboxService(self.db).add_event('billing_record', billing_id, 'billing.finalized', {
+            'patient_id': billing_record.patient_id
+        })
+        
         self.db.commit()
         self.db.refresh(billing_record)
         logger.info(f"Billing record finalized: {billing_id}")
         return billing_record
+    
+    def get_aging_report(self, group_by: str = 'patient', as_of: datetime = None,
+                         use_cache: bool = True) -> dict:
+        """Get accounts-receivable aging of each bill's outstanding balance (responsibility less payments)"""
+        group_columns = {
+            'patient': BillingRecord.patient_id,
+            'department': BillingRecord.department_id
+        }
+        if group_by not in group_columns:
+            raise ValueError(f"Unsupported aging report grouping: {group_by}")
+        
+        cache_key = (group_by, as_of)
+        if use_cache and as_of is None:
+            cached = _aging_report_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        as_of = as_of or datetime.utcnow()
+        group_column = group_columns[group_by]
+        paid = self._paid_subquery(as_of)
+        balance = BillingRecord.patient_responsibility - func.coalesce(paid.c.paid, 0)
+        bucket_columns = [
+            func.coalesce(func.sum(case(
+                (self._aging_bucket_condition(index, as_of), balance),
+                else_=0
+            )), 0).label(f'bucket_{index}')
+            for index in range(len(AGING_BUCKETS))
+        ]
+        
+        rows = self.db.query(
+            group_column.label('group_key'),
+            func.count(BillingRecord.id).label('record_count'),
+            *bucket_columns
+        ).outerjoin(paid, paid.c.billing_id == BillingRecord.id).filter(
+            BillingRecord.status.in_(OUTSTANDING_STATUSES),
+            BillingRecord.created_at <= as_of,
+            balance > 0
+        ).group_by(group_column).all()
+        
+        totals = {label: Decimal('0') for label, _ in AGING_BUCKETS}
+        groups = []
+        for row in rows:
+            buckets = {
+                label: Decimal(str(getattr(row, f'bucket_{index}')))
+                for index, (label, _) in enumerate(AGING_BUCKETS)
+            }
+            for label, amount in buckets.items():
+                totals[label] += amount
+            groups.append({
+                f'{group_by}_id': row.group_key,
+                'record_count': row.record_count,
+                'buckets': buckets,
+                'total': sum(buckets.values(), Decimal('0'))
+            })
+        groups.sort(key=lambda group: group['total'], reverse=True)
+        
+        report = {
+            'as_of': as_of,
+            'group_by': group_by,
+            'totals': totals,
+            'total_outstanding': sum(totals.values(), Decimal('0')),
+            'groups': groups
+        }
+        if cache_key[1] is None:
+            _aging_report_cache.set(cache_key, report)
+        return report
+    
+    def iter_aging_detail(self, as_of: datetime = None, batch_size: int = 1000) -> Iterator[dict]:
+        """Stream outstanding billing records with their aging bucket, ordered by patient"""
+        as_of = as_of or datetime.utcnow()
+        paid = self._paid_subquery(as_of)
+        balance = BillingRecord.patient_responsibility - func.coalesce(paid.c.paid, 0)
+        query = self.db.query(
+            BillingRecord.id,
+            BillingRecord.patient_id,
+            BillingRecord.department_id,
+            BillingRecord.patient_responsibility,
+            balance.label('balance'),
+            BillingRecord.created_at
+        ).outerjoin(paid, paid.c.billing_id == BillingRecord.id).filter(
+            BillingRecord.status.in_(OUTSTANDING_STATUSES),
+            BillingRecord.created_at <= as_of,
+            balance > 0
+        ).order_by(BillingRecord.patient_id, BillingRecord.created_at).yield_per(batch_size)
+        
+        for row in query:
+            age_days = (as_of - row.created_at).days
+            yield {
+                'billing_id': row.id,
+                'patient_id': row.patient_id,
+                'department_id': row.department_id,
+                'patient_responsibility': row.patient_responsibility,
+                'balance': Decimal(str(row.balance)),
+                'created_at': row.created_at,
+                'age_days': age_days,
+                'bucket': self._aging_bucket_label(age_days)
+            }
+    
+    def _paid_subquery(self, as_of: datetime):
+        """Completed payments per billing record up to as_of"""
+        return self.db.query(
+            Payment.billing_id.label('billing_id'),
+            func.sum(Payment.amount).label('paid')
+        ).filter(
+            Payment.status == PaymentStatus.COMPLETED,
+            Payment.created_at <= as_of
+        ).group_by(Payment.billing_id).subquery()
+    
+    @staticmethod
+    def _aging_bucket_condition(index: int, as_of: datetime):
+        """SQL condition selecting records whose age falls in the indexed bucket"""
+        lower_days = AGING_BUCKETS[index][1]
+        condition = BillingRecord.created_at <= as_of - timedelta(days=lower_days)
+        if index + 1 < len(AGING_BUCKETS):
+            next_lower_days = AGING_BUCKETS[index + 1][1]
+            condition = condition & (BillingRecord.created_at > as_of - timedelta(days=next_lower_days))
+        return condition
+    
+    @staticmethod
+    def _aging_bucket_label(age_days: int) -> str:
+        """Aging bucket label for an age in days"""
+        label = AGING_BUCKETS[0][0]
+        for bucket_label, lower_days in AGING_BUCKETS:
+            if age_days >= lower_days:
+                label = bucket_label
+        return label
@@ -0,0 +1,178 @@
+"""Full-text search over clinical notes and diagnoses"""
+import re
+from datetime import datetime
+from typing import List
+from sqlalchemy import column, exists, func, literal, literal_column, select, table, text, union_all
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.pagination import clamp_limit
+from app.models.medical_record import (
+    MedicalRecord, MedicalRecordRemoval, Diagnosis, ClinicalNote, FULL_TEXT_COLUMNS, full_text_ddl
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+SEARCH_KINDS = ('note', 'diagnosis')
+SEARCH_TERM = re.compile(r"\w+", re.UNICODE)
+TEXT_SEARCH_CONFIG = literal_column("'english'")
+
+class ClinicalSearchService:
+    """Service for ranked full-text search of clinical notes and diagnosis descriptions
+
+    On SQLite each searchable table has an FTS5 external-content table keyed by
+    the source rowid. It stores only the index, and index_note/index_diagnosis
+    add each new row to it in the writer's transaction. On PostgreSQL a GIN index
+    on to_tsvector('english', ...) is maintained by the database and the same
+    expression is matched at query time. Both search paths require every term to
+    match and rank notes and diagnoses together.
+    """
+
+    SNIPPET_CHARS = 160
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    @property
+    def dialect(self) -> str:
+        """Name of the database dialect the session is bound to"""
+        return self.db.get_bind().dialect.name
+
+    def index_note(self, note: ClinicalNote):
+        """Add a flushed clinical note to the search index; the caller commits"""
+        self._index_row(ClinicalNote.__tablename__, note.id)
+
+    def index_diagnosis(self, diagnosis: Diagnosis):
+        """Add a flushed diagnosis to the search index; the caller commits"""
+        self._index_row(Diagnosis.__tablename__, diagnosis.id)
+
+    def search(self, query: str, patient_id: str = None, start_date: datetime = None,
+               end_date: datetime = None, kinds: List[str] = None, limit: int = None,
+               offset: int = 0) -> dict:
+        """Get one page of notes and diagnoses matching every term, best match first"""
+        terms = SEARCH_TERM.findall(query or '')
+        if not terms:
+            raise ValueError("Search query must contain at least one word")
+        kinds = kinds or list(SEARCH_KINDS)
+        unknown = [kind for kind in kinds if kind not in SEARCH_KINDS]
+        if unknown:
+            raise ValueError(f"Unknown search kind: {', '.join(unknown)}")
+        if offset < 0:
+            raise ValueError(f"Search offset must not be negative: {offset}")
+        limit = clamp_limit(limit, settings.CLINICAL_SEARCH_PAGE_SIZE, settings.CLINICAL_SEARCH_MAX_PAGE_SIZE)
+
+        sources = []
+        if 'note' in kinds:
+            sources.append(self._matches('note', ClinicalNote, ClinicalNote.note_text,
+                                         ClinicalNote.created_at, terms, patient_id, start_date, end_date))
+        if 'diagnosis' in kinds:
+            sources.append(self._matches('diagnosis', Diagnosis, Diagnosis.description,
+                                         Diagnosis.date_recorded, terms, patient_id, start_date, end_date))
+        matches = (union_all(*sources) if len(sources) > 1 else sources[0]).subquery()
+        rows = self.db.execute(
+            select(matches)
+            .order_by(matches.c.score.desc(), matches.c.recorded_at.desc(), matches.c.id)
+            .limit(limit + 1).offset(offset)
+        ).all()
+
+        has_more = len(rows) > limit
+        results = [
+            {
+                'kind': row.kind,
+                'id': row.id,
+                'record_id': row.record_id,
+                'patient_id': row.patient_id,
+                'recorded_at': row.recorded_at,
+                'score': float(row.score),
+                'snippet': self._snippet(row.body, terms)
+            }
+            for row in rows[:limit]
+        ]
+        return {
+            'query': query,
+            'results': results,
+            'next_offset': offset + limit if has_more else None
+        }
+
+    def rebuild_index(self) -> dict:
+        """Create any missing search structures and re-index every note and diagnosis
+
+        Also the backfill for databases created before search existed. On SQLite
+        run it after VACUUM, which may renumber the rowids the index is keyed by.
+        """
+        counts = {}
+        for table_name in FULL_TEXT_COLUMNS:
+            for statement in full_text_ddl(table_name, self.dialect):
+                self.db.execute(text(statement))
+            if self.dialect == 'sqlite':
+                # FTS5 re-reads the whole content table in one pass
+                self.db.execute(text(f"INSERT INTO {table_name}_fts({table_name}_fts) VALUES ('rebuild')"))
+            counts[table_name] = self.db.execute(text(f"SELECT count(*) FROM {table_name}")).scalar()
+        self.db.commit()
+        logger.info(f"Clinical search index rebuilt: {counts}")
+        return counts
+
+    def _index_row(self, table_name: str, row_id: str):
+        """Copy one source row into its FTS5 table; PostgreSQL indexes on write itself"""
+        if self.dialect != 'sqlite':
+            return
+        column_name = FULL_TEXT_COLUMNS[table_name]
+        self.db.execute(
+            text(
+                f"INSERT INTO {table_name}_fts(rowid, {column_name}) "
+                f"SELECT rowid, {column_name} FROM {table_name} WHERE id = :id"
+            ),
+            {'id': row_id}
+        )
+
+    def _matches(self, kind: str, model, body_column, time_column, terms: List[str],
+                 patient_id: str, start_date: datetime, end_date: datetime):
+        """Select of one source's matching rows with a score where higher is better"""
+        table_name = model.__tablename__
+        if self.dialect == 'sqlite':
+            fts = table(f"{table_name}_fts", column('rowid'))
+            fts_name = literal_column(fts.name)
+            # Quoted terms are matched literally, so user input cannot inject FTS5 syntax
+            match = fts_name.op('MATCH')(' '.join(f'"{term}"' for term in terms))
+            score = -func.bm25(fts_name)
+        else:
+            vector = func.to_tsvector(TEXT_SEARCH_CONFIG, body_column)
+            tsquery = func.plainto_tsquery(TEXT_SEARCH_CONFIG, ' '.join(terms))
+            match = vector.op('@@')(tsquery)
+            score = func.ts_rank(vector, tsquery)
+
+        query = select(
+            literal(kind).label('kind'),
+            model.id.label('id'),
+            model.record_id.label('record_id'),
+            MedicalRecord.patient_id.label('patient_id'),
+            time_column.label('recorded_at'),
+            score.label('score'),
+            body_column.label('body')
+        )
+        if self.dialect == 'sqlite':
+            query = query.select_from(fts).join(model, literal_column(f"{table_name}.rowid") == fts.c.rowid)
+        else:
+            query = query.select_from(model)
+        # Entries removed in a later record version are no longer part of the record
+        removed = exists().where(
+            MedicalRecordRemoval.entry_type == kind,
+            MedicalRecordRemoval.entry_id == model.id
+        )
+        query = query.join(MedicalRecord, MedicalRecord.id == model.record_id).where(match, ~removed)
+        if patient_id:
+            query = query.where(MedicalRecord.patient_id == patient_id)
+        if start_date:
+            query = query.where(time_column >= start_date)
+        if end_date:
+            query = query.where(time_column < end_date)
+        return query
+
+    def _snippet(self, body: str, terms: List[str]) -> str:
+        """Text around the first literal match of a term, or the start of the text"""
+        lowered = body.lower()
+        positions = [lowered.find(term.lower()) for term in terms]
+        first = min((position for position in positions if position >= 0), default=0)
+        start = max(first - self.SNIPPET_CHARS // 4, 0)
+        snippet = body[start:start + self.SNIPPET_CHARS]
+        return ('...' if start else '') + snippet + ('...' if start + self.SNIPPET_CHARS < len(body) else '')
@@ -0,0 +1,351 @@
+"""Diagnosis-code cohort queries over in-memory posting lists"""
+import bisect
+import threading
+import time
+from datetime import date, datetime
+from functools import reduce
+from typing import Iterator, List, Optional
+import numpy as np
+from sqlalchemy import exists, or_, select
+from sqlalchemy.orm import Session
+from app.bitmap import Bitmap
+from app.config import settings
+from app.models.medical_record import Diagnosis, MedicalRecord, MedicalRecordRemoval
+from app.models.patient import Patient
+from app.models.prescription import Prescription, PrescriptionStatus
+from app.services.diagnosis_code_service import normalize_code
+import logging
+
+logger = logging.getLogger(__name__)
+
+def diagnosis_key(diagnosis_id: str) -> int:
+    """Compact in-process key of a diagnosis, so a posting can tell whether the index already has it"""
+    return hash(diagnosis_id)
+
+class CohortIndex:
+    """Diagnosis postings for every patient, keyed by normalized code
+
+    Each code keeps the ordinals of its patients as a Bitmap for undated queries,
+    plus the ordinals and keys of every diagnosis sorted by day recorded, so a
+    date window is two binary searches. A prefix such as E11.* unions the codes in
+    its range of the sorted code list; undated prefix unions are memoized. An index
+    never changes once built: posted changes produce a new index that shares every
+    untouched posting, so lock-free queries always see one consistent index.
+    """
+
+    def __init__(self, patient_ids: List[str], postings: dict, ordinals: dict = None,
+                 codes: List[str] = None, universe: Bitmap = None, prefixes: dict = None):
+        self.patient_ids = patient_ids
+        self.ordinals = ordinals if ordinals is not None else {
+            patient_id: ordinal for ordinal, patient_id in enumerate(patient_ids)
+        }
+        self.codes = codes if codes is not None else sorted(postings)
+        self.postings = postings
+        self.universe = universe if universe is not None else Bitmap.from_range(len(patient_ids))
+        self._prefixes = prefixes if prefixes is not None else {}
+
+    def patients_with(self, pattern: str, start_date: Optional[date] = None,
+                      end_date: Optional[date] = None) -> Bitmap:
+        """Patients with a diagnosis matching a code or a prefix ending in *, optionally in [start, end)"""
+        is_prefix = pattern.strip().endswith('*')
+        code = normalize_code(pattern.strip().rstrip('*'))
+        if not code:
+            raise ValueError(f"Invalid diagnosis code pattern: {pattern}")
+        if is_prefix:
+            codes = self.codes[bisect.bisect_left(self.codes, code):bisect.bisect_left(self.codes, code + '\uffff')]
+        else:
+            codes = [code] if code in self.postings else []
+
+        if start_date is None and end_date is None:
+            if not is_prefix:
+                return self.postings[code][3] if codes else Bitmap()
+            union = self._prefixes.get(code)
+            if union is None:
+                union = self._prefixes[code] = Bitmap.union_all(self.postings[c][3] for c in codes)
+            return union
+
+        parts = []
+        for c in codes:
+            days, ordinals, _, _ = self.postings[c]
+            low = np.searchsorted(days, start_date.toordinal()) if start_date else 0
+            high = np.searchsorted(days, end_date.toordinal()) if end_date else len(days)
+            parts.append(ordinals[low:high])
+        return Bitmap.from_values(np.concatenate(parts)) if parts else Bitmap()
+
+    def with_changes(self, changes: list) -> 'CohortIndex':
+        """New index with posted diagnosis additions and removals applied
+
+        Postings are idempotent: an addition the index already has, or a removal of
+        a diagnosis it does not have, changes nothing. Only the postings of changed
+        codes are rebuilt, and the patient list is copied only for new patients.
+        """
+        patient_ids, ordinals, codes = self.patient_ids, self.ordinals, self.codes
+        postings = dict(self.postings)
+        changed = set()
+        for key, code, patient_id, day, added in changes:
+            code = normalize_code(code)
+            days, members, keys, bitmap = postings.get(code) or (
+                np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.int64), Bitmap()
+            )
+            matches = np.flatnonzero(keys == key)
+            if added:
+                if len(matches):
+                    continue
+                ordinal = ordinals.get(patient_id)
+                if ordinal is None:
+                    if patient_ids is self.patient_ids:
+                        patient_ids, ordinals = list(patient_ids), dict(ordinals)
+                    ordinal = ordinals[patient_id] = len(patient_ids)
+                    patient_ids.append(patient_id)
+                position = np.searchsorted(days, day, side='right')
+                days = np.insert(days, position, day)
+                members = np.insert(members, position, ordinal)
+                keys = np.insert(keys, position, key)
+                bitmap = bitmap | Bitmap.from_values([ordinal])
+            else:
+                if not len(matches):
+                    continue
+                ordinal = members[matches[0]]
+                days = np.delete(days, matches[0])
+                members = np.delete(members, matches[0])
+                keys = np.delete(keys, matches[0])
+                if not (members == ordinal).any():
+                    bitmap = bitmap - Bitmap.from_values([ordinal])
+            if code not in postings:
+                codes = None
+            postings[code] = (days, members, keys, bitmap)
+            changed.add(code)
+
+        # Copied before filtering, since queries on this index may add to the memo meanwhile
+        prefixes = dict(self._prefixes)
+        prefixes = {
+            prefix: union for prefix, union in prefixes.items()
+            if not any(code.startswith(prefix) for code in changed)
+        }
+        return CohortIndex(
+            patient_ids, postings, ordinals, codes,
+            self.universe if patient_ids is self.patient_ids else None, prefixes
+        )
+
+    def ordinals_of(self, patient_ids) -> Bitmap:
+        """Bitmap of the patients the index knows about"""
+        return Bitmap.from_values([self.ordinals[p] for p in patient_ids if p in self.ordinals])
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate bytes held by the postings"""
+        return sum(
+            days.nbytes + ordinals.nbytes + keys.nbytes + bitmap.nbytes
+            for days, ordinals, keys, bitmap in self.postings.values()
+        )
+
+class _IndexState:
+    """Process-wide cohort index and when it was built"""
+
+    def __init__(self):
+        self.index = None
+        self.built_at = None
+        self.built_on = None
+        self.lock = threading.Lock()
+        # Diagnosis changes committed in this process and not yet applied to the index
+        self.pending = []
+        self.pending_lock = threading.Lock()
+
+_state = _IndexState()
+
+class CohortService:
+    """Service for population-health cohort queries by diagnosis code
+
+    Diagnoses are read once into an in-process CohortIndex and rebuilt when older
+    than COHORT_INDEX_REFRESH_SECONDS. Diagnoses added or removed through this
+    process are posted to the index as they commit; changes made by other
+    processes show up within the refresh interval. While one caller rebuilds,
+    others keep querying the previous index. A query is a JSON expression tree:
+
+        {"and": [...]}, {"or": [...]}, {"not": expr}
+        {"code": "E11.*", "start_date": "2024-01-01", "end_date": "2025-01-01"}
+        {"prescription": "<medication_id>"}   patients with it active and unexpired
+
+    Codes and boolean operators are evaluated on bitmaps in memory; each
+    prescription filter is one indexed query.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def count(self, expression: dict) -> dict:
+        """Number of patients in a cohort"""
+        started = time.perf_counter()
+        cohort = self._evaluate(self._index(), expression)
+        return {
+            'count': len(cohort),
+            'index_built_at': _state.built_on,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 3)
+        }
+
+    def iter_patient_ids(self, expression: dict) -> Iterator[str]:
+        """Patient IDs in a cohort"""
+        index = self._index()
+        cohort = self._evaluate(index, expression)
+        patient_ids = index.patient_ids
+        for ordinal in cohort:
+            yield patient_ids[ordinal]
+
+    def post_diagnosis(self, diagnosis_id: str, patient_id: str, code: str, recorded: datetime, added: bool = True):
+        """Post a committed diagnosis addition or removal to this process's index"""
+        with _state.pending_lock:
+            _state.pending.append((diagnosis_key(diagnosis_id), code, patient_id, recorded.toordinal(), added))
+        self._apply_pending()
+
+    def rebuild(self) -> dict:
+        """Build a new index from the database and swap it in"""
+        with _state.lock:
+            return self._build()
+
+    def stats(self) -> dict:
+        """Size of the current index"""
+        index = self._index()
+        return {
+            'patients': len(index.patient_ids),
+            'codes': len(index.codes),
+            'bytes': index.nbytes,
+            'built_at': _state.built_on
+        }
+
+    def run_forever(self, stop_event: Optional[threading.Event] = None, interval: float = None):
+        """Rebuild the index on an interval until the stop event is set"""
+        stop_event = stop_event or threading.Event()
+        interval = settings.COHORT_INDEX_REFRESH_SECONDS if interval is None else interval
+        while not stop_event.is_set():
+            try:
+                self.rebuild()
+            except Exception as e:
+                self.db.rollback()
+                logger.error(f"Cohort index rebuild error: {e}")
+            stop_event.wait(interval)
+
+    def _index(self) -> CohortIndex:
+        """The current index, rebuilding it first if it is missing or stale"""
+        built_at = _state.built_at
+        if built_at is not None and time.monotonic() - built_at <= settings.COHORT_INDEX_REFRESH_SECONDS:
+            self._apply_pending()
+            return _state.index
+        # Only the first caller to notice rebuilds; the rest wait only when there is nothing to serve
+        if _state.lock.acquire(blocking=_state.index is None):
+            try:
+                if _state.built_at == built_at:
+                    self._build()
+            finally:
+                _state.lock.release()
+        return _state.index
+
+    @staticmethod
+    def _apply_pending():
+        """Apply posted changes unless a rebuild or another caller holds the index, which applies them instead"""
+        if _state.pending and _state.lock.acquire(blocking=False):
+            try:
+                CohortService._drain_pending()
+            finally:
+                _state.lock.release()
+
+    @staticmethod
+    def _drain_pending():
+        """Swap in an index with every posted change applied; the caller holds the lock"""
+        with _state.pending_lock:
+            changes, _state.pending = _state.pending, []
+        if changes and _state.index is not None:
+            _state.index = _state.index.with_changes(changes)
+
+    def _build(self) -> dict:
+        """Read every current diagnosis into a new index; the caller holds the lock"""
+        started = time.perf_counter()
+        # Changes posted so far committed before the read below, which includes them. Changes
+        # posted during the read may be in it too; postings are idempotent, so applying them after is safe
+        with _state.pending_lock:
+            _state.pending = []
+        patient_ids = list(self.db.execute(select(Patient.id).order_by(Patient.id)).scalars())
+        ordinals = {patient_id: ordinal for ordinal, patient_id in enumerate(patient_ids)}
+
+        removed = exists().where(
+            MedicalRecordRemoval.entry_type == 'diagnosis',
+            MedicalRecordRemoval.entry_id == Diagnosis.id
+        )
+        rows = self.db.execute(
+            select(Diagnosis.id, Diagnosis.diagnosis_code, MedicalRecord.patient_id, Diagnosis.date_recorded)
+            .join(MedicalRecord, MedicalRecord.id == Diagnosis.record_id)
+            .where(~removed)
+            .execution_options(yield_per=settings.COHORT_INDEX_BATCH_SIZE)
+        )
+
+        collected = {}
+        diagnoses = 0
+        for diagnosis_id, code, patient_id, recorded in rows:
+            ordinal = ordinals.get(patient_id)
+            if ordinal is None:
+                ordinal = ordinals[patient_id] = len(patient_ids)
+                patient_ids.append(patient_id)
+            days, members, keys = collected.setdefault(normalize_code(code), ([], [], []))
+            days.append(recorded.toordinal())
+            members.append(ordinal)
+            keys.append(diagnosis_key(diagnosis_id))
+            diagnoses += 1
+
+        postings = {}
+        for code, (days, members, keys) in collected.items():
+            days = np.asarray(days, dtype=np.int32)
+            members = np.asarray(members, dtype=np.uint32)
+            keys = np.asarray(keys, dtype=np.int64)
+            order = np.argsort(days, kind='stable')
+            postings[code] = (days[order], members[order], keys[order], Bitmap.from_values(members))
+
+        index = CohortIndex(patient_ids, postings)
+        _state.index = index
+        _state.built_at = time.monotonic()
+        _state.built_on = datetime.utcnow()
+        self._drain_pending()
+        logger.info(
+            f"Cohort index built: {diagnoses} diagnoses, {len(postings)} codes, {len(patient_ids)} patients "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+        return {'diagnoses': diagnoses, 'codes': len(postings), 'patients': len(patient_ids), 'bytes': index.nbytes}
+
+    def _evaluate(self, index: CohortIndex, expression) -> Bitmap:
+        """Bitmap of the patients matching an expression"""
+        if not isinstance(expression, dict) or len(expression.keys() & {'and', 'or', 'not', 'code', 'prescription'}) != 1:
+            raise ValueError(f"Invalid cohort expression: {expression}")
+
+        if 'and' in expression or 'or' in expression:
+            operands = expression.get('and', expression.get('or'))
+            if not isinstance(operands, list) or not operands:
+                raise ValueError(f"Cohort operator needs a non-empty list: {expression}")
+            bitmaps = [self._evaluate(index, operand) for operand in operands]
+            if 'and' in expression:
+                # Smallest first keeps every intermediate result small
+                bitmaps.sort(key=len)
+                return reduce(lambda left, right: left & right, bitmaps)
+            return Bitmap.union_all(bitmaps)
+        if 'not' in expression:
+            return index.universe - self._evaluate(index, expression['not'])
+        if 'code' in expression:
+            return index.patients_with(
+                str(expression['code']),
+                self._parse_date(expression.get('start_date')),
+                self._parse_date(expression.get('end_date'))
+            )
+        return index.ordinals_of(self.db.execute(
+            select(Prescription.patient_id).where(
+                Prescription.medication_id == expression['prescription'],
+                Prescription.status == PrescriptionStatus.ACTIVE,
+                or_(Prescription.expires_at.is_(None), Prescription.expires_at > datetime.utcnow())
+            ).distinct()
+        ).scalars())
+
+    @staticmethod
+    def _parse_date(value) -> Optional[date]:
+        """Date from an ISO string, or None"""
+        if value is None or isinstance(value, date):
+            return value
+        try:
+            return date.fromisoformat(str(value)[:10])
+        except ValueError:
+            raise ValueError(f"Invalid cohort date: {value}")
@@ -0,0 +1,238 @@
+"""Diagnosis code catalog with prefix and word autocomplete"""
+import bisect
+import csv
+import re
+import sys
+import threading
+import time
+from itertools import islice
+from typing import Iterable, List, Optional, TextIO
+from app.bitmap import Bitmap
+from app.config import settings
+from app.pagination import clamp_limit
+import logging
+
+logger = logging.getLogger(__name__)
+
+CODE_QUERY = re.compile(r"^\s*[A-Za-z][0-9]")
+WORD = re.compile(r"[a-z0-9]+")
+
+def normalize_code(code: str) -> str:
+    """Diagnosis code in index form: upper case without the dot, so E11.9 and e119 match"""
+    return code.strip().upper().replace('.', '')
+
+def display_code(code: str) -> str:
+    """ICD-10 code with its dot after the category, e.g. E119 -> E11.9"""
+    normalized = normalize_code(code)
+    return f"{normalized[:3]}.{normalized[3:]}" if len(normalized) > 3 else normalized
+
+class _TrieNode:
+    """Trie node: children by next character, and the catalog entry ending here or -1"""
+
+    __slots__ = ('children', 'entry')
+
+    def __init__(self):
+        self.children = None
+        self.entry = -1
+
+class DiagnosisCodeCatalog:
+    """Immutable in-memory diagnosis code catalog
+
+    Entries are numbered in ranking order, shortest description first, so the
+    most general terms come first. Codes are stored in a character trie whose
+    children are inserted in code order: a prefix lookup walks to the prefix node
+    and reads entries breadth first, so categories rank ahead of their subcodes.
+    Each description word has a Bitmap of the entries that use it. A word query
+    intersects those bitmaps, treating the last word as a prefix, and the first
+    entries of the result are already the best ranked.
+    """
+
+    def __init__(self, rows: Iterable[tuple]):
+        unique = {}
+        for code, description in rows:
+            normalized = normalize_code(code)
+            if normalized:
+                unique[normalized] = description.strip()
+        ranked = sorted(unique.items(), key=lambda item: (len(item[1]), item[0]))
+
+        self.codes = [normalized for normalized, _ in ranked]
+        self.descriptions = [description for _, description in ranked]
+        self.by_code = {normalized: entry for entry, normalized in enumerate(self.codes)}
+
+        self.root = _TrieNode()
+        for normalized in sorted(self.by_code):
+            node = self.root
+            for char in normalized:
+                if node.children is None:
+                    node.children = {}
+                child = node.children.get(char)
+                if child is None:
+                    child = node.children[char] = _TrieNode()
+                node = child
+            node.entry = self.by_code[normalized]
+
+        postings = {}
+        for entry, description in enumerate(self.descriptions):
+            for word in set(WORD.findall(description.lower())):
+                postings.setdefault(word, []).append(entry)
+        self.words = sorted(postings)
+        self.postings = {word: Bitmap.from_values(entries) for word, entries in postings.items()}
+        self.memory_bytes = self._memory_bytes()
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def lookup(self, code: str) -> Optional[dict]:
+        """Catalog entry for a code in any spelling, or None"""
+        entry = self.by_code.get(normalize_code(code))
+        return None if entry is None else self._entry(entry)
+
+    def search(self, query: str, limit: int) -> List[dict]:
+        """Codes starting with a code-like query, otherwise entries matching every word"""
+        if CODE_QUERY.match(query):
+            return self.prefix_search(query, limit)
+        return self.word_search(query, limit)
+
+    def prefix_search(self, prefix: str, limit: int) -> List[dict]:
+        """Codes starting with a prefix, shorter codes first"""
+        node = self.root
+        for char in normalize_code(prefix):
+            node = node.children.get(char) if node.children else None
+            if node is None:
+                return []
+
+        entries = []
+        level = [node]
+        while level and len(entries) < limit:
+            entries.extend(n.entry for n in level if n.entry >= 0)
+            level = [child for n in level if n.children for child in n.children.values()]
+        return [self._entry(entry) for entry in entries[:limit]]
+
+    def word_search(self, query: str, limit: int) -> List[dict]:
+        """Entries whose description has every word, the last one as a prefix, best ranked first"""
+        words = WORD.findall(query.lower())
+        if not words:
+            return []
+        *complete, partial = words
+        bitmaps = []
+        for word in complete:
+            bitmap = self.postings.get(word)
+            if bitmap is None:
+                return []
+            bitmaps.append(bitmap)
+        start = bisect.bisect_left(self.words, partial)
+        end = bisect.bisect_left(self.words, partial + '\uffff')
+        if start == end:
+            return []
+        bitmaps.append(Bitmap.union_all(self.postings[word] for word in self.words[start:end]))
+
+        bitmaps.sort(key=len)
+        matches = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            matches = matches & bitmap
+        return [self._entry(entry) for entry in islice(matches, limit)]
+
+    def _entry(self, entry: int) -> dict:
+        """Catalog entry as returned to callers"""
+        return {'code': display_code(self.codes[entry]), 'description': self.descriptions[entry]}
+
+    def _memory_bytes(self) -> int:
+        """Approximate bytes held by the trie, entries and word index"""
+        total = sum(sys.getsizeof(value) for value in (self.codes, self.descriptions, self.by_code, self.words, self.postings))
+        total += sum(sys.getsizeof(code) + sys.getsizeof(description)
+                     for code, description in zip(self.codes, self.descriptions))
+        total += sum(sys.getsizeof(word) + bitmap.nbytes for word, bitmap in self.postings.items())
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            total += sys.getsizeof(node)
+            if node.children:
+                total += sys.getsizeof(node.children)
+                stack.extend(node.children.values())
+        return total
+
+class _CatalogState:
+    """Process-wide diagnosis code catalog"""
+
+    def __init__(self):
+        self.catalog = None
+        self.loaded_at = None
+        # Set when the configured file could not be loaded, so lookups stop retrying until a reload
+        self.failed = False
+        self.lock = threading.Lock()
+
+_state = _CatalogState()
+
+class DiagnosisCodeService:
+    """Service for diagnosis code autocomplete and validation
+
+    The catalog is read from DIAGNOSIS_CODES_FILE, a CSV with code and
+    description columns, into a DiagnosisCodeCatalog at startup, on first use or
+    on reload. Lookups never touch the database. Without a configured file, or
+    when it cannot be read, there is no catalog: autocomplete returns nothing and
+    codes are accepted as entered.
+    """
+
+    CSV_FIELDS = ('code', 'description')
+
+    def catalog(self) -> Optional[DiagnosisCodeCatalog]:
+        """The loaded catalog, loading it on first use when a file is configured"""
+        if _state.catalog is None and settings.DIAGNOSIS_CODES_FILE and not _state.failed:
+            with _state.lock:
+                if _state.catalog is None and not _state.failed:
+                    try:
+                        self.load()
+                    except (ValueError, OSError) as e:
+                        _state.failed = True
+                        logger.error(f"Diagnosis code catalog not loaded, codes are not validated: {e}")
+        return _state.catalog
+
+    def load(self, stream: TextIO = None) -> dict:
+        """Build a catalog from a CSV stream or the configured file and swap it in"""
+        if stream is None:
+            if not settings.DIAGNOSIS_CODES_FILE:
+                raise ValueError("No diagnosis codes file configured")
+            with open(settings.DIAGNOSIS_CODES_FILE, newline='', encoding='utf-8') as handle:
+                return self.load(handle)
+
+        started = time.perf_counter()
+        reader = csv.DictReader(stream)
+        missing = [field for field in self.CSV_FIELDS if field not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"Diagnosis codes file is missing columns: {', '.join(missing)}")
+        catalog = DiagnosisCodeCatalog((row['code'], row['description'] or '') for row in reader)
+        _state.catalog = catalog
+        _state.loaded_at = time.time()
+        _state.failed = False
+
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(f"Diagnosis code catalog loaded: {len(catalog)} codes, {catalog.memory_bytes} bytes in {elapsed_ms}ms")
+        return {'codes': len(catalog), 'memory_bytes': catalog.memory_bytes, 'load_ms': elapsed_ms}
+
+    def search(self, query: str, limit: int = None) -> List[dict]:
+        """Autocomplete suggestions for a code prefix or description words"""
+        limit = clamp_limit(limit, settings.DIAGNOSIS_CODE_SEARCH_LIMIT, settings.DIAGNOSIS_CODE_SEARCH_MAX_LIMIT)
+        catalog = self.catalog()
+        if catalog is None or not query or not query.strip():
+            return []
+        return catalog.search(query, limit)
+
+    def validate(self, code: str) -> str:
+        """Catalog form of a code; codes are accepted as entered when no catalog is configured"""
+        catalog = self.catalog()
+        if catalog is None:
+            return code
+        found = catalog.lookup(code)
+        if found is None:
+            raise ValueError(f"Unknown diagnosis code: {code}")
+        return found['code']
+
+    def stats(self) -> dict:
+        """Size of the loaded catalog"""
+        catalog = self.catalog()
+        return {
+            'codes': len(catalog) if catalog else 0,
+            'words': len(catalog.words) if catalog else 0,
+            'memory_bytes': catalog.memory_bytes if catalog else 0,
+            'loaded_at': _state.loaded_at
+        }
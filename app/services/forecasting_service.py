@@ -0,0 +1,154 @@
+"""Consumption forecasting and reorder-point service"""
+import math
+from datetime import date, datetime, timedelta
+from typing import Iterator, List
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models.inventory import InventoryTransaction, InventoryTransactionType
+from app.services.inventory_service import InventoryService
+import logging
+
+logger = logging.getLogger(__name__)
+
+FORECAST_METHODS = ('sma', 'ses')
+
+class ForecastingService:
+    """Service for forecasting demand from the inventory transaction log
+
+    Daily CONSUME volumes are aggregated in the database and laid out as an
+    items x days matrix, one chunk of items at a time, so memory stays bounded
+    for any catalogue size and every statistic is a NumPy operation over the chunk.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def forecast(self, as_of: date = None, history_days: int = None, method: str = 'ses',
+                 item_ids: List[str] = None) -> Iterator[dict]:
+        """Yield demand forecast and reorder point for every item consumed in the history window"""
+        if method not in FORECAST_METHODS:
+            raise ValueError(f"Unsupported forecast method: {method}")
+        history_days = history_days or settings.FORECAST_HISTORY_DAYS
+        if history_days < 2:
+            raise ValueError("Forecast history must cover at least 2 days")
+        as_of = as_of or date.today()
+        start = as_of - timedelta(days=history_days)
+
+        consumed_ids = item_ids if item_ids is not None else self._consumed_item_ids(start, as_of)
+        chunk_size = settings.FORECAST_ITEM_CHUNK_SIZE
+        for offset in range(0, len(consumed_ids), chunk_size):
+            chunk = consumed_ids[offset:offset + chunk_size]
+            matrix = self._daily_consumption(chunk, start, as_of, history_days)
+            yield from self._forecast_chunk(chunk, matrix, method)
+
+    def apply_reorder_points(self, as_of: date = None, history_days: int = None,
+                             method: str = 'ses', dry_run: bool = False) -> dict:
+        """Write forecast reorder points back as min_threshold, one transaction per item chunk"""
+        summary = {'items_forecast': 0, 'thresholds_changed': 0, 'dry_run': dry_run}
+        inventory = InventoryService(self.db)
+
+        pending = {}
+        for suggestion in self.forecast(as_of, history_days, method):
+            summary['items_forecast'] += 1
+            pending[suggestion['item_id']] = suggestion['reorder_point']
+            if len(pending) >= settings.FORECAST_ITEM_CHUNK_SIZE:
+                summary['thresholds_changed'] += self._write_thresholds(inventory, pending, dry_run)
+                pending = {}
+        summary['thresholds_changed'] += self._write_thresholds(inventory, pending, dry_run)
+
+        logger.info(
+            f"Reorder points computed: {summary['items_forecast']} items, "
+            f"{summary['thresholds_changed']} thresholds changed (dry_run={dry_run})"
+        )
+        return summary
+
+    def _write_thresholds(self, inventory: InventoryService, pending: dict, dry_run: bool) -> int:
+        """Write the thresholds that differ from the stored ones; returns how many differ"""
+        if not pending:
+            return 0
+        current = inventory.get_min_thresholds(list(pending))
+        changed = {
+            item_id: threshold for item_id, threshold in pending.items()
+            if item_id in current and current[item_id] != threshold
+        }
+        if changed and not dry_run:
+            inventory.set_min_thresholds(changed)
+        return len(changed)
+
+    def _consumed_item_ids(self, start: date, end: date) -> List[str]:
+        """IDs of items with CONSUME transactions in [start, end)"""
+        rows = self.db.query(InventoryTransaction.item_id).filter(
+            InventoryTransaction.transaction_type == InventoryTransactionType.CONSUME,
+            InventoryTransaction.timestamp >= datetime.combine(start, datetime.min.time()),
+            InventoryTransaction.timestamp < datetime.combine(end, datetime.min.time())
+        ).distinct().order_by(InventoryTransaction.item_id).all()
+        return [row.item_id for row in rows]
+
+    def _daily_consumption(self, item_ids: List[str], start: date, end: date, days: int) -> np.ndarray:
+        """Build an items x days matrix of consumed units from a per-day GROUP BY"""
+        day = func.date(InventoryTransaction.timestamp)
+        # Run on the connection: ORM row processing costs more than the aggregation at this volume
+        rows = self.db.connection().execute(
+            select(InventoryTransaction.item_id, day, func.sum(InventoryTransaction.quantity))
+            .where(
+                InventoryTransaction.item_id.in_(item_ids),
+                InventoryTransaction.transaction_type == InventoryTransactionType.CONSUME,
+                InventoryTransaction.timestamp >= datetime.combine(start, datetime.min.time()),
+                InventoryTransaction.timestamp < datetime.combine(end, datetime.min.time())
+            )
+            .group_by(InventoryTransaction.item_id, day)
+        ).all()
+
+        matrix = np.zeros((len(item_ids), days), dtype=np.float64)
+        if not rows:
+            return matrix
+        row_items, row_days, row_units = zip(*rows)
+
+        item_index = {item_id: i for i, item_id in enumerate(item_ids)}
+        # SQLite returns the day as text, PostgreSQL as a date; convert only the distinct values
+        day_index = {
+            value: ((value if isinstance(value, date) else date.fromisoformat(str(value))) - start).days
+            for value in set(row_days)
+        }
+        rows_idx = np.fromiter((item_index[item_id] for item_id in row_items), dtype=np.int64, count=len(rows))
+        cols_idx = np.fromiter((day_index[value] for value in row_days), dtype=np.int64, count=len(rows))
+
+        np.add.at(matrix, (rows_idx, cols_idx), np.asarray(row_units, dtype=np.float64))
+        return matrix
+
+    def _forecast_chunk(self, item_ids: List[str], matrix: np.ndarray, method: str) -> Iterator[dict]:
+        """Vectorized demand, safety stock and reorder point for one chunk of items"""
+        window = min(settings.FORECAST_WINDOW_DAYS, matrix.shape[1])
+        recent = matrix[:, -window:]
+
+        if method == 'sma':
+            demand = recent.mean(axis=1)
+        else:
+            demand = matrix @ self._smoothing_weights(matrix.shape[1], settings.FORECAST_SMOOTHING_ALPHA)
+        demand_std = recent.std(axis=1, ddof=1)
+
+        lead_time = settings.FORECAST_LEAD_TIME_DAYS
+        safety_stock = settings.FORECAST_SERVICE_LEVEL_Z * demand_std * math.sqrt(lead_time)
+        # Round off float noise first so exact demand does not ceil up to the next unit
+        reorder_point = np.ceil(np.round(demand * lead_time + safety_stock, 6)).astype(np.int64)
+
+        for i, item_id in enumerate(item_ids):
+            yield {
+                'item_id': item_id,
+                'daily_demand': round(float(demand[i]), 3),
+                'demand_std': round(float(demand_std[i]), 3),
+                'safety_stock': round(float(safety_stock[i]), 3),
+                'reorder_point': int(reorder_point[i])
+            }
+
+    @staticmethod
+    def _smoothing_weights(days: int, alpha: float) -> np.ndarray:
+        """Weights that turn simple exponential smoothing over `days` observations into one dot product"""
+        if not 0 < alpha <= 1:
+            raise ValueError(f"Smoothing alpha must be in (0, 1]: {alpha}")
+        weights = alpha * (1 - alpha) ** np.arange(days - 1, -1, -1, dtype=np.float64)
+        # The first observation seeds the level and keeps the remaining weight
+        weights[0] = (1 - alpha) ** (days - 1)
+        return weights
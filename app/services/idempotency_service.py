@@ -0,0 +1,209 @@
+"""Idempotency key handling for retry-safe write operations"""
+import hashlib
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from app.cache import TTLCache
+from app.config import settings
+from app.exceptions import ConflictError
+from app.models.idempotency import IdempotencyRecord, IdempotencyStatus
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Completed responses shared by every session in this process
+_response_cache = TTLCache(settings.IDEMPOTENCY_TTL_SECONDS, settings.IDEMPOTENCY_CACHE_SIZE)
+
+# Striped locks so in-process duplicates of a key wait for the first request
+_LOCK_STRIPES = 256
+_key_locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+
+class IdempotencyService:
+    """Service for executing operations at most once per idempotency key"""
+
+    POLL_INTERVAL_SECONDS = 0.05
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def execute(self, scope: str, key: str, payload: dict, operation: Callable[[], dict]) -> dict:
+        """Run operation once for the key and return its stored response on retries
+
+        The operation must add its changes to the session without committing; they are
+        committed together with the stored response so a crash cannot leave a write
+        without its idempotency record. A claim left in progress by a crashed request
+        is taken over once it is older than IDEMPOTENCY_LEASE_SECONDS; the completion
+        is conditional on the claim token, so a request whose claim was taken over
+        rolls back instead of writing twice.
+        """
+        if not key:
+            raise ValueError("Idempotency key must not be empty")
+
+        request_hash = self._hash_payload(payload)
+        cached = _response_cache.get((scope, key))
+        if cached:
+            return self._check_replay(key, request_hash, cached)
+
+        with self._lock_for(scope, key):
+            cached = _response_cache.get((scope, key))
+            if cached:
+                return self._check_replay(key, request_hash, cached)
+
+            record = self._claim(scope, key, request_hash)
+            if record.status == IdempotencyStatus.COMPLETED:
+                return self._remember(scope, key, record)
+
+            claim_token = record.claim_token
+            try:
+                response = operation()
+                completed = self.db.execute(
+                    update(IdempotencyRecord)
+                    .where(
+                        IdempotencyRecord.scope == scope,
+                        IdempotencyRecord.key == key,
+                        IdempotencyRecord.claim_token == claim_token
+                    )
+                    .values(
+                        status=IdempotencyStatus.COMPLETED,
+                        response_body=json.dumps(response, default=str)
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                if completed.rowcount != 1:
+                    raise ConflictError(f"Idempotency claim was taken over by another request: {key}")
+                self.db.commit()
+            except Exception:
+                self.db.rollback()
+                self._release(scope, key, claim_token)
+                raise
+
+            record = self._get_record(scope, key)
+
+            logger.info(f"Idempotent request completed: {scope}/{key}")
+            return self._remember(scope, key, record)
+
+    def purge_expired(self) -> int:
+        """Delete expired idempotency records"""
+        deleted = self.db.query(IdempotencyRecord).filter(
+            IdempotencyRecord.expires_at < datetime.utcnow()
+        ).delete(synchronize_session=False)
+        self.db.commit()
+        logger.info(f"Expired idempotency keys purged: {deleted}")
+        return deleted
+
+    def _claim(self, scope: str, key: str, request_hash: str) -> IdempotencyRecord:
+        """Insert an in-progress record, or wait for the request that already owns the key"""
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            record = self._get_record(scope, key)
+            if record and record.expires_at < datetime.utcnow():
+                self.db.delete(record)
+                self.db.commit()
+                record = None
+
+            if record:
+                if record.request_hash != request_hash:
+                    raise ConflictError(f"Idempotency key reused with a different request: {key}")
+                if record.status == IdempotencyStatus.COMPLETED:
+                    return record
+                if self._lease_expired(record) and self._take_over(record):
+                    logger.warning(f"Stale idempotency claim taken over: {scope}/{key}")
+                    return record
+            else:
+                record = IdempotencyRecord(
+                    scope=scope,
+                    key=key,
+                    request_hash=request_hash,
+                    status=IdempotencyStatus.IN_PROGRESS,
+                    claimed_at=datetime.utcnow(),
+                    claim_token=str(uuid.uuid4()),
+                    expires_at=datetime.utcnow() + timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS)
+                )
+                self.db.add(record)
+                try:
+                    self.db.commit()
+                    return record
+                except IntegrityError:
+                    # Another process claimed the key first
+                    self.db.rollback()
+
+            if time.monotonic() >= deadline:
+                raise ConflictError(f"Request with idempotency key is still in progress: {key}")
+            time.sleep(self.POLL_INTERVAL_SECONDS)
+
+    def _take_over(self, record: IdempotencyRecord) -> bool:
+        """Claim a stale in-progress record, unless another retry got to it first"""
+        claimed_at = datetime.utcnow()
+        claim_token = str(uuid.uuid4())
+        taken = self.db.execute(
+            update(IdempotencyRecord)
+            .where(
+                IdempotencyRecord.scope == record.scope,
+                IdempotencyRecord.key == record.key,
+                IdempotencyRecord.status == IdempotencyStatus.IN_PROGRESS,
+                IdempotencyRecord.claim_token == record.claim_token
+            )
+            .values(claimed_at=claimed_at, claim_token=claim_token)
+            .execution_options(synchronize_session=False)
+        )
+        self.db.commit()
+        if taken.rowcount != 1:
+            return False
+        record.claimed_at = claimed_at
+        record.claim_token = claim_token
+        return True
+
+    def _release(self, scope: str, key: str, claim_token: str):
+        """Drop our in-progress claim so the request can be retried"""
+        self.db.query(IdempotencyRecord).filter(
+            IdempotencyRecord.scope == scope,
+            IdempotencyRecord.key == key,
+            IdempotencyRecord.status == IdempotencyStatus.IN_PROGRESS,
+            IdempotencyRecord.claim_token == claim_token
+        ).delete(synchronize_session=False)
+        self.db.commit()
+
+    @staticmethod
+    def _lease_expired(record: IdempotencyRecord) -> bool:
+        """Whether an in-progress claim is older than the lease"""
+        claimed_at = record.claimed_at or record.created_at
+        return claimed_at is None or \
+            claimed_at < datetime.utcnow() - timedelta(seconds=settings.IDEMPOTENCY_LEASE_SECONDS)
+
+    def _get_record(self, scope: str, key: str) -> Optional[IdempotencyRecord]:
+        """Get a fresh copy of the idempotency record"""
+        return self.db.query(IdempotencyRecord).populate_existing().filter(
+            IdempotencyRecord.scope == scope,
+            IdempotencyRecord.key == key
+        ).first()
+
+    def _remember(self, scope: str, key: str, record: IdempotencyRecord) -> dict:
+        """Cache a completed record and return its response"""
+        entry = {'request_hash': record.request_hash, 'response': json.loads(record.response_body)}
+        ttl = max((record.expires_at - datetime.utcnow()).total_seconds(), 0)
+        _response_cache.set((scope, key), entry, ttl)
+        return entry['response']
+
+    def _check_replay(self, key: str, request_hash: str, entry: dict) -> dict:
+        """Return a stored response if the retry matches the original request"""
+        if entry['request_hash'] != request_hash:
+            raise ConflictError(f"Idempotency key reused with a different request: {key}")
+        logger.info(f"Idempotent replay served: {key}")
+        return entry['response']
+
+    @staticmethod
+    def _lock_for(scope: str, key: str) -> threading.Lock:
+        """Get the process-wide lock for a key"""
+        return _key_locks[hash((scope, key)) % _LOCK_STRIPES]
+
+    @staticmethod
+    def _hash_payload(payload: dict) -> str:
+        """Fingerprint a request payload"""
+        encoded = json.dumps(payload, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode()).hexdigest()
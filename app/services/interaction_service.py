@@ -0,0 +1,219 @@
+"""Drug-drug interaction checking service"""
+import csv
+import threading
+import time
+import uuid
+from datetime import datetime
+from itertools import combinations, islice
+from typing import Iterable, List, TextIO
+from sqlalchemy import or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models.prescription import DrugInteraction, InteractionSeverity, Prescription, PrescriptionStatus
+import logging
+
+logger = logging.getLogger(__name__)
+
+SEVERITY_RANK = {severity: rank for rank, severity in enumerate(InteractionSeverity)}
+
+class InteractionMatrix:
+    """Interaction table as a hashed set of integer medication pairs
+
+    Each medication is given a dense integer index. An interacting pair is stored
+    once under the key low << 32 | high, so a check is one integer hash lookup
+    per pair regardless of how many interactions are known.
+    """
+
+    def __init__(self, rows: Iterable):
+        self.index = {}
+        self.medication_ids = []
+        self.pairs = {}
+        for row in rows:
+            key = self._key(self._index_of(row.medication_a_id), self._index_of(row.medication_b_id))
+            self.pairs[key] = (row.severity, row.description)
+
+    def lookup(self, first: str, second: str):
+        """(severity, description) for a pair of medications, or None"""
+        i = self.index.get(first)
+        j = self.index.get(second)
+        if i is None or j is None or i == j:
+            return None
+        return self.pairs.get(self._key(i, j))
+
+    def _index_of(self, medication_id: str) -> int:
+        """Dense index of a medication, assigned on first sight"""
+        index = self.index.get(medication_id)
+        if index is None:
+            index = self.index[medication_id] = len(self.medication_ids)
+            self.medication_ids.append(medication_id)
+        return index
+
+    @staticmethod
+    def _key(i: int, j: int) -> int:
+        """Order-independent key for a pair of indexes"""
+        return (i << 32) | j if i < j else (j << 32) | i
+
+class _MatrixState:
+    """Process-wide interaction matrix and when it was loaded"""
+
+    def __init__(self):
+        self.matrix = None
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+_state = _MatrixState()
+
+class DrugInteractionService:
+    """Service for checking medications against known drug-drug interactions
+
+    Interactions live in the drug_interactions table and can be imported from a
+    CSV file. They are loaded into an in-process InteractionMatrix, reloaded when
+    older than DRUG_INTERACTION_RELOAD_SECONDS or after a local change, so a check
+    against a patient's active prescriptions costs one query for their medication
+    IDs and otherwise runs in memory.
+    """
+
+    CSV_FIELDS = ('medication_a_id', 'medication_b_id', 'severity', 'description')
+    UPSERT_CHUNK_SIZE = 1000
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def check_new_medication(self, patient_id: str, medication_id: str) -> List[dict]:
+        """Interactions between a medication and the patient's active prescriptions"""
+        active_ids = self.db.execute(
+            select(Prescription.medication_id).where(
+                Prescription.patient_id == patient_id,
+                Prescription.status == PrescriptionStatus.ACTIVE,
+                or_(Prescription.expires_at.is_(None), Prescription.expires_at > datetime.utcnow())
+            ).distinct()
+        ).scalars().all()
+        matrix = self._matrix()
+        warnings = []
+        for other_id in active_ids:
+            found = matrix.lookup(medication_id, other_id)
+            if found:
+                warnings.append(self._warning(medication_id, other_id, found))
+        return self._by_severity(warnings)
+
+    def check_medication_list(self, medication_ids: List[str]) -> List[dict]:
+        """Interactions between every pair in a medication list, e.g. at admission"""
+        matrix = self._matrix()
+        warnings = []
+        for first, second in combinations(dict.fromkeys(medication_ids), 2):
+            found = matrix.lookup(first, second)
+            if found:
+                warnings.append(self._warning(first, second, found))
+        return self._by_severity(warnings)
+
+    def add_interaction(self, medication_a_id: str, medication_b_id: str,
+                        severity: str, description: str) -> DrugInteraction:
+        """Record an interaction for a pair of medications, replacing any existing entry"""
+        self._upsert([(medication_a_id, medication_b_id, severity, description)])
+        self.db.commit()
+        self.invalidate()
+        logger.info(f"Drug interaction recorded: {medication_a_id} / {medication_b_id} ({severity})")
+        first, second = sorted((medication_a_id, medication_b_id))
+        return self.db.query(DrugInteraction).filter(
+            DrugInteraction.medication_a_id == first,
+            DrugInteraction.medication_b_id == second
+        ).populate_existing().first()
+
+    def import_interactions(self, stream: TextIO = None) -> int:
+        """Upsert interactions from a CSV with medication_a_id, medication_b_id, severity, description"""
+        if stream is None:
+            if not settings.DRUG_INTERACTIONS_FILE:
+                raise ValueError("No drug interactions file configured")
+            with open(settings.DRUG_INTERACTIONS_FILE, newline='', encoding='utf-8') as handle:
+                return self.import_interactions(handle)
+
+        reader = csv.DictReader(stream)
+        missing = [field for field in self.CSV_FIELDS if field not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"Drug interactions file is missing columns: {', '.join(missing)}")
+        count = self._upsert(
+            (row['medication_a_id'].strip(), row['medication_b_id'].strip(),
+             row['severity'].strip().lower(), row['description'].strip())
+            for row in reader
+        )
+        self.db.commit()
+        self.invalidate()
+        logger.info(f"Drug interactions imported: {count}")
+        return count
+
+    @staticmethod
+    def invalidate():
+        """Reload the interaction matrix on its next use"""
+        _state.loaded_at = None
+
+    def _matrix(self) -> InteractionMatrix:
+        """The loaded interaction matrix, reloading it when stale"""
+        loaded_at = _state.loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at <= settings.DRUG_INTERACTION_RELOAD_SECONDS:
+            return _state.matrix
+        with _state.lock:
+            if _state.loaded_at is None or time.monotonic() - _state.loaded_at > settings.DRUG_INTERACTION_RELOAD_SECONDS:
+                rows = self.db.execute(select(
+                    DrugInteraction.medication_a_id, DrugInteraction.medication_b_id,
+                    DrugInteraction.severity, DrugInteraction.description
+                )).all()
+                _state.matrix = InteractionMatrix(rows)
+                _state.loaded_at = time.monotonic()
+                logger.info(f"Drug interaction matrix loaded: {len(rows)} pairs")
+            return _state.matrix
+
+    def _upsert(self, entries: Iterable[tuple]) -> int:
+        """Insert or update interactions on their unique ordered pair; the caller commits
+
+        Each chunk of UPSERT_CHUNK_SIZE entries is one INSERT ... ON CONFLICT statement,
+        so an import never builds an unbounded lookup of existing pairs.
+        """
+        insert = postgresql.insert if self.db.get_bind().dialect.name == 'postgresql' else sqlite.insert
+        entries = iter(entries)
+        count = 0
+        while True:
+            chunk = list(islice(entries, self.UPSERT_CHUNK_SIZE))
+            if not chunk:
+                return count
+            now = datetime.utcnow()
+            rows = {}
+            for medication_a_id, medication_b_id, severity, description in chunk:
+                if not medication_a_id or not medication_b_id or medication_a_id == medication_b_id:
+                    raise ValueError(f"Interaction needs two different medications: {medication_a_id}, {medication_b_id}")
+                try:
+                    severity = InteractionSeverity(severity)
+                except ValueError:
+                    raise ValueError(f"Unknown interaction severity: {severity}")
+                pair = tuple(sorted((medication_a_id, medication_b_id)))
+                # A statement may not update the same row twice, so the last entry for a pair wins
+                rows[pair] = {
+                    'id': str(uuid.uuid4()), 'medication_a_id': pair[0], 'medication_b_id': pair[1],
+                    'severity': severity, 'description': description, 'updated_at': now
+                }
+                count += 1
+            statement = insert(DrugInteraction).values(list(rows.values()))
+            self.db.execute(statement.on_conflict_do_update(
+                index_elements=[DrugInteraction.medication_a_id, DrugInteraction.medication_b_id],
+                set_={
+                    'severity': statement.excluded.severity,
+                    'description': statement.excluded.description,
+                    'updated_at': statement.excluded.updated_at
+                }
+            ))
+
+    @staticmethod
+    def _warning(medication_id: str, other_id: str, found: tuple) -> dict:
+        """Warning for one interacting pair"""
+        severity, description = found
+        return {
+            'medication_id': medication_id,
+            'interacts_with': other_id,
+            'severity': severity.value,
+            'description': description
+        }
+
+    @staticmethod
+    def _by_severity(warnings: List[dict]) -> List[dict]:
+        """Most severe interactions first"""
+        return sorted(warnings, key=lambda w: -SEVERITY_RANK[InteractionSeverity(w['severity'])])
@@ -0,0 +1,140 @@
+"""Expiry sweep and expiring-soon view for inventory"""
+import bisect
+import threading
+from datetime import date, datetime, timedelta
+from typing import Optional
+from sqlalchemy import select, union
+from sqlalchemy.orm import Session
+from app.cache import TTLCache
+from app.config import settings
+from app.models.inventory import InventoryItem, InventoryLot
+from app.services.inventory_service import InventoryService
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Refreshed by every sweep; the TTL only bounds staleness if the sweep stops running
+_expiring_view = TTLCache(settings.INVENTORY_EXPIRY_SWEEP_SECONDS * 2, maxsize=1)
+
+class InventoryExpiryService:
+    """Service for quarantining expired stock and serving what expires soon
+
+    The sweep finds expired stock with range reads on the expiration_date indexes
+    of items and lots, quarantines it item by item, and rebuilds the expiring-soon
+    view: every item and lot expiring within INVENTORY_EXPIRY_HORIZON_DAYS, sorted
+    by date, so a request for any window up to the horizon is a binary search
+    instead of a table scan.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def sweep(self) -> dict:
+        """Quarantine all expired stock, then refresh the expiring-soon view"""
+        inventory = InventoryService(self.db)
+        summary = {'items_quarantined': 0, 'lots_quarantined': 0, 'units_quarantined': 0}
+        for item_id in self._expired_item_ids():
+            try:
+                result = inventory.quarantine_expired_stock(item_id)
+            except Exception as e:
+                self.db.rollback()
+                logger.error(f"Expiry sweep failed for {item_id}: {e}")
+                continue
+            if result['quantity']:
+                summary['items_quarantined'] += 1
+                summary['lots_quarantined'] += result['lots']
+                summary['units_quarantined'] += result['quantity']
+
+        view = self.refresh_expiring_view()
+        summary['expiring_within_horizon'] = len(view['items'])
+        logger.info(
+            f"Expiry sweep: {summary['units_quarantined']} units quarantined from "
+            f"{summary['items_quarantined']} items"
+        )
+        return summary
+
+    def get_expiring_items(self, days: int = 30) -> dict:
+        """Items and lots expiring within the given number of days, from the cached view"""
+        if not 0 <= days <= settings.INVENTORY_EXPIRY_HORIZON_DAYS:
+            raise ValueError(f"Expiry window must be between 0 and {settings.INVENTORY_EXPIRY_HORIZON_DAYS} days: {days}")
+        view = _expiring_view.get('view')
+        if view is None or view['as_of'] != date.today():
+            view = self.refresh_expiring_view()
+
+        end = bisect.bisect_right(view['dates'], view['as_of'] + timedelta(days=days))
+        return {
+            'as_of': view['as_of'],
+            'refreshed_at': view['refreshed_at'],
+            'days': days,
+            'items': view['items'][:end]
+        }
+
+    def refresh_expiring_view(self) -> dict:
+        """Rebuild the expiring-soon view from the expiration_date indexes"""
+        today = date.today()
+        horizon = today + timedelta(days=settings.INVENTORY_EXPIRY_HORIZON_DAYS)
+
+        items = self.db.query(
+            InventoryItem.id, InventoryItem.name, InventoryItem.storage_location,
+            InventoryItem.expiration_date, InventoryItem.quantity
+        ).filter(
+            InventoryItem.expiration_date >= today,
+            InventoryItem.expiration_date <= horizon,
+            InventoryItem.lot_tracked.is_(False),
+            InventoryItem.quantity > 0
+        ).all()
+        lots = self.db.query(
+            InventoryLot.id, InventoryLot.item_id, InventoryItem.name, InventoryItem.storage_location,
+            InventoryLot.expiration_date, InventoryLot.quantity
+        ).join(InventoryItem, InventoryItem.id == InventoryLot.item_id).filter(
+            InventoryLot.expiration_date >= today,
+            InventoryLot.expiration_date <= horizon,
+            InventoryLot.quantity > 0
+        ).all()
+
+        rows = [
+            {'item_id': row.id, 'lot_id': None, 'name': row.name, 'storage_location': row.storage_location,
+             'expiration_date': row.expiration_date, 'quantity': row.quantity}
+            for row in items
+        ] + [
+            {'item_id': row.item_id, 'lot_id': row.id, 'name': row.name, 'storage_location': row.storage_location,
+             'expiration_date': row.expiration_date, 'quantity': row.quantity}
+            for row in lots
+        ]
+        rows.sort(key=lambda row: (row['expiration_date'], row['item_id'], row['lot_id'] or ''))
+
+        view = {
+            'as_of': today,
+            'refreshed_at': datetime.utcnow(),
+            'dates': [row['expiration_date'] for row in rows],
+            'items': rows
+        }
+        _expiring_view.set('view', view)
+        return view
+
+    def run_forever(self, stop_event: Optional[threading.Event] = None, interval: float = None):
+        """Sweep on an interval until the stop event is set"""
+        stop_event = stop_event or threading.Event()
+        interval = settings.INVENTORY_EXPIRY_SWEEP_SECONDS if interval is None else interval
+        while not stop_event.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                self.db.rollback()
+                logger.error(f"Expiry sweep error: {e}")
+            stop_event.wait(interval)
+
+    def _expired_item_ids(self) -> list:
+        """IDs of items holding expired stock, from index range reads on items and lots"""
+        today = date.today()
+        items = select(InventoryItem.id.label('item_id')).where(
+            InventoryItem.expiration_date < today,
+            InventoryItem.lot_tracked.is_(False),
+            # Sharded items are quarantined from their shards, which the item quantity may lag
+            (InventoryItem.quantity > 0) | (InventoryItem.shard_count > 0)
+        )
+        lots = select(InventoryLot.item_id.label('item_id')).where(
+            InventoryLot.expiration_date < today,
+            InventoryLot.quantity > 0
+        )
+        return sorted(self.db.execute(union(items, lots)).scalars())
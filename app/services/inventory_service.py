@@ -1,13 +1,27 @@
 """Inventory management service"""
+import threading
 import uuid
+import zlib
 from datetime import datetime, date
+from decimal import Decimal
 from typing import List, Optional
+from sqlalchemy import insert, update, select, func, case, literal, or_
 from sqlalchemy.orm import Session
-from app.models.inventory import InventoryItem, InventoryTransaction, InventoryTransactionType
+from sqlalchemy.orm.attributes import set_committed_value
+from app.cache import TTLCache
+from app.config import settings
+from app.services.outbox_service import OutboxService
+from app.services.medication_catalog_service import MedicationCatalogService
+from app.models.inventory import InventoryItem, InventoryTransaction, InventoryTransactionType, InventoryLot, InventoryStock, InventoryCounterShard, InventoryQuarantine
 import logging
 
 logger = logging.getLogger(__name__)
 
+BATCH_MODES = ('all_or_nothing', 'partial')
+
+# Inventory report summary, dropped whenever this process changes stock
+_report_cache = TTLCache(settings.INVENTORY_REPORT_CACHE_SECONDS, maxsize=1)
+
 class InventoryService:
     """Service for inventory management"""
     
@@ -29,16 +43,20 @@ class InventoryService:
             unit_cost=item_data['unit_cost'],
             expiration_date=item_data.get('expiration_date'),
             storage_location=item_data['storage_location'],
+            category=item_data.get('category'),
             min_threshold=item_data.get('min_threshold', 10)
         )
+        item.is_low_stock = item.quantity <= item.min_threshold
         
         self.db.add(item)
+        self.db.add(InventoryStock(item_id=item_id, location=item.storage_location, quantity=item.quantity))
+        self._log_transaction(item_id, InventoryTransactionType.ADD, item_data['quantity'], location=item.storage_location)
+        self._record_low_stock_change(item_id, False, item.is_low_stock, item.quantity, item.min_threshold)
         self.db.commit()
+        self.stock_changed()
+        MedicationCatalogService.invalidate()
         self.db.refresh(item)
         
-        # Log transaction
-        self._log_transaction(item_id, InventoryTransactionType.ADD, item_data['quantity'])
-        
         logger.info(f"Inventory item added: {item_id}")
         return item
     
@@ -46,44 +64,555 @@ class InventoryService:
         """Get inventory item by ID"""
         return self.db.query(InventoryItem).filter(InventoryItem.id == item_id).first()
     
-    def consume_inventory(self, item_id: str, quantity: int, user_id: str = None) -> InventoryItem:
-        """Consume inventory"""
+    def consume_inventory(self, item_id: str, quantity: int, user_id: str = None, location: str = None) -> InventoryItem:
+        """Consume inventory with conditional UPDATEs so concurrent consumers cannot oversell
+
+        Stock is taken from the given location, or the item's home location.
+        """
+        if quantity <= 0:
+            raise ValueError(f"Consumption quantity must be positive: {quantity}")
+        
+        if not self._take_location_stock(item_id, quantity, location):
+            self.db.rollback()
+            item = self.get_inventory_item(item_id)
+            if item and item.shard_count and location in (None, item.storage_location):
+                return self._consume_sharded(item, quantity, user_id)
+            self._raise_location_error(item_id, location)
+        
+        notes = None
+        item = self._decrement_stock(item_id, quantity)
+        if item is None:
+            item = self.get_inventory_item(item_id)
+            if not item or not item.lot_tracked:
+                self.db.rollback()
+                self._raise_consume_error(item_id, quantity)
+            
+            allocations = self._consume_lots(item_id, quantity)
+            if allocations is None:
+                self.db.rollback()
+                self._raise_consume_error(item_id, quantity)
+            notes = self._format_allocations(allocations)
+            # Lot rows were updated in SQL; drop any loaded copies
+            self.db.expire_all()
+        
+        self._log_transaction(item_id, InventoryTransactionType.CONSUME, quantity, user_id, notes,
+                              location or item.storage_location)
+        self.db.commit()
+        self.stock_changed()
+        
+        logger.info(f"Inventory consumed: {item_id} - {quantity} units")
+        return item
+    
+    def receive_lot(self, item_id: str, quantity: int, expiration_date: date = None,
+                    lot_number: str = None, user_id: str = None, location: str = None) -> InventoryLot:
+        """Receive stock into a new lot, switching the item to lot tracking"""
+        if quantity <= 0:
+            raise ValueError(f"Received quantity must be positive: {quantity}")
+        
         item = self.get_inventory_item(item_id)
         if not item:
             raise ValueError(f"Inventory item not found: {item_id}")
+        if item.shard_count:
+            raise ValueError(f"Sharded items cannot be lot-tracked: {item_id}")
+        was_low = item.is_low_stock
         
-        if item.quantity < quantity:
-            raise ValueError(f"Insufficient inventory: {item_id}")
+        if not item.lot_tracked:
+            # Carry existing untracked stock over as an opening lot
+            if item.quantity > 0:
+                self.db.add(InventoryLot(
+                    id=str(uuid.uuid4()),
+                    item_id=item_id,
+                    lot_number='OPENING',
+                    quantity=item.quantity,
+                    expiration_date=item.expiration_date
+                ))
+            item.lot_tracked = True
         
-        # Check if item is expired
-        if item.expiration_date and item.expiration_date < date.today():
-            raise ValueError(f"Item is expired: {item_id}")
+        lot = InventoryLot(
+            id=str(uuid.uuid4()),
+            item_id=item_id,
+            lot_number=lot_number,
+            quantity=quantity,
+            expiration_date=expiration_date
+        )
+        self.db.add(lot)
+        self.db.flush()
         
-        item.quantity -= quantity
-        item.updated_at = datetime.utcnow()
+        item.quantity = InventoryItem.quantity + quantity
+        item.is_low_stock = InventoryItem.quantity + quantity <= InventoryItem.min_threshold
+        item.expiration_date = self._earliest_lot_expiry(item_id)
+        self._put_location_stock(item_id, quantity, location)
+        self._log_transaction(item_id, InventoryTransactionType.ADD, quantity, user_id, f"lot {lot_number or lot.id}",
+                              location or item.storage_location)
+        self.db.flush()
+        self._record_low_stock_change(item_id, was_low, item.is_low_stock, item.quantity, item.min_threshold)
         
         self.db.commit()
-        self.db.refresh(item)
+        self.stock_changed()
+        self.db.refresh(lot)
+        logger.info(f"Inventory lot received: {item_id} - {quantity} units in lot {lot.id}")
+        return lot
+    
+    def get_item_lots(self, item_id: str, include_empty: bool = False) -> List[InventoryLot]:
+        """Get an item's lots in first-expired-first-out order"""
+        query = self.db.query(InventoryLot).filter(InventoryLot.item_id == item_id)
+        if not include_empty:
+            query = query.filter(InventoryLot.quantity > 0)
+        return query.order_by(InventoryLot.expiration_date.asc().nullslast(), InventoryLot.id).all()
+    
+    def allocate_fefo(self, item_id: str, quantity: int, for_update: bool = False) -> Optional[List[dict]]:
+        """Pick unexpired lots soonest-expiring first to cover quantity; None if stock is short
+
+        Reads the (item_id, expiration_date) index in order and stops as soon as the
+        quantity is covered, so items with thousands of lots read only what they need.
+        """
+        query = self.db.query(InventoryLot.id, InventoryLot.quantity, InventoryLot.expiration_date).filter(
+            InventoryLot.item_id == item_id,
+            InventoryLot.quantity > 0,
+            or_(InventoryLot.expiration_date.is_(None), InventoryLot.expiration_date >= date.today())
+        ).order_by(InventoryLot.expiration_date.asc().nullslast(), InventoryLot.id)
+        if for_update:
+            query = query.with_for_update()
         
-        # Log transaction
-        self._log_transaction(item_id, InventoryTransactionType.CONSUME, quantity, user_id)
+        allocations = []
+        remaining = quantity
+        for lot in query.yield_per(100):
+            take = min(lot.quantity, remaining)
+            allocations.append({'lot_id': lot.id, 'quantity': take, 'expiration_date': lot.expiration_date})
+            remaining -= take
+            if remaining == 0:
+                return allocations
+        return None
+    
+    def consume_batch(self, lines: List[dict], mode: str = 'all_or_nothing', user_id: str = None) -> dict:
+        """Consume several items in one transaction
+
+        In all_or_nothing mode any failing line rejects the whole batch; in partial mode
+        valid lines are applied and failures are reported.
+        """
+        report, applied = self.stage_consumption(lines, mode, user_id)
+        if not applied:
+            self.db.rollback()
+            return report
         
-        logger.info(f"Inventory consumed: {item_id} - {quantity} units")
-        return item
+        self.db.commit()
+        self.stock_changed()
+        report['committed'] = True
+        
+        logger.info(f"Batch consumption: {len(report['applied'])} items applied, {len(report['failed'])} failed")
+        return report
+    
+    def stage_consumption(self, lines: List[dict], mode: str = 'all_or_nothing', user_id: str = None,
+                          nested: bool = True) -> tuple:
+        """Apply a batch consumption to the caller's unit of work; the caller commits
+
+        Returns the batch report and whether the batch was applied. By default the
+        batch runs in a savepoint, so a rejected batch is undone without discarding
+        the caller's other changes. Callers that roll back their whole transaction
+        on rejection pass nested=False: on SQLite an outermost savepoint commits
+        when released, which would make the stock decrement durable on its own.
+        """
+        if mode not in BATCH_MODES:
+            raise ValueError(f"Unsupported batch mode: {mode}")
+        if not lines:
+            raise ValueError("Batch must contain at least one item")
+        
+        # Check each line before merging, so a negative line cannot offset another line of the same item
+        failed = []
+        requested = {}
+        for line in lines:
+            if line['quantity'] <= 0:
+                failed.append({'item_id': line['item_id'], 'quantity': line['quantity'], 'reason': 'quantity must be positive'})
+                continue
+            # Merge repeated items so each row is decremented once
+            requested[line['item_id']] = requested.get(line['item_id'], 0) + line['quantity']
+        
+        invalid, lot_tracked_ids, home_locations, sharded = self._validate_batch(requested)
+        failed.extend(invalid)
+        report = {'mode': mode, 'committed': False, 'applied': [], 'failed': failed}
+        if failed and mode == 'all_or_nothing':
+            return report, False
+        
+        savepoint = self.db.begin_nested() if nested else None
+        
+        def abandon():
+            if savepoint is not None:
+                savepoint.rollback()
+        
+        failed_ids = {line['item_id'] for line in invalid}
+        now = datetime.utcnow()
+        transaction_rows = []
+        # Lock rows in a stable order so concurrent batches cannot deadlock
+        for item_id in sorted(requested):
+            if item_id in failed_ids:
+                continue
+            quantity = requested[item_id]
+            notes = None
+            if item_id in sharded:
+                if not self._take_from_shards(item_id, sharded[item_id], quantity, str(uuid.uuid4())):
+                    if mode == 'all_or_nothing':
+                        abandon()
+                        report['applied'] = []
+                        report['failed'] = failed + [{'item_id': item_id, 'quantity': quantity, 'reason': 'insufficient inventory'}]
+                        return report, False
+                    failed.append({'item_id': item_id, 'quantity': quantity, 'reason': 'insufficient inventory'})
+                    continue
+            # Batches draw from each item's home location
+            elif not self._take_location_stock(item_id, quantity):
+                if mode == 'all_or_nothing':
+                    abandon()
+                    report['applied'] = []
+                    report['failed'] = failed + [{'item_id': item_id, 'quantity': quantity, 'reason': 'insufficient inventory at location'}]
+                    return report, False
+                failed.append({'item_id': item_id, 'quantity': quantity, 'reason': 'insufficient inventory at location'})
+                continue
+            if item_id in lot_tracked_ids:
+                # Earlier lot updates for this item may already be applied when allocation
+                # comes up short, so a partial batch rolls back just this line's savepoint
+                line = self.db.begin_nested() if mode == 'partial' else None
+                allocations = self._consume_lots(item_id, quantity)
+                if allocations is None:
+                    if mode == 'all_or_nothing':
+                        abandon()
+                        report['applied'] = []
+                        report['failed'] = failed + [{'item_id': item_id, 'quantity': quantity, 'reason': 'insufficient unexpired lot stock'}]
+                        return report, False
+                    line.rollback()
+                    self._put_location_stock(item_id, quantity)
+                    failed.append({'item_id': item_id, 'quantity': quantity, 'reason': 'insufficient unexpired lot stock'})
+                    continue
+                if line is not None:
+                    line.commit()
+                notes = self._format_allocations(allocations)
+            elif self._decrement_stock(item_id, quantity) is None:
+                # Stock changed since validation
+                if mode == 'all_or_nothing':
+                    abandon()
+                    report['applied'] = []
+                    report['failed'] = [{'item_id': item_id, 'quantity': quantity, 'reason': 'stock changed concurrently'}]
+                    return report, False
+                self._put_location_stock(item_id, quantity)
+                failed.append({'item_id': item_id, 'quantity': quantity, 'reason': 'stock changed concurrently'})
+                continue
+            report['applied'].append({'item_id': item_id, 'quantity': quantity})
+            transaction_rows.append({
+                'id': str(uuid.uuid4()),
+                'item_id': item_id,
+                'transaction_type': InventoryTransactionType.CONSUME,
+                'quantity': quantity,
+                'timestamp': now,
+                'user_id': user_id,
+                'notes': notes,
+                'location': home_locations[item_id]
+            })
+        
+        if transaction_rows:
+            self.db.execute(insert(InventoryTransaction), transaction_rows)
+        if savepoint is not None:
+            savepoint.commit()
+        return report, True
     
     def get_low_stock_items(self, threshold: int = None) -> List[InventoryItem]:
-        """Get items with low stock"""
+        """Get items with low stock
+
+        Without an explicit threshold this reads the maintained is_low_stock flag;
+        an ad hoc threshold still compares quantities across the table.
+        """
         query = self.db.query(InventoryItem)
         
         if threshold:
             query = query.filter(InventoryItem.quantity <= threshold)
         else:
-            query = query.filter(InventoryItem.quantity <= InventoryItem.min_threshold)
+            query = query.filter(InventoryItem.is_low_stock.is_(True))
         
         return query.all()
     
+    def transfer_stock(self, item_id: str, from_location: str, to_location: str,
+                       quantity: int, user_id: str = None) -> List[InventoryStock]:
+        """Move stock between locations, recorded as a pair of TRANSFER transactions"""
+        if quantity <= 0:
+            raise ValueError(f"Transfer quantity must be positive: {quantity}")
+        if from_location == to_location:
+            raise ValueError("Transfer source and destination must differ")
+        
+        if not self._take_location_stock(item_id, quantity, from_location):
+            self.db.rollback()
+            self._raise_location_error(item_id, from_location)
+        self._put_location_stock(item_id, quantity, to_location)
+        
+        reference_id = str(uuid.uuid4())
+        self._log_transaction(item_id, InventoryTransactionType.TRANSFER, -quantity, user_id,
+                              f"transfer to {to_location}", from_location, reference_id)
+        self._log_transaction(item_id, InventoryTransactionType.TRANSFER, quantity, user_id,
+                              f"transfer from {from_location}", to_location, reference_id)
+        self.db.commit()
+        self.stock_changed()
+        
+        logger.info(f"Inventory transferred: {item_id} - {quantity} units {from_location} -> {to_location}")
+        return self.get_item_locations(item_id)
+    
+    def get_item_locations(self, item_id: str) -> List[InventoryStock]:
+        """Get an item's stock at each location"""
+        return self.db.query(InventoryStock).filter(
+            InventoryStock.item_id == item_id
+        ).order_by(InventoryStock.location).all()
+    
+    def get_location_stock(self, location: str) -> List[dict]:
+        """Get every item held at one location"""
+        rows = self.db.query(
+            InventoryStock.item_id,
+            InventoryItem.name,
+            InventoryStock.quantity
+        ).join(InventoryItem, InventoryItem.id == InventoryStock.item_id).filter(
+            InventoryStock.location == location,
+            InventoryStock.quantity > 0
+        ).order_by(InventoryItem.name).all()
+        return [{'item_id': row.item_id, 'name': row.name, 'quantity': row.quantity} for row in rows]
+    
+    def get_location_totals(self) -> List[dict]:
+        """Get item count and units on hand per location"""
+        rows = self.db.query(
+            InventoryStock.location,
+            func.count(InventoryStock.item_id).label('item_count'),
+            func.sum(InventoryStock.quantity).label('total_units')
+        ).filter(InventoryStock.quantity > 0).group_by(InventoryStock.location).order_by(InventoryStock.location).all()
+        return [
+            {'location': row.location, 'item_count': row.item_count, 'total_units': int(row.total_units)}
+            for row in rows
+        ]
+    
+    def get_item_totals(self, name: str) -> List[dict]:
+        """Get facility-wide stock of the items with the given name"""
+        rows = self.db.query(
+            InventoryItem.id,
+            InventoryItem.name,
+            InventoryItem.quantity,
+            func.count(InventoryStock.location).label('location_count')
+        ).outerjoin(
+            InventoryStock, (InventoryStock.item_id == InventoryItem.id) & (InventoryStock.quantity > 0)
+        ).filter(InventoryItem.name == name).group_by(
+            InventoryItem.id, InventoryItem.name, InventoryItem.quantity
+        ).all()
+        return [
+            {'item_id': row.id, 'name': row.name, 'quantity': row.quantity, 'location_count': row.location_count}
+            for row in rows
+        ]
+    
+    def backfill_location_stock(self) -> int:
+        """Create home-location stock rows for items that have none; returns rows created"""
+        missing = select(InventoryItem.id, InventoryItem.storage_location, InventoryItem.quantity).where(
+            ~select(InventoryStock.item_id).where(InventoryStock.item_id == InventoryItem.id).exists()
+        )
+        result = self.db.execute(
+            insert(InventoryStock).from_select(['item_id', 'location', 'quantity'], missing)
+        )
+        self.db.commit()
+        logger.info(f"Location stock backfilled: {result.rowcount} items")
+        return result.rowcount
+    
+    def enable_sharded_counter(self, item_id: str, shards: int = None) -> InventoryItem:
+        """Split a hot item's stock across counter shards so consumers stop contending on one row"""
+        shards = shards or settings.INVENTORY_COUNTER_SHARDS
+        if shards < 2:
+            raise ValueError(f"Sharded counters need at least 2 shards: {shards}")
+        item = self.db.query(InventoryItem).filter(InventoryItem.id == item_id).with_for_update().first()
+        if not item:
+            raise ValueError(f"Inventory item not found: {item_id}")
+        if item.lot_tracked:
+            raise ValueError(f"Lot-tracked items cannot use sharded counters: {item_id}")
+        if item.shard_count:
+            raise ValueError(f"Item already uses sharded counters: {item_id}")
+        
+        item.shard_count = shards
+        self.db.execute(insert(InventoryCounterShard), [
+            {'item_id': item_id, 'shard': shard, 'quantity': quantity}
+            for shard, quantity in enumerate(self._split_evenly(item.quantity, shards))
+        ])
+        self.db.commit()
+        
+        logger.info(f"Sharded counter enabled: {item_id} - {shards} shards")
+        return item
+    
+    def disable_sharded_counter(self, item_id: str) -> InventoryItem:
+        """Fold an item's shards back into its stock row"""
+        item = self.get_inventory_item(item_id)
+        if not item:
+            raise ValueError(f"Inventory item not found: {item_id}")
+        if not item.shard_count:
+            raise ValueError(f"Item does not use sharded counters: {item_id}")
+        
+        self._compact_item(item_id)
+        self.db.query(InventoryCounterShard).filter(
+            InventoryCounterShard.item_id == item_id
+        ).delete(synchronize_session=False)
+        item.shard_count = 0
+        self.db.commit()
+        self.stock_changed()
+        
+        logger.info(f"Sharded counter disabled: {item_id}")
+        return item
+    
+    def get_available_quantity(self, item_id: str) -> int:
+        """Current stock of an item, summing the shards of sharded items"""
+        item = self.get_inventory_item(item_id)
+        if not item:
+            raise ValueError(f"Inventory item not found: {item_id}")
+        if not item.shard_count:
+            return item.quantity
+        return self._shard_total(item_id)
+    
+    def _shard_total(self, item_id: str) -> int:
+        """Sum of a sharded item's shards"""
+        return int(self.db.query(func.coalesce(func.sum(InventoryCounterShard.quantity), 0)).filter(
+            InventoryCounterShard.item_id == item_id
+        ).scalar())
+    
+    def compact_sharded_counters(self) -> int:
+        """Fold every sharded item's shards into its stock row and rebalance them; one transaction per item"""
+        item_ids = [row.id for row in self.db.query(InventoryItem.id).filter(InventoryItem.shard_count > 0).all()]
+        for item_id in item_ids:
+            self._compact_item(item_id)
+            self.db.commit()
+        if item_ids:
+            self.stock_changed()
+            logger.info(f"Sharded counters compacted: {len(item_ids)} items")
+        return len(item_ids)
+    
+    def run_counter_compactor(self, stop_event: Optional[threading.Event] = None, interval: float = None):
+        """Compact sharded counters on an interval until the stop event is set"""
+        stop_event = stop_event or threading.Event()
+        interval = settings.INVENTORY_COUNTER_COMPACT_SECONDS if interval is None else interval
+        while not stop_event.is_set():
+            try:
+                self.compact_sharded_counters()
+            except Exception as e:
+                self.db.rollback()
+                logger.error(f"Counter compaction error: {e}")
+            stop_event.wait(interval)
+    
+    def quarantine_expired_stock(self, item_id: str) -> dict:
+        """Move an item's expired stock out of usable inventory
+
+        Expired stock is taken from the item's locations, home first, with one RETURN
+        transaction per location and recorded in inventory_quarantine. Lot-tracked
+        items lose their expired lots only; other items lose all stock once past
+        their expiration date.
+        """
+        today = date.today()
+        item = self.db.query(InventoryItem).filter(
+            InventoryItem.id == item_id
+        ).with_for_update().populate_existing().first()
+        if not item:
+            raise ValueError(f"Inventory item not found: {item_id}")
+        
+        reference_id = str(uuid.uuid4())
+        quarantined = []
+        if item.lot_tracked:
+            lots = self.db.query(InventoryLot).filter(
+                InventoryLot.item_id == item_id,
+                InventoryLot.expiration_date < today,
+                InventoryLot.quantity > 0
+            ).order_by(InventoryLot.expiration_date, InventoryLot.id).with_for_update().populate_existing().all()
+            for lot in lots:
+                quarantined.append((lot.id, lot.quantity, lot.expiration_date))
+                lot.quantity = 0
+        elif item.expiration_date and item.expiration_date < today:
+            # Sharded stock is folded to zero first so the shards stop serving it
+            quantity = self._compact_item(item_id, 0) if item.shard_count else item.quantity
+            if quantity > 0:
+                quarantined.append((None, quantity, item.expiration_date))
+        
+        total = sum(quantity for _, quantity, _ in quarantined)
+        if total == 0:
+            self.db.commit()
+            return {'item_id': item_id, 'quantity': 0, 'lots': 0}
+        
+        if not item.shard_count:
+            for location, taken in self._drain_location_stock(item, total):
+                self._log_transaction(item_id, InventoryTransactionType.RETURN, -taken, None,
+                                      "expired stock quarantined", location, reference_id)
+            was_low = item.is_low_stock
+            item.quantity -= total
+            item.is_low_stock = item.quantity <= item.min_threshold
+            if item.lot_tracked:
+                self.db.flush()
+                item.expiration_date = self.db.execute(
+                    select(self._earliest_lot_expiry(item_id))
+                ).scalar()
+            self._record_low_stock_change(item_id, was_low, item.is_low_stock, item.quantity, item.min_threshold)
+        else:
+            self._log_transaction(item_id, InventoryTransactionType.RETURN, -total, None,
+                                  "expired stock quarantined", item.storage_location, reference_id)
+        
+        self.db.execute(insert(InventoryQuarantine), [
+            {
+                'id': str(uuid.uuid4()),
+                'item_id': item_id,
+                'lot_id': lot_id,
+                'quantity': quantity,
+                'expiration_date': expiration_date,
+                'reference_id': reference_id,
+                'quarantined_at': datetime.utcnow()
+            }
+            for lot_id, quantity, expiration_date in quarantined
+        ])
+        self.db.commit()
+        self.stock_changed()
+        
+        logger.info(f"Expired stock quarantined: {item_id} - {total} units")
+        return {'item_id': item_id, 'quantity': total, 'lots': sum(1 for lot_id, _, _ in quarantined if lot_id)}
+    
+    def get_min_thresholds(self, item_ids: List[str]) -> dict:
+        """Map item ID to its current min_threshold"""
+        rows = self.db.query(InventoryItem.id, InventoryItem.min_threshold).filter(
+            InventoryItem.id.in_(item_ids)
+        ).all()
+        return {row.id: row.min_threshold for row in rows}
+    
+    def set_min_thresholds(self, thresholds: dict) -> int:
+        """Bulk-update min_threshold by item ID and refresh the low-stock flags it affects"""
+        if not thresholds:
+            return 0
+        if any(threshold < 0 for threshold in thresholds.values()):
+            raise ValueError("Minimum threshold cannot be negative")
+        
+        self.db.execute(
+            update(InventoryItem),
+            [{'id': item_id, 'min_threshold': threshold} for item_id, threshold in thresholds.items()]
+        )
+        crossed = self.db.execute(
+            update(InventoryItem)
+            .where(
+                InventoryItem.id.in_(list(thresholds)),
+                InventoryItem.is_low_stock != (InventoryItem.quantity <= InventoryItem.min_threshold)
+            )
+            .values(is_low_stock=InventoryItem.quantity <= InventoryItem.min_threshold)
+            .returning(InventoryItem.id, InventoryItem.quantity, InventoryItem.min_threshold, InventoryItem.is_low_stock)
+            .execution_options(synchronize_session=False)
+        ).all()
+        for row in crossed:
+            self._record_low_stock_change(row.id, not row.is_low_stock, row.is_low_stock, row.quantity, row.min_threshold)
+        
+        self.db.commit()
+        self.stock_changed()
+        logger.info(f"Minimum thresholds updated: {len(thresholds)} items, {len(crossed)} crossed")
+        return len(thresholds)
+    
+    def rebuild_low_stock_flags(self) -> int:
+        """Recompute every item's low-stock flag, e.g. after a bulk import; returns rows corrected"""
+        result = self.db.execute(
+            update(InventoryItem)
+            .where(InventoryItem.is_low_stock != (InventoryItem.quantity <= InventoryItem.min_threshold))
+            .values(is_low_stock=InventoryItem.quantity <= InventoryItem.min_threshold)
+            .execution_options(synchronize_session=False)
+        )
+        self.db.commit()
+        self.stock_changed()
+        logger.info(f"Low-stock flags rebuilt: {result.rowcount} corrected")
+        return result.rowcount
+    
     def get_expired_items(self) -> List[InventoryItem]:
-        """Get expired items"""
+        """Get expired items; a range read on the expiration_date index"""
         today = date.today()
         return self.db.query(InventoryItem).filter(
             InventoryItem.expiration_date < today
@@ -94,56 +623,480 @@ class InventoryService:
         item = self.get_inventory_item(item_id)
         if not item:
             raise ValueError(f"Inventory item not found: {item_id}")
+        if item.lot_tracked:
+            raise ValueError(f"Stock for lot-tracked item is adjusted per lot: {item_id}")
+        if item.shard_count:
+            old_quantity = self._compact_item(item_id, quantity)
+            self._log_transaction(item_id, InventoryTransactionType.ADJUST, quantity - old_quantity, user_id,
+                                  location=item.storage_location)
+            self.db.commit()
+            self.stock_changed()
+            logger.info(f"Sharded stock level updated: {item_id} - {old_quantity} -> {quantity}")
+            return item
         
         old_quantity = item.quantity
+        was_low = item.is_low_stock
         item.quantity = quantity
-        item.updated_at = datetime.utcnow()
+        item.is_low_stock = quantity <= item.min_threshold
+        
+        adjustment = quantity - old_quantity
+        if adjustment < 0 and not self._take_location_stock(item_id, -adjustment):
+            self.db.rollback()
+            raise ValueError(f"Home location {item.storage_location} holds less than the reduction; transfer stock first: {item_id}")
+        if adjustment > 0:
+            self._put_location_stock(item_id, adjustment)
+        self._log_transaction(item_id, InventoryTransactionType.ADJUST, adjustment, user_id, location=item.storage_location)
+        self._record_low_stock_change(item_id, was_low, item.is_low_stock, quantity, item.min_threshold)
         
         self.db.commit()
+        self.stock_changed()
         self.db.refresh(item)
         
-        # Log transaction
-        adjustment = quantity - old_quantity
-        self._log_transaction(item_id, InventoryTransactionType.ADJUST, adjustment, user_id)
-        
         logger.info(f"Stock level updated: {item_id} - {old_quantity} -> {quantity}")
         return item
     
-    def get_inventory_report(self) -> dict:
-        """Get inventory report"""
-        items = self.db.query(InventoryItem).all()
+    def get_inventory_report(self, use_cache: bool = True) -> dict:
+        """Get inventory summary computed with aggregate queries; item detail is paged separately"""
+        if use_cache:
+            cached = _report_cache.get('summary')
+            if cached is not None:
+                return cached
         
-        total_value = sum(item.quantity * item.unit_cost for item in items)
-        low_stock_items = self.get_low_stock_items()
-        expired_items = self.get_expired_items()
+        totals = self.db.query(*self._report_aggregates()).one()
+        report = {
+            'total_items': totals.item_count,
+            'total_value': self._money(totals.total_value),
+            'low_stock_count': totals.low_stock_count,
+            'expired_count': totals.expired_count,
+            'by_location': self._report_location_breakdown(),
+            'by_category': self._report_breakdown(InventoryItem.category)
+        }
+        _report_cache.set('summary', report)
+        return report
+    
+    def get_inventory_items_page(self, limit: int = 100, after_id: str = None,
+                                 storage_location: str = None, category: str = None) -> dict:
+        """Get one page of inventory items ordered by ID"""
+        query = self.db.query(InventoryItem)
+        if after_id:
+            query = query.filter(InventoryItem.id > after_id)
+        if storage_location:
+            query = query.filter(InventoryItem.storage_location == storage_location)
+        if category:
+            query = query.filter(InventoryItem.category == category)
         
+        items = query.order_by(InventoryItem.id).limit(limit + 1).all()
+        has_more = len(items) > limit
+        items = items[:limit]
         return {
-            'total_items': len(items),
-            'total_value': total_value,
-            'low_stock_count': len(low_stock_items),
-            'expired_count': len(expired_items),
-            'items': [
-                {
-                    'id': item.id,
-                    'name': item.name,
-                    'quantity': item.quantity,
-                    'unit_cost': item.unit_cost,
-                    'expiration_date': item.expiration_date
-                }
-                for item in items
-            ]
+            'items': items,
+            'next_after_id': items[-1].id if has_more else None
         }
     
-    def _log_transaction(self, item_id: str, transaction_type: InventoryTransactionType, 
-                        quantity: int, user_id: str = None):
-        """Log inventory transaction"""
+    def _report_aggregates(self) -> list:
+        """Aggregate columns shared by the report summary and its breakdowns"""
+        today = date.today()
+        return [
+            func.count(InventoryItem.id).label('item_count'),
+            func.coalesce(func.sum(InventoryItem.quantity * InventoryItem.unit_cost), 0).label('total_value'),
+            func.coalesce(func.sum(case(
+                (InventoryItem.is_low_stock.is_(True), 1), else_=0
+            )), 0).label('low_stock_count'),
+            func.coalesce(func.sum(case(
+                (InventoryItem.expiration_date < today, 1), else_=0
+            )), 0).label('expired_count')
+        ]
+    
+    def _report_breakdown(self, group_column) -> List[dict]:
+        """Report totals grouped by one column"""
+        rows = self.db.query(
+            group_column.label('group_key'),
+            *self._report_aggregates()
+        ).group_by(group_column).order_by(group_column).all()
+        return [
+            {
+                'key': row.group_key,
+                'total_items': row.item_count,
+                'total_value': self._money(row.total_value),
+                'low_stock_count': row.low_stock_count,
+                'expired_count': row.expired_count
+            }
+            for row in rows
+        ]
+    
+    def _report_location_breakdown(self) -> List[dict]:
+        """Report totals per location from the stock actually held there
+
+        Value counts the units at each location; an item is counted at every location
+        holding it, and at its home location even when out of stock.
+        """
+        today = date.today()
+        rows = self.db.query(
+            InventoryStock.location.label('group_key'),
+            func.count(InventoryStock.item_id).label('item_count'),
+            func.coalesce(func.sum(InventoryStock.quantity * InventoryItem.unit_cost), 0).label('total_value'),
+            func.coalesce(func.sum(case(
+                (InventoryItem.is_low_stock.is_(True), 1), else_=0
+            )), 0).label('low_stock_count'),
+            func.coalesce(func.sum(case(
+                (InventoryItem.expiration_date < today, 1), else_=0
+            )), 0).label('expired_count')
+        ).join(InventoryItem, InventoryItem.id == InventoryStock.item_id).filter(
+            or_(InventoryStock.quantity > 0, InventoryStock.location == InventoryItem.storage_location)
+        ).group_by(InventoryStock.location).order_by(InventoryStock.location).all()
+        return [
+            {
+                'key': row.group_key,
+                'total_items': row.item_count,
+                'total_value': self._money(row.total_value),
+                'low_stock_count': row.low_stock_count,
+                'expired_count': row.expired_count
+            }
+            for row in rows
+        ]
+    
+    @staticmethod
+    def _money(value) -> Decimal:
+        """Normalize an aggregated amount to cents"""
+        return Decimal(str(value)).quantize(Decimal('0.01'))
+    
+    @staticmethod
+    def stock_changed():
+        """Drop cached inventory summaries; call after committing a stock change"""
+        _report_cache.clear()
+    
+    def _decrement_stock(self, item_id: str, quantity: int) -> Optional[InventoryItem]:
+        """Decrement stock if enough unexpired stock remains; returns the updated item or None"""
+        today = date.today()
+        stmt = (
+            update(InventoryItem)
+            .where(
+                InventoryItem.id == item_id,
+                InventoryItem.lot_tracked.is_(False),
+                InventoryItem.shard_count == 0,
+                InventoryItem.quantity >= quantity,
+                or_(InventoryItem.expiration_date.is_(None), InventoryItem.expiration_date >= today)
+            )
+            .values(
+                quantity=InventoryItem.quantity - quantity,
+                is_low_stock=InventoryItem.quantity - quantity <= InventoryItem.min_threshold
+            )
+            .returning(InventoryItem)
+        )
+        # Load the item from RETURNING; the ORM's in-Python evaluation of the SET clause
+        # would compute is_low_stock from the already-decremented quantity
+        item = self.db.scalars(
+            select(InventoryItem).from_statement(stmt),
+            execution_options={'populate_existing': True}
+        ).first()
+        if item is not None:
+            self._record_low_stock_change(
+                item_id, item.quantity + quantity <= item.min_threshold, item.is_low_stock,
+                item.quantity, item.min_threshold
+            )
+        return item
+    
+    def _consume_lots(self, item_id: str, quantity: int) -> Optional[List[dict]]:
+        """Decrement FEFO-allocated lots and the item total without committing; None if stock is short"""
+        allocations = self.allocate_fefo(item_id, quantity, for_update=True)
+        if allocations is None:
+            return None
+        
+        for allocation in allocations:
+            result = self.db.execute(
+                update(InventoryLot)
+                .where(InventoryLot.id == allocation['lot_id'], InventoryLot.quantity >= allocation['quantity'])
+                .values(quantity=InventoryLot.quantity - allocation['quantity'])
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount != 1:
+                return None
+        
+        row = self.db.execute(
+            update(InventoryItem)
+            .where(InventoryItem.id == item_id, InventoryItem.quantity >= quantity)
+            .values(
+                quantity=InventoryItem.quantity - quantity,
+                is_low_stock=InventoryItem.quantity - quantity <= InventoryItem.min_threshold,
+                expiration_date=self._earliest_lot_expiry(item_id)
+            )
+            .returning(InventoryItem.quantity, InventoryItem.min_threshold, InventoryItem.is_low_stock)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if row is None:
+            return None
+        self._record_low_stock_change(
+            item_id, row.quantity + quantity <= row.min_threshold, row.is_low_stock,
+            row.quantity, row.min_threshold
+        )
+        return allocations
+    
+    def _record_low_stock_change(self, item_id: str, was_low: bool, is_low: bool,
+                                 quantity: int, min_threshold: int):
+        """Add an outbox event when an item crosses its threshold; delivered with the stock change"""
+        if bool(was_low) == bool(is_low):
+            return
+        event_type = 'inventory.low_stock' if is_low else 'inventory.restocked'
+        OutboxService(self.db).add_event('inventory_item', item_id, event_type, {
+            'quantity': quantity,
+            'min_threshold': min_threshold
+        })
+        logger.info(f"Inventory threshold crossed: {item_id} - {event_type}")
+    
+    def _consume_sharded(self, item: InventoryItem, quantity: int, user_id: str = None) -> InventoryItem:
+        """Consume a sharded item from its shards without touching the item row
+
+        The returned item carries the summed shard quantity, which the item row only
+        catches up with at the next compaction.
+        """
+        if item.expiration_date and item.expiration_date < date.today():
+            raise ValueError(f"Item is expired: {item.id}")
+        
         transaction_id = str(uuid.uuid4())
+        if not self._take_from_shards(item.id, item.shard_count, quantity, transaction_id):
+            self.db.rollback()
+            raise ValueError(f"Insufficient inventory: {item.id}")
+        self._log_transaction(item.id, InventoryTransactionType.CONSUME, quantity, user_id,
+                              location=item.storage_location, transaction_id=transaction_id)
+        self.db.commit()
+        self.stock_changed()
+        
+        # Set without marking the item dirty, so no later flush writes the hot row
+        set_committed_value(item, 'quantity', self._shard_total(item.id))
+        logger.info(f"Inventory consumed from shards: {item.id} - {quantity} units")
+        return item
+    
+    def _take_from_shards(self, item_id: str, shard_count: int, quantity: int, key: str) -> bool:
+        """Decrement shards by quantity without going negative; False if the item is short
+
+        Starts at the shard chosen by hashing the key and moves on to the next shard
+        when one runs dry. Only when no single shard can cover the quantity are all
+        shards locked, in shard order, and drained together.
+        """
+        start = zlib.crc32(key.encode()) % shard_count
+        for offset in range(shard_count):
+            shard = (start + offset) % shard_count
+            result = self.db.execute(
+                update(InventoryCounterShard)
+                .where(
+                    InventoryCounterShard.item_id == item_id,
+                    InventoryCounterShard.shard == shard,
+                    InventoryCounterShard.quantity >= quantity
+                )
+                .values(quantity=InventoryCounterShard.quantity - quantity)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount == 1:
+                return True
+        
+        shards = self.db.query(InventoryCounterShard).filter(
+            InventoryCounterShard.item_id == item_id
+        ).order_by(InventoryCounterShard.shard).with_for_update().populate_existing().all()
+        if sum(shard.quantity for shard in shards) < quantity:
+            return False
+        remaining = quantity
+        for shard in shards:
+            take = min(shard.quantity, remaining)
+            shard.quantity -= take
+            remaining -= take
+            if remaining == 0:
+                break
+        self.db.flush()
+        return True
+    
+    def _compact_item(self, item_id: str, new_total: int = None) -> int:
+        """Fold shards into the item row, optionally resetting the total; returns the stock before
+
+        Locks the shards, then the item row, brings InventoryItem.quantity, the
+        low-stock flag and the home location row up to date, and spreads the total
+        evenly across the shards again. The caller commits.
+        """
+        shards = self.db.query(InventoryCounterShard).filter(
+            InventoryCounterShard.item_id == item_id
+        ).order_by(InventoryCounterShard.shard).with_for_update().populate_existing().all()
+        item = self.db.query(InventoryItem).filter(
+            InventoryItem.id == item_id
+        ).with_for_update().populate_existing().first()
+        
+        live_total = sum(shard.quantity for shard in shards)
+        total = live_total if new_total is None else new_total
+        if total < 0:
+            raise ValueError(f"Stock level cannot be negative: {item_id}")
+        if total != item.quantity:
+            self._put_location_stock(item_id, total - item.quantity)
+        
+        was_low = item.is_low_stock
+        item.quantity = total
+        item.is_low_stock = total <= item.min_threshold
+        for shard, quantity in zip(shards, self._split_evenly(total, len(shards))):
+            shard.quantity = quantity
+        self._record_low_stock_change(item_id, was_low, item.is_low_stock, total, item.min_threshold)
+        self.db.flush()
+        return live_total
+    
+    @staticmethod
+    def _split_evenly(total: int, parts: int) -> List[int]:
+        """Split a quantity into near-equal non-negative parts"""
+        base, remainder = divmod(total, parts)
+        return [base + 1 if i < remainder else base for i in range(parts)]
+    
+    def _location_value(self, item_id: str, location: Optional[str]):
+        """SQL value for a location, defaulting to the item's home location"""
+        if location:
+            return literal(location)
+        return select(InventoryItem.storage_location).where(InventoryItem.id == item_id).scalar_subquery()
+    
+    def _take_location_stock(self, item_id: str, quantity: int, location: str = None) -> bool:
+        """Decrement stock at a location if it holds enough; False otherwise"""
+        result = self.db.execute(
+            update(InventoryStock)
+            .where(
+                InventoryStock.item_id == item_id,
+                InventoryStock.location == self._location_value(item_id, location),
+                InventoryStock.quantity >= quantity,
+                # Sharded items fold location stock at compaction so consumers never touch this row
+                ~select(InventoryItem.id).where(InventoryItem.id == item_id, InventoryItem.shard_count > 0).exists()
+            )
+            .values(quantity=InventoryStock.quantity - quantity, updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+    
+    def _put_location_stock(self, item_id: str, quantity: int, location: str = None):
+        """Increment stock at a location, creating its row on first use"""
+        location_value = self._location_value(item_id, location)
+        result = self.db.execute(
+            update(InventoryStock)
+            .where(InventoryStock.item_id == item_id, InventoryStock.location == location_value)
+            .values(quantity=InventoryStock.quantity + quantity, updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            self.db.execute(
+                insert(InventoryStock).from_select(
+                    ['item_id', 'location', 'quantity'],
+                    select(literal(item_id), location_value, literal(quantity))
+                )
+            )
+    
+    def _drain_location_stock(self, item: InventoryItem, quantity: int) -> List[tuple]:
+        """Take quantity from an item's locations, home first; returns (location, taken) pairs"""
+        rows = self.db.query(InventoryStock).filter(
+            InventoryStock.item_id == item.id,
+            InventoryStock.quantity > 0
+        ).order_by(
+            case((InventoryStock.location == item.storage_location, 0), else_=1),
+            InventoryStock.location
+        ).with_for_update().populate_existing().all()
+        
+        drained = []
+        remaining = quantity
+        for row in rows:
+            if remaining == 0:
+                break
+            taken = min(row.quantity, remaining)
+            row.quantity -= taken
+            remaining -= taken
+            drained.append((row.location, taken))
+        if remaining:
+            # Location rows lag the item total; book the rest against the home location
+            drained.append((item.storage_location, remaining))
+        return drained
+    
+    def _raise_location_error(self, item_id: str, location: Optional[str]):
+        """Explain why stock could not be taken from a location"""
+        item = self.get_inventory_item(item_id)
+        if not item:
+            raise ValueError(f"Inventory item not found: {item_id}")
+        if item.shard_count:
+            raise ValueError(f"Sharded item stock stays at its home location {item.storage_location}: {item_id}")
+        raise ValueError(f"Insufficient inventory at {location or item.storage_location}: {item_id}")
+    
+    def _earliest_lot_expiry(self, item_id: str):
+        """Scalar subquery for the earliest expiry among lots that still hold stock"""
+        return select(func.min(InventoryLot.expiration_date)).where(
+            InventoryLot.item_id == item_id,
+            InventoryLot.quantity > 0
+        ).scalar_subquery()
+    
+    @staticmethod
+    def _format_allocations(allocations: List[dict]) -> str:
+        """Describe consumed lots for the transaction log"""
+        return 'FEFO lots: ' + ', '.join(f"{a['lot_id']}x{a['quantity']}" for a in allocations)
+    
+    def _raise_consume_error(self, item_id: str, quantity: int):
+        """Explain why a conditional decrement matched no row"""
+        item = self.get_inventory_item(item_id)
+        if not item:
+            raise ValueError(f"Inventory item not found: {item_id}")
+        if item.quantity < quantity:
+            raise ValueError(f"Insufficient inventory: {item_id}")
+        if item.lot_tracked:
+            # Expired lots still count in the item total but cannot be allocated
+            unexpired = self._unexpired_lot_quantity(item_id)
+            raise ValueError(
+                f"Insufficient unexpired stock: {item_id} - {unexpired} of {quantity} available, "
+                f"short {quantity - unexpired}"
+            )
+        raise ValueError(f"Item is expired: {item_id}")
+    
+    def _unexpired_lot_quantity(self, item_id: str) -> int:
+        """Stock held in lots that have not expired"""
+        return self.db.query(func.coalesce(func.sum(InventoryLot.quantity), 0)).filter(
+            InventoryLot.item_id == item_id,
+            InventoryLot.quantity > 0,
+            or_(InventoryLot.expiration_date.is_(None), InventoryLot.expiration_date >= date.today())
+        ).scalar()
+    
+    def _validate_batch(self, requested: dict) -> tuple:
+        """Check every requested item with one query
+
+        Returns failing lines, lot-tracked item IDs, home locations and shard counts of sharded items.
+        """
+        rows = self.db.query(
+            InventoryItem.id,
+            InventoryItem.quantity,
+            InventoryItem.expiration_date,
+            InventoryItem.lot_tracked,
+            InventoryItem.storage_location,
+            InventoryItem.shard_count
+        ).filter(InventoryItem.id.in_(list(requested))).all()
+        stock = {row.id: row for row in rows}
+        today = date.today()
+        
+        failed = []
+        for item_id, quantity in requested.items():
+            row = stock.get(item_id)
+            reason = None
+            if row is None:
+                reason = 'item not found'
+            elif row.quantity < quantity and not row.shard_count:
+                # Sharded stock is checked against the shards when applied
+                reason = 'insufficient inventory'
+            elif not row.lot_tracked and row.expiration_date and row.expiration_date < today:
+                # Lot-tracked expiry is checked per lot during allocation
+                reason = 'item is expired'
+            if reason:
+                failed.append({'item_id': item_id, 'quantity': quantity, 'reason': reason})
+        lot_tracked_ids = {row.id for row in rows if row.lot_tracked}
+        home_locations = {row.id: row.storage_location for row in rows}
+        sharded = {row.id: row.shard_count for row in rows if row.shard_count}
+        return failed, lot_tracked_ids, home_locations, sharded
+    
+    def _log_transaction(self, item_id: str, transaction_type: InventoryTransactionType, 
+                        quantity: int, user_id: str = None, notes: str = None,
+                        location: str = None, reference_id: str = None, transaction_id: str = None):
+        """Add an inventory transaction to the caller's unit of work"""
+        transaction_id = transaction_id or str(uuid.uuid4())
         transaction = InventoryTransaction(
             id=transaction_id,
             item_id=item_id,
             transaction_type=transaction_type,
             quantity=quantity,
-            user_id=user_id
+            timestamp=datetime.utcnow(),
+            user_id=user_id,
+            notes=notes,
+            location=location,
+            reference_id=reference_id
         )
         self.db.add(transaction)
-        self.db.commit()
@@ -0,0 +1,180 @@
+"""Inventory snapshot checkpoints rebuilt from the transaction log"""
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import case, func, insert, literal, select, union_all
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models.inventory import InventoryItem, InventoryTransaction, InventoryTransactionType, InventoryCheckpoint, InventorySnapshot, InventoryCounterShard
+import logging
+
+logger = logging.getLogger(__name__)
+
+class InventorySnapshotService:
+    """Service for point-in-time stock built from checkpoints plus transaction replay
+
+    Every stock change is recorded in inventory_transactions. A checkpoint folds the
+    transactions up to its cutoff into per-item snapshot rows, starting from the
+    previous checkpoint. An as-of query then starts from the nearest checkpoint and
+    replays only the transactions after it. Checkpoints are built from the log
+    alone, never from InventoryItem.quantity. Their cutoff trails the clock by
+    INVENTORY_CHECKPOINT_SETTLE_SECONDS so that transactions still in flight are
+    committed before they are folded.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def take_checkpoint(self, cutoff: datetime = None) -> InventoryCheckpoint:
+        """Fold transactions up to the cutoff into a new checkpoint"""
+        cutoff = cutoff or datetime.utcnow() - timedelta(seconds=settings.INVENTORY_CHECKPOINT_SETTLE_SECONDS)
+        previous = self._checkpoint_at(cutoff)
+        if previous and previous.cutoff == cutoff:
+            raise ValueError(f"Checkpoint already exists at {cutoff.isoformat()}")
+
+        checkpoint = InventoryCheckpoint(
+            id=str(uuid.uuid4()),
+            cutoff=cutoff,
+            previous_id=previous.id if previous else None
+        )
+        self.db.add(checkpoint)
+        self.db.flush()
+
+        stock = self._replayed_stock(previous, cutoff)
+        result = self.db.execute(
+            insert(InventorySnapshot).from_select(
+                ['checkpoint_id', 'item_id', 'quantity'],
+                select(literal(checkpoint.id), stock.c.item_id, stock.c.quantity)
+            )
+        )
+        checkpoint.item_count = result.rowcount
+        self.db.commit()
+        self.db.refresh(checkpoint)
+
+        logger.info(f"Inventory checkpoint taken: {checkpoint.id} at {cutoff.isoformat()} - {checkpoint.item_count} items")
+        return checkpoint
+
+    def get_stock_as_of(self, as_of: datetime, item_ids: List[str] = None) -> dict:
+        """Map item ID to quantity on hand at the given time"""
+        checkpoint = self._checkpoint_at(as_of)
+        stock = self._replayed_stock(checkpoint, as_of, item_ids)
+        rows = self.db.execute(select(stock.c.item_id, stock.c.quantity)).all()
+        return {row.item_id: int(row.quantity) for row in rows}
+
+    def get_item_stock_as_of(self, item_id: str, as_of: datetime) -> int:
+        """Quantity of one item on hand at the given time"""
+        return self.get_stock_as_of(as_of, [item_id]).get(item_id, 0)
+
+    def check_consistency(self, item_ids: List[str] = None) -> dict:
+        """Compare stock replayed from the latest checkpoint and log against current stock
+
+        Current stock is InventoryItem.quantity, or the sum of the shards for items
+        with sharded counters, whose item row only catches up at compaction.
+        """
+        checkpoint = self._checkpoint_at(None)
+        stock = self._replayed_stock(checkpoint, None, item_ids)
+        replayed = func.coalesce(stock.c.quantity, 0)
+        shards = select(
+            InventoryCounterShard.item_id,
+            func.sum(InventoryCounterShard.quantity).label('quantity')
+        ).group_by(InventoryCounterShard.item_id).subquery()
+        current = case(
+            (InventoryItem.shard_count > 0, func.coalesce(shards.c.quantity, 0)),
+            else_=InventoryItem.quantity
+        )
+
+        query = select(InventoryItem.id, current.label('quantity'), replayed.label('replayed')).outerjoin(
+            stock, stock.c.item_id == InventoryItem.id
+        ).outerjoin(shards, shards.c.item_id == InventoryItem.id)
+        if item_ids is not None:
+            query = query.where(InventoryItem.id.in_(item_ids))
+        checked = self.db.execute(select(func.count()).select_from(query.subquery())).scalar()
+        rows = self.db.execute(query.where(current != replayed)).all()
+
+        mismatches = [
+            {'item_id': row.id, 'quantity': row.quantity, 'replayed': int(row.replayed)}
+            for row in rows
+        ]
+        if mismatches:
+            logger.warning(f"Inventory consistency check found {len(mismatches)} mismatched items")
+        return {
+            'checked': checked,
+            'checkpoint_id': checkpoint.id if checkpoint else None,
+            'mismatches': mismatches
+        }
+
+    def purge_checkpoints(self, keep: int = None) -> int:
+        """Delete all but the most recent checkpoints; older as-of queries replay further back"""
+        keep = settings.INVENTORY_CHECKPOINT_RETENTION if keep is None else keep
+        stale_ids = [
+            row.id for row in self.db.query(InventoryCheckpoint.id)
+            .order_by(InventoryCheckpoint.cutoff.desc())
+            .offset(keep).all()
+        ]
+        if not stale_ids:
+            return 0
+
+        self.db.query(InventorySnapshot).filter(
+            InventorySnapshot.checkpoint_id.in_(stale_ids)
+        ).delete(synchronize_session=False)
+        self.db.query(InventoryCheckpoint).filter(
+            InventoryCheckpoint.previous_id.in_(stale_ids)
+        ).update({'previous_id': None}, synchronize_session=False)
+        self.db.query(InventoryCheckpoint).filter(
+            InventoryCheckpoint.id.in_(stale_ids)
+        ).delete(synchronize_session=False)
+        self.db.commit()
+        logger.info(f"Inventory checkpoints purged: {len(stale_ids)}")
+        return len(stale_ids)
+
+    def run_forever(self, stop_event: Optional[threading.Event] = None, interval: float = None):
+        """Take checkpoints on an interval until the stop event is set"""
+        stop_event = stop_event or threading.Event()
+        interval = settings.INVENTORY_CHECKPOINT_INTERVAL_SECONDS if interval is None else interval
+        while not stop_event.is_set():
+            try:
+                self.take_checkpoint()
+                self.purge_checkpoints()
+            except Exception as e:
+                self.db.rollback()
+                logger.error(f"Inventory checkpoint error: {e}")
+            stop_event.wait(interval)
+
+    def _checkpoint_at(self, as_of: Optional[datetime]) -> Optional[InventoryCheckpoint]:
+        """Latest checkpoint whose cutoff is not after as_of, or the latest overall"""
+        query = self.db.query(InventoryCheckpoint)
+        if as_of is not None:
+            query = query.filter(InventoryCheckpoint.cutoff <= as_of)
+        return query.order_by(InventoryCheckpoint.cutoff.desc()).first()
+
+    def _replayed_stock(self, checkpoint: Optional[InventoryCheckpoint], until: Optional[datetime],
+                        item_ids: List[str] = None):
+        """Subquery of (item_id, quantity): checkpoint snapshot plus transactions up to `until`"""
+        # CONSUME quantities are removals; every other type stores the signed change in stock
+        signed = case(
+            (InventoryTransaction.transaction_type == InventoryTransactionType.CONSUME, -InventoryTransaction.quantity),
+            else_=InventoryTransaction.quantity
+        )
+        transactions = select(InventoryTransaction.item_id.label('item_id'), signed.label('delta'))
+        if checkpoint is not None:
+            transactions = transactions.where(InventoryTransaction.timestamp > checkpoint.cutoff)
+        if until is not None:
+            transactions = transactions.where(InventoryTransaction.timestamp <= until)
+        if item_ids is not None:
+            transactions = transactions.where(InventoryTransaction.item_id.in_(item_ids))
+
+        parts = transactions
+        if checkpoint is not None:
+            snapshot = select(
+                InventorySnapshot.item_id.label('item_id'), InventorySnapshot.quantity.label('delta')
+            ).where(InventorySnapshot.checkpoint_id == checkpoint.id)
+            if item_ids is not None:
+                snapshot = snapshot.where(InventorySnapshot.item_id.in_(item_ids))
+            parts = union_all(snapshot, transactions)
+
+        movements = parts.subquery()
+        return select(
+            movements.c.item_id,
+            func.sum(movements.c.delta).label('quantity')
+        ).group_by(movements.c.item_id).subquery()
@@ -2,8 +2,13 @@
 import uuid
 from datetime import datetime
 from typing import List, Optional
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from app.models.medical_record import MedicalRecord, Diagnosis, Treatment, ClinicalNote
+from app.services.clinical_search_service import ClinicalSearchService
+from app.services.cohort_service import CohortService
+from app.services.diagnosis_code_service import DiagnosisCodeService
+from app.services.record_version_service import RecordVersionService
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,7 +20,10 @@ class MedicalRecordService:
         self.db = db
     
     def create_record(self, patient_id: str, created_by: str) -> MedicalRecord:
-        """Create a new medical record"""
+        """Create a patient's medical record, or return the latest version if one exists"""
+        existing = self.get_record(patient_id)
+        if existing:
+            return existing
         record_id = str(uuid.uuid4())
         record = MedicalRecord(
             id=record_id,
@@ -24,7 +32,15 @@ class MedicalRecordService:
             version=1
         )
         self.db.add(record)
-        self.db.commit()
+        try:
+            self.db.commit()
+        except IntegrityError:
+            # Created concurrently
+            self.db.rollback()
+            existing = self.get_record(patient_id)
+            if not existing:
+                raise
+            return existing
         self.db.refresh(record)
         logger.info(f"Medical record created: {record_id}")
         return record
@@ -34,13 +50,29 @@ class MedicalRecordService:
         query = self.db.query(MedicalRecord).filter(MedicalRecord.patient_id == patient_id)
         if version:
             query = query.filter(MedicalRecord.version == version)
-        return query.first()
+        return query.order_by(MedicalRecord.version.desc()).first()
+
+    def get_full_record(self, patient_id: str, version: int = None) -> Optional[dict]:
+        """Get a medical record version, or the latest one, with its diagnoses, treatments and notes"""
+        try:
+            return self._full_record(RecordVersionService(self.db).get_version(patient_id, version))
+        except ValueError:
+            return None
+
+    def get_full_record_history(self, patient_id: str) -> List[dict]:
+        """Get every version with its children; each child table is read once for all versions"""
+        try:
+            history = RecordVersionService(self.db).get_history(patient_id)
+        except ValueError:
+            return []
+        return [self._full_record(contents) for contents in history]
     
     def add_diagnosis(self, patient_id: str, diagnosis_code: str, description: str) -> Diagnosis:
         """Add diagnosis to medical record"""
         record = self.get_record(patient_id)
         if not record:
             raise ValueError(f"Medical record not found for patient: {patient_id}")
+        diagnosis_code = DiagnosisCodeService().validate(diagnosis_code)
         
         diagnosis_id = str(uuid.uuid4())
         diagnosis = Diagnosis(
@@ -50,8 +82,14 @@ class MedicalRecordService:
             description=description
         )
         self.db.add(diagnosis)
+        self.db.flush()
+        ClinicalSearchService(self.db).index_diagnosis(diagnosis)
         self.db.commit()
         self.db.refresh(diagnosis)
+        self._check_sealed(record)
+        CohortService(self.db).post_diagnosis(
+            diagnosis.id, patient_id, diagnosis.diagnosis_code, diagnosis.date_recorded
+        )
         logger.info(f"Diagnosis added: {diagnosis_id}")
         return diagnosis
     
@@ -74,6 +112,7 @@ class MedicalRecordService:
         self.db.add(treatment)
         self.db.commit()
         self.db.refresh(treatment)
+        self._check_sealed(record)
         logger.info(f"Treatment added: {treatment_id}")
         return treatment
     
@@ -91,8 +130,11 @@ class MedicalRecordService:
             created_by=created_by
         )
         self.db.add(note)
+        self.db.flush()
+        ClinicalSearchService(self.db).index_note(note)
         self.db.commit()
         self.db.refresh(note)
+        self._check_sealed(record)
         logger.info(f"Clinical note added: {note_id}")
         return note
     
@@ -106,3 +148,19 @@ class MedicalRecordService:
         """Verify user has access to patient's medical record"""
         # TODO: Implement access control logic
         return True
+
+    def _check_sealed(self, record: MedicalRecord):
+        """Drop the cached contents of a version that gained a successor while it was written to
+
+        Writes go to the version that was latest when read, but a new version can be
+        committed before the write is, and a reader may have cached the now sealed
+        version without it. Checking after our own commit catches every such case.
+        """
+        latest = self.get_record(record.patient_id)
+        if latest is not None and latest.id != record.id:
+            RecordVersionService.invalidate(record.id)
+
+    @staticmethod
+    def _full_record(contents: dict) -> dict:
+        """Materialized version contents keyed like a MedicalRecord with its children"""
+        return {'id': contents['record_id'], **contents}
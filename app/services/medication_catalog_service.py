@@ -0,0 +1,150 @@
+"""In-process medication catalog for prescription validation"""
+import threading
+import time
+from datetime import timedelta
+from typing import Iterable, Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from app.cache import TTLCache
+from app.config import settings
+from app.models.inventory import InventoryItem
+import logging
+
+logger = logging.getLogger(__name__)
+
+class _CatalogState:
+    """Process-wide catalog entries and the watermark they were read up to"""
+
+    def __init__(self):
+        self.entries = {}
+        self.watermark = None
+        self.refreshed_at = None
+        self.dirty = True
+        self.lock = threading.Lock()
+
+_catalog = _CatalogState()
+
+# IDs a direct read could not find, so repeated lookups of them do not read again
+_unknown_ids = TTLCache(settings.MEDICATION_CATALOG_MISS_TTL_SECONDS, settings.MEDICATION_CATALOG_MISS_CACHE_SIZE)
+
+class MedicationCatalogService:
+    """Service for medication lookups served from an in-process catalog
+
+    The first lookup loads every inventory item's catalog fields. Later refreshes
+    only read rows whose updated_at is at or after the watermark, less a small
+    overlap for writes that committed late; updated_at always comes from the
+    database clock. A refresh runs when the catalog is older than
+    MEDICATION_CATALOG_REFRESH_SECONDS or after a local inventory write invalidates
+    it, so a hit costs no database round trip. A miss reads the missing IDs
+    directly, since a row that committed long after its updated_at can fall behind
+    the watermark. An ID that read cannot find is remembered for
+    MEDICATION_CATALOG_MISS_TTL_SECONDS, so unknown IDs do not query on every call.
+    """
+
+    WATERMARK_OVERLAP = timedelta(seconds=5)
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def get_medication(self, medication_id: str) -> Optional[dict]:
+        """Catalog entry for a medication, or None if it does not exist"""
+        return self.get_medications([medication_id]).get(medication_id)
+
+    def get_medications(self, medication_ids: Iterable[str]) -> dict:
+        """Map each known medication ID to its catalog entry; unknown IDs are left out"""
+        medication_ids = list(medication_ids)
+        if self._is_stale():
+            self.refresh()
+        entries = _catalog.entries
+        unchecked = [
+            medication_id for medication_id in medication_ids
+            if medication_id not in entries and _unknown_ids.get(medication_id) is None
+        ]
+        if unchecked:
+            # Another process may have added the medication since the last refresh
+            entries = self._read_ids(unchecked)
+            for medication_id in unchecked:
+                if medication_id not in entries:
+                    _unknown_ids.set(medication_id, True)
+        return {
+            medication_id: entries[medication_id]
+            for medication_id in medication_ids if medication_id in entries
+        }
+
+    def validate_medications(self, medication_ids: Iterable[str]) -> dict:
+        """Map each medication ID to whether it exists in the catalog"""
+        medication_ids = list(medication_ids)
+        found = self.get_medications(medication_ids)
+        return {medication_id: medication_id in found for medication_id in medication_ids}
+
+    def refresh(self, full: bool = False) -> int:
+        """Read changed items since the watermark, or everything; returns rows read"""
+        with _catalog.lock:
+            # Cleared before reading so an invalidation during the read is not lost
+            _catalog.dirty = False
+            query = select(
+                InventoryItem.id, InventoryItem.name, InventoryItem.category,
+                InventoryItem.unit_cost, InventoryItem.updated_at
+            )
+            watermark = None if full else _catalog.watermark
+            if watermark is not None:
+                query = query.where(InventoryItem.updated_at >= watermark - self.WATERMARK_OVERLAP)
+            rows = self.db.execute(query).all()
+
+            entries = {} if watermark is None else dict(_catalog.entries)
+            for row in rows:
+                entries[row.id] = self._entry(row)
+            latest = max((row.updated_at for row in rows), default=None)
+            if latest is not None and (watermark is None or latest > watermark):
+                watermark = latest
+
+            # Swap in a new dict so lock-free readers never see a partial update
+            _catalog.entries = entries
+            _catalog.watermark = watermark
+            _catalog.refreshed_at = time.monotonic()
+
+        logger.debug(f"Medication catalog refreshed: {len(rows)} rows read, {len(entries)} entries")
+        return len(rows)
+
+    def load(self) -> int:
+        """Read the whole catalog, e.g. at startup so the first lookups are hits"""
+        rows = self.refresh(full=True)
+        logger.info(f"Medication catalog loaded: {len(_catalog.entries)} entries")
+        return rows
+
+    def _read_ids(self, medication_ids: list) -> dict:
+        """Read specific items into the catalog regardless of the watermark; returns the new entries"""
+        rows = self.db.execute(
+            select(InventoryItem.id, InventoryItem.name, InventoryItem.category, InventoryItem.unit_cost)
+            .where(InventoryItem.id.in_(medication_ids))
+        ).all()
+        with _catalog.lock:
+            entries = _catalog.entries
+            if rows:
+                entries = dict(entries)
+                for row in rows:
+                    entries[row.id] = self._entry(row)
+                _catalog.entries = entries
+        return entries
+
+    @staticmethod
+    def _entry(row) -> dict:
+        """Catalog entry for an item row"""
+        return {
+            'id': row.id,
+            'name': row.name,
+            'category': row.category,
+            'unit_cost': row.unit_cost
+        }
+
+    @staticmethod
+    def invalidate():
+        """Mark the catalog for an incremental refresh on its next lookup"""
+        _catalog.dirty = True
+
+    @staticmethod
+    def _is_stale() -> bool:
+        """Whether the catalog needs a refresh before serving lookups"""
+        if _catalog.dirty or _catalog.refreshed_at is None:
+            return True
+        return time.monotonic() - _catalog.refreshed_at > settings.MEDICATION_CATALOG_REFRESH_SECONDS
@@ -0,0 +1,261 @@
+"""Transactional outbox and relay for publishing domain events"""
+import json
+import queue
+from abc import ABC, abstractmethod
+import threading
+import urllib.request
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Set
+from sqlalchemy import exists, insert, or_, tuple_
+from sqlalchemy.orm import Session, aliased
+from app.config import settings
+from app.models.outbox import OutboxEvent
+import logging
+
+logger = logging.getLogger(__name__)
+
+class OutboxService:
+    """Service for writing domain events alongside the changes they describe"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def add_event(self, aggregate_type: str, aggregate_id: str, event_type: str, payload: dict) -> OutboxEvent:
+        """Add an event to the current transaction; the caller commits it with its own changes"""
+        event = OutboxEvent(
+            aggregate_type=aggregate_type,
+            aggregate_id=aggregate_id,
+            event_type=event_type,
+            payload=json.dumps(payload, default=str),
+            created_at=datetime.utcnow()
+        )
+        self.db.add(event)
+        return event
+
+    def add_events(self, events: Iterable[tuple]):
+        """Bulk-add (aggregate_type, aggregate_id, event_type, payload) events to the current transaction"""
+        now = datetime.utcnow()
+        rows = [
+            {
+                'aggregate_type': aggregate_type,
+                'aggregate_id': aggregate_id,
+                'event_type': event_type,
+                'payload': json.dumps(payload, default=str),
+                'created_at': now,
+                'attempts': 0
+            }
+            for aggregate_type, aggregate_id, event_type, payload in events
+        ]
+        if rows:
+            self.db.execute(insert(OutboxEvent), rows)
+
+    def get_pending_count(self) -> int:
+        """Count events not yet published"""
+        return self.db.query(OutboxEvent).filter(OutboxEvent.published_at.is_(None)).count()
+
+    def purge_published(self, older_than_days: int = 7) -> int:
+        """Delete events published more than the given number of days ago"""
+        cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+        deleted = self.db.query(OutboxEvent).filter(
+            OutboxEvent.published_at < cutoff
+        ).delete(synchronize_session=False)
+        self.db.commit()
+        logger.info(f"Published outbox events purged: {deleted}")
+        return deleted
+
+class OutboxSink(ABC):
+    """Destination for relayed outbox events"""
+
+    @abstractmethod
+    def publish(self, event: dict):
+        """Deliver one event, raising if it was not accepted"""
+
+    def close(self):
+        pass
+
+class FileSink(OutboxSink):
+    """Append events to a local NDJSON file"""
+
+    def __init__(self, path: str = None):
+        self.path = path or settings.OUTBOX_FILE_PATH
+        self._file = None
+
+    def publish(self, event: dict):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(event, default=str) + '\n')
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class QueueSink(OutboxSink):
+    """Put events on an in-process queue"""
+
+    def __init__(self, target: queue.Queue = None):
+        self.queue = target if target is not None else queue.Queue()
+
+    def publish(self, event: dict):
+        self.queue.put(event)
+
+class WebhookSink(OutboxSink):
+    """POST events as JSON to a webhook URL"""
+
+    def __init__(self, url: str = None, timeout: float = 5):
+        self.url = url or settings.OUTBOX_WEBHOOK_URL
+        if not self.url:
+            raise ValueError("Webhook sink requires a URL")
+        self.timeout = timeout
+
+    def publish(self, event: dict):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(event, default=str).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if response.status >= 300:
+                raise RuntimeError(f"Webhook returned status {response.status}")
+
+class OutboxRelay:
+    """Drains unpublished outbox events to sinks with at-least-once delivery
+
+    Events are delivered in insertion order. When delivery of an event fails, later
+    events for the same aggregate are held back until it succeeds, so each aggregate's
+    stream stays ordered while other aggregates keep flowing. A batch is claimed with
+    a lease of OUTBOX_CLAIM_SECONDS and committed before any sink is called, so no row
+    locks are held during delivery; a crashed relay's claims expire, and a second relay
+    skips claimed events and the aggregates behind them.
+    """
+
+    def __init__(self, db: Session, sinks: List[OutboxSink], batch_size: int = None):
+        if not sinks:
+            raise ValueError("Outbox relay requires at least one sink")
+        self.db = db
+        self.sinks = sinks
+        self.batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+
+    def drain_once(self, blocked: Optional[Set[tuple]] = None) -> dict:
+        """Publish one batch of pending events, skipping the (aggregate type, ID) streams in blocked
+
+        Streams whose delivery fails are added to blocked.
+        """
+        blocked = set() if blocked is None else blocked
+        events, messages = self._claim_batch(blocked)
+
+        stats = {'published': 0, 'failed': 0, 'deferred': 0}
+        published_at = {}
+        failed = {}
+        for message in messages:
+            stream = (message['aggregate_type'], message['aggregate_id'])
+            if stream in blocked:
+                stats['deferred'] += 1
+                continue
+            try:
+                for sink in self.sinks:
+                    sink.publish(message)
+                published_at[message['id']] = datetime.utcnow()
+                stats['published'] += 1
+            except Exception as e:
+                failed[message['id']] = str(e)[:500]
+                blocked.add(stream)
+                stats['failed'] += 1
+                logger.warning(f"Outbox event {message['id']} delivery failed: {e}")
+
+        self._record_results(events, published_at, failed)
+        if events:
+            logger.info(
+                f"Outbox relay batch: {stats['published']} published, "
+                f"{stats['failed']} failed, {stats['deferred']} deferred"
+            )
+        return stats
+
+    def drain(self) -> dict:
+        """Publish batches until nothing more can be published
+
+        Streams that fail are left out of later batches, so a stalled aggregate cannot
+        fill every batch and starve the others.
+        """
+        totals = {'published': 0, 'failed': 0, 'deferred': 0}
+        blocked = set()
+        while True:
+            stats = self.drain_once(blocked)
+            for key in totals:
+                totals[key] += stats[key]
+            # A failure blocks one more stream, so the next batch can still make progress
+            if stats['published'] == 0 and stats['failed'] == 0:
+                return totals
+
+    def run_forever(self, stop_event: Optional[threading.Event] = None, poll_interval: float = None):
+        """Poll and drain until the stop event is set"""
+        stop_event = stop_event or threading.Event()
+        poll_interval = settings.OUTBOX_POLL_SECONDS if poll_interval is None else poll_interval
+        try:
+            while not stop_event.is_set():
+                try:
+                    self.drain()
+                except Exception as e:
+                    self.db.rollback()
+                    logger.error(f"Outbox relay error: {e}")
+                stop_event.wait(poll_interval)
+        finally:
+            for sink in self.sinks:
+                sink.close()
+
+    def _claim_batch(self, blocked: Set[tuple]) -> tuple:
+        """Lease the next batch of deliverable events, commit the claim and return the events with their messages
+
+        An event is deliverable when it is unpublished and unclaimed, its stream is
+        not blocked, and no earlier event of its aggregate is claimed by another relay.
+        """
+        now = datetime.utcnow()
+        earlier = aliased(OutboxEvent)
+        unclaimed = or_(OutboxEvent.claimed_until.is_(None), OutboxEvent.claimed_until < now)
+        query = self.db.query(OutboxEvent).filter(
+            OutboxEvent.published_at.is_(None),
+            unclaimed,
+            ~exists().where(
+                earlier.aggregate_type == OutboxEvent.aggregate_type,
+                earlier.aggregate_id == OutboxEvent.aggregate_id,
+                earlier.id < OutboxEvent.id,
+                earlier.published_at.is_(None),
+                earlier.claimed_until >= now
+            )
+        )
+        if blocked:
+            query = query.filter(tuple_(OutboxEvent.aggregate_type, OutboxEvent.aggregate_id).notin_(blocked))
+        events = query.order_by(OutboxEvent.id).limit(self.batch_size).with_for_update(skip_locked=True).all()
+
+        # Messages are built before the commit so delivery never reads from the database
+        messages = [self._to_message(event) for event in events]
+        claimed_until = now + timedelta(seconds=settings.OUTBOX_CLAIM_SECONDS)
+        for event in events:
+            event.claimed_until = claimed_until
+        self.db.commit()
+        return events, messages
+
+    def _record_results(self, events: List[OutboxEvent], published_at: dict, failed: dict):
+        """Mark delivered events published, count failures and release every claim"""
+        for event in events:
+            if event.id in published_at:
+                event.published_at = published_at[event.id]
+            elif event.id in failed:
+                event.attempts += 1
+                event.last_error = failed[event.id]
+            event.claimed_until = None
+        self.db.commit()
+
+    @staticmethod
+    def _to_message(event: OutboxEvent) -> dict:
+        """Build the published representation of an event"""
+        return {
+            'id': event.id,
+            'aggregate_type': event.aggregate_type,
+            'aggregate_id': event.aggregate_id,
+            'event_type': event.event_type,
+            'payload': json.loads(event.payload),
+            'created_at': event.created_at.isoformat() if event.created_at else None
+        }
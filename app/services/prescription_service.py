@@ -1,14 +1,35 @@
 """Prescription management service"""
+import re
+import threading
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
+from decimal import Decimal
 from typing import List, Optional
+from sqlalchemy import insert, or_, select, update
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
+from app.config import settings
+from app.pagination import encode_cursor, keyset_before, clamp_limit
 from app.models.prescription import Prescription, PrescriptionItem, PrescriptionStatus
-from app.models.inventory import InventoryItem
+from app.services.outbox_service import OutboxService
+from app.services.medication_catalog_service import MedicationCatalogService
+from app.services.interaction_service import DrugInteractionService
+from app.services.inventory_service import InventoryService
+from app.services.billing_service import BillingService
 import logging
 
 logger = logging.getLogger(__name__)
 
+DURATION_PATTERN = re.compile(r'(\d+)\s*(days?|d|weeks?|wks?|w|months?|mos?|years?|yrs?|y)\b', re.IGNORECASE)
+DURATION_UNIT_DAYS = {'d': 1, 'w': 7, 'm': 30, 'y': 365}
+
+def parse_duration(duration: str) -> Optional[timedelta]:
+    """Length of a free-text duration such as '30 days' or '2 weeks'; None if it has none"""
+    match = DURATION_PATTERN.search(duration or '')
+    if not match:
+        return None
+    return timedelta(days=int(match.group(1)) * DURATION_UNIT_DAYS[match.group(2)[0].lower()])
+
 class PrescriptionService:
     """Service for prescription management"""
     
@@ -23,14 +44,19 @@ class PrescriptionService:
                 raise ValueError(f"Missing required field: {field}")
         
         # Validate medication exists
-        medication = self.db.query(InventoryItem).filter(
-            InventoryItem.id == prescription_data['medication_id']
-        ).first()
-        
-        if not medication:
+        if not self.validate_medication(prescription_data['medication_id']):
             raise ValueError(f"Medication not found: {prescription_data['medication_id']}")
         
+        item_rows = self._build_item_rows(prescription_data)
+        
+        # Warn about interactions with the patient's other active prescriptions
+        warnings = DrugInteractionService(self.db).check_new_medication(
+            prescription_data['patient_id'], prescription_data['medication_id']
+        )
+        
         prescription_id = str(uuid.uuid4())
+        length = parse_duration(prescription_data['duration'])
+        now = datetime.utcnow()
         prescription = Prescription(
             id=prescription_id,
             patient_id=prescription_data['patient_id'],
@@ -39,24 +65,243 @@ class PrescriptionService:
             dosage=prescription_data['dosage'],
             frequency=prescription_data['frequency'],
             duration=prescription_data['duration'],
-            status=PrescriptionStatus.ACTIVE
+            status=PrescriptionStatus.ACTIVE,
+            expires_at=now + length if length else None,
+            # Set here rather than by the server so keyset cursors round-trip exactly
+            created_at=now
         )
         
         self.db.add(prescription)
+        if item_rows:
+            self.db.flush()
+            for row in item_rows:
+                row['prescription_id'] = prescription_id
+            self.db.execute(insert(PrescriptionItem), item_rows)
+        OutboxService(self.db).add_event('prescription', prescription_id, 'prescription.created', {
+            'patient_id': prescription.patient_id,
+            'doctor_id': prescription.doctor_id,
+            'medication_id': prescription.medication_id,
+            'dosage': prescription.dosage,
+            'frequency': prescription.frequency,
+            'duration': prescription.duration
+        })
         self.db.commit()
         self.db.refresh(prescription)
+        prescription.interaction_warnings = warnings
+        if warnings:
+            logger.warning(f"Prescription {prescription_id} has {len(warnings)} interaction warnings")
         logger.info(f"Prescription created: {prescription_id}")
         return prescription
     
+    def dispense_prescription(self, prescription_id: str, user_id: str = None,
+                              department_id: str = None) -> dict:
+        """Fill a prescription: stock decrement, billing and status change in one transaction"""
+        prescription = self.db.query(Prescription).filter(
+            Prescription.id == prescription_id
+        ).with_for_update().first()
+        if not prescription:
+            raise ValueError(f"Prescription not found: {prescription_id}")
+        items = self._load_items([prescription_id]).get(prescription_id, [])
+        
+        try:
+            billing_record = self._dispense(prescription, items, user_id, department_id)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        InventoryService.stock_changed()
+        
+        logger.info(f"Prescription dispensed: {prescription_id} - billing {billing_record.id}")
+        return {'prescription_id': prescription_id, 'billing_id': billing_record.id, 'status': prescription.status.value}
+    
+    def dispense_prescriptions(self, prescription_ids: List[str], user_id: str = None,
+                               department_id: str = None) -> dict:
+        """Dispense many prescriptions, e.g. a ward medication round, in one transaction
+
+        Each prescription is dispensed in its own savepoint, so one that cannot be
+        filled, including one that hits a database error, is reported without
+        holding back the others.
+        """
+        if not prescription_ids:
+            raise ValueError("Dispense batch must contain at least one prescription")
+        prescription_ids = sorted(set(prescription_ids))
+        self._begin_outer_transaction()
+        # Lock in ID order so concurrent rounds cannot deadlock
+        prescriptions = {
+            prescription.id: prescription
+            for prescription in self.db.query(Prescription).filter(
+                Prescription.id.in_(prescription_ids)
+            ).order_by(Prescription.id).with_for_update().all()
+        }
+        items = self._load_items(prescription_ids)
+        
+        report = {'dispensed': [], 'failed': []}
+        for prescription_id in prescription_ids:
+            prescription = prescriptions.get(prescription_id)
+            if prescription is None:
+                report['failed'].append({'prescription_id': prescription_id, 'reason': 'prescription not found'})
+                continue
+            savepoint = self.db.begin_nested()
+            try:
+                billing_record = self._dispense(prescription, items.get(prescription_id, []), user_id, department_id)
+            except ValueError as e:
+                savepoint.rollback()
+                report['failed'].append({'prescription_id': prescription_id, 'reason': str(e)})
+                continue
+            except SQLAlchemyError as e:
+                savepoint.rollback()
+                logger.error(f"Dispense database error: {prescription_id} - {e}")
+                report['failed'].append({'prescription_id': prescription_id, 'reason': f"database error: {e.__class__.__name__}"})
+                continue
+            savepoint.commit()
+            report['dispensed'].append({'prescription_id': prescription_id, 'billing_id': billing_record.id})
+        
+        self.db.commit()
+        if report['dispensed']:
+            InventoryService.stock_changed()
+        logger.info(f"Prescriptions dispensed: {len(report['dispensed'])} of {len(prescription_ids)}")
+        return report
+    
     def get_prescription(self, prescription_id: str) -> Optional[Prescription]:
         """Get prescription by ID"""
         return self.db.query(Prescription).filter(Prescription.id == prescription_id).first()
     
+    def query_prescriptions(self, patient_id: str, statuses: List[str] = None, start_date: datetime = None,
+                            end_date: datetime = None, limit: int = None, cursor: str = None) -> List[Prescription]:
+        """Get a patient's prescriptions, newest first, optionally filtered by status and creation date"""
+        query = self.db.query(Prescription).filter(Prescription.patient_id == patient_id)
+        if statuses:
+            query = query.filter(Prescription.status.in_([PrescriptionStatus(s) for s in statuses]))
+        if start_date:
+            query = query.filter(Prescription.created_at >= start_date)
+        if end_date:
+            query = query.filter(Prescription.created_at < end_date)
+        after_cursor = keyset_before(Prescription.created_at, Prescription.id, cursor)
+        if after_cursor is not None:
+            query = query.filter(after_cursor)
+        
+        query = query.order_by(Prescription.created_at.desc(), Prescription.id.desc())
+        if limit:
+            query = query.limit(limit)
+        return query.all()
+    
+    def get_prescriptions_page(self, patient_id: str, statuses: List[str] = None, start_date: datetime = None,
+                               end_date: datetime = None, limit: int = None, cursor: str = None) -> dict:
+        """Get one page of a patient's prescriptions with a cursor for the next page"""
+        limit = clamp_limit(limit, settings.PRESCRIPTION_PAGE_SIZE, settings.PRESCRIPTION_MAX_PAGE_SIZE)
+        prescriptions = self.query_prescriptions(patient_id, statuses, start_date, end_date, limit + 1, cursor)
+        
+        has_more = len(prescriptions) > limit
+        prescriptions = prescriptions[:limit]
+        next_cursor = encode_cursor(prescriptions[-1].created_at, prescriptions[-1].id) if has_more else None
+        return {
+            'patient_id': patient_id,
+            'prescriptions': prescriptions,
+            'next_cursor': next_cursor
+        }
+    
+    def get_active_prescriptions(self, patient_id: str) -> List[Prescription]:
+        """Get a patient's active prescriptions, leaving out any past expiry the sweep has not reached"""
+        return self.get_active_prescriptions_for_patients([patient_id]).get(patient_id, [])
+    
+    def get_active_prescriptions_for_patients(self, patient_ids: List[str]) -> dict:
+        """Map each patient to their active prescriptions, newest first, with one query"""
+        grouped = {patient_id: [] for patient_id in patient_ids}
+        if not patient_ids:
+            return grouped
+        prescriptions = self.db.query(Prescription).filter(
+            Prescription.patient_id.in_(set(patient_ids)),
+            Prescription.status == PrescriptionStatus.ACTIVE,
+            or_(Prescription.expires_at.is_(None), Prescription.expires_at > datetime.utcnow())
+        ).order_by(Prescription.patient_id, Prescription.created_at.desc(), Prescription.id.desc()).all()
+        for prescription in prescriptions:
+            grouped[prescription.patient_id].append(prescription)
+        return grouped
+    
+    def expire_prescriptions(self, batch_size: int = None, now: datetime = None) -> int:
+        """Mark active prescriptions past their expiry as EXPIRED, one committed batch at a time"""
+        batch_size = batch_size or settings.PRESCRIPTION_EXPIRY_BATCH_SIZE
+        now = now or datetime.utcnow()
+        expired = 0
+        while True:
+            rows = self.db.execute(
+                select(Prescription.id, Prescription.patient_id)
+                .where(Prescription.status == PrescriptionStatus.ACTIVE, Prescription.expires_at <= now)
+                .order_by(Prescription.expires_at)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if not rows:
+                break
+            
+            # Only rows still active are expired and counted; another worker may have changed the rest
+            changed = self.db.execute(
+                update(Prescription)
+                .where(Prescription.id.in_([row.id for row in rows]), Prescription.status == PrescriptionStatus.ACTIVE)
+                .values(status=PrescriptionStatus.EXPIRED, updated_at=now)
+                .returning(Prescription.id, Prescription.patient_id)
+                .execution_options(synchronize_session=False)
+            ).all()
+            OutboxService(self.db).add_events(
+                ('prescription', row.id, 'prescription.status_changed', {
+                    'patient_id': row.patient_id,
+                    'status': PrescriptionStatus.EXPIRED.value
+                })
+                for row in changed
+            )
+            self.db.commit()
+            expired += len(changed)
+            if len(rows) < batch_size:
+                break
+        
+        if expired:
+            logger.info(f"Prescriptions expired: {expired}")
+        return expired
+    
+    def backfill_expires_at(self, batch_size: int = None) -> int:
+        """Parse expires_at for prescriptions written before it existed; returns rows updated"""
+        batch_size = batch_size or settings.PRESCRIPTION_EXPIRY_BATCH_SIZE
+        updated = 0
+        after_id = ''
+        while True:
+            rows = self.db.execute(
+                select(Prescription.id, Prescription.duration, Prescription.created_at)
+                .where(Prescription.expires_at.is_(None), Prescription.id > after_id)
+                .order_by(Prescription.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            after_id = rows[-1].id
+            
+            changes = []
+            for row in rows:
+                length = parse_duration(row.duration)
+                if length:
+                    changes.append({'id': row.id, 'expires_at': row.created_at + length})
+            if changes:
+                self.db.execute(update(Prescription), changes)
+            self.db.commit()
+            updated += len(changes)
+        
+        logger.info(f"Prescription expiry backfilled: {updated} rows")
+        return updated
+    
+    def run_expiry_sweep(self, stop_event: Optional[threading.Event] = None, interval: float = None):
+        """Expire prescriptions on an interval until the stop event is set"""
+        stop_event = stop_event or threading.Event()
+        interval = settings.PRESCRIPTION_EXPIRY_SWEEP_SECONDS if interval is None else interval
+        while not stop_event.is_set():
+            try:
+                self.expire_prescriptions()
+            except Exception as e:
+                self.db.rollback()
+                logger.error(f"Prescription expiry sweep error: {e}")
+            stop_event.wait(interval)
+    
     def get_patient_prescriptions(self, patient_id: str) -> List[Prescription]:
         """Get all prescriptions for a patient"""
-        return self.db.query(Prescription).filter(
-            Prescription.patient_id == patient_id
-        ).order_by(Prescription.created_at.desc()).all()
+        return self.query_prescriptions(patient_id)
     
     def update_prescription_status(self, prescription_id: str, status: str) -> Prescription:
         """Update prescription status"""
@@ -67,6 +312,11 @@ class PrescriptionService:
         prescription.status = PrescriptionStatus(status)
         prescription.updated_at = datetime.utcnow()
         
+        OutboxService(self.db).add_event('prescription', prescription_id, 'prescription.status_changed', {
+            'patient_id': prescription.patient_id,
+            'status': prescription.status.value
+        })
+        
         self.db.commit()
         self.db.refresh(prescription)
         logger.info(f"Prescription status updated: {prescription_id} -> {status}")
@@ -74,13 +324,102 @@ class PrescriptionService:
     
     def validate_medication(self, medication_id: str) -> bool:
         """Validate medication exists in inventory"""
-        medication = self.db.query(InventoryItem).filter(
-            InventoryItem.id == medication_id
-        ).first()
-        return medication is not None
+        return MedicationCatalogService(self.db).validate_medications([medication_id])[medication_id]
+    
+    def validate_medications(self, medication_ids: List[str]) -> dict:
+        """Validate a list of medications; no database round trip when all are cached"""
+        return MedicationCatalogService(self.db).validate_medications(medication_ids)
     
     def get_prescription_history(self, patient_id: str) -> List[Prescription]:
         """Get prescription history for a patient"""
-        return self.db.query(Prescription).filter(
-            Prescription.patient_id == patient_id
-        ).order_by(Prescription.created_at.desc()).all()
+        return self.query_prescriptions(patient_id)
+    
+    def _begin_outer_transaction(self):
+        """Open the database transaction explicitly on SQLite, before any savepoint
+
+        pysqlite only begins a transaction before DML, so a SAVEPOINT would be the
+        outermost statement and its RELEASE would commit on its own.
+        """
+        if self.db.get_bind().dialect.name != 'sqlite':
+            return
+        connection = self.db.connection()
+        if not connection.connection.dbapi_connection.in_transaction:
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+    def _dispense(self, prescription: Prescription, items: List[PrescriptionItem],
+                  user_id: str = None, department_id: str = None):
+        """Stage the stock decrement, billing record and FILLED transition; the caller commits
+
+        The caller rolls back its transaction or savepoint when this raises, so the
+        stock step takes no savepoint of its own and cannot outlive a later failure.
+        """
+        if prescription.status != PrescriptionStatus.ACTIVE:
+            raise ValueError(f"Prescription is not active: {prescription.id} ({prescription.status.value})")
+        if prescription.expires_at and prescription.expires_at <= datetime.utcnow():
+            raise ValueError(f"Prescription has expired: {prescription.id}")
+        if not items:
+            raise ValueError(f"Prescription has no items to dispense: {prescription.id}")
+        
+        report, applied = InventoryService(self.db).stage_consumption(
+            [{'item_id': item.medication_id, 'quantity': item.quantity} for item in items],
+            'all_or_nothing', user_id, nested=False
+        )
+        if not applied:
+            reasons = ', '.join(f"{line['item_id']}: {line['reason']}" for line in report['failed'])
+            raise ValueError(f"Cannot dispense {prescription.id}: {reasons}")
+        
+        billing_record = BillingService(self.db).stage_billing_record(prescription.patient_id, [
+            {
+                'service_type': 'pharmacy',
+                'quantity': item.quantity,
+                'unit_price': item.unit_price,
+                'total_price': item.unit_price * item.quantity
+            }
+            for item in items
+        ], department_id)
+        
+        prescription.status = PrescriptionStatus.FILLED
+        prescription.updated_at = datetime.utcnow()
+        OutboxService(self.db).add_event('prescription', prescription.id, 'prescription.status_changed', {
+            'patient_id': prescription.patient_id,
+            'status': prescription.status.value
+        })
+        OutboxService(self.db).add_event('prescription', prescription.id, 'prescription.dispensed', {
+            'patient_id': prescription.patient_id,
+            'billing_id': billing_record.id,
+            'items': [{'medication_id': item.medication_id, 'quantity': item.quantity} for item in items]
+        })
+        self.db.flush()
+        return billing_record
+    
+    def _load_items(self, prescription_ids: List[str]) -> dict:
+        """Prescription items grouped by prescription ID, with one query"""
+        grouped = {}
+        for item in self.db.query(PrescriptionItem).filter(
+            PrescriptionItem.prescription_id.in_(prescription_ids)
+        ).order_by(PrescriptionItem.prescription_id, PrescriptionItem.id):
+            grouped.setdefault(item.prescription_id, []).append(item)
+        return grouped
+    
+    def _build_item_rows(self, prescription_data: dict) -> List[dict]:
+        """Validate the optional dispensable items of a new prescription"""
+        items = prescription_data.get('items') or []
+        medication_ids = [item.get('medication_id') or prescription_data['medication_id'] for item in items]
+        catalog = MedicationCatalogService(self.db).get_medications(medication_ids)
+        
+        rows = []
+        for item, medication_id in zip(items, medication_ids):
+            if medication_id not in catalog:
+                raise ValueError(f"Medication not found: {medication_id}")
+            if not item.get('quantity') or item['quantity'] <= 0:
+                raise ValueError(f"Prescription item quantity must be positive: {medication_id}")
+            unit_price = item.get('unit_price')
+            rows.append({
+                'id': str(uuid.uuid4()),
+                'medication_id': medication_id,
+                'quantity': item['quantity'],
+                # Priced at the medication's unit cost unless given
+                'unit_price': Decimal(str(unit_price)) if unit_price is not None else catalog[medication_id]['unit_cost'],
+                'created_at': datetime.utcnow()
+            })
+        return rows
@@ -0,0 +1,283 @@
+"""Copy-on-write medical record versions stored as deltas"""
+import uuid
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
+from app.cache import TTLCache
+from app.config import settings
+from app.models.medical_record import MedicalRecord, MedicalRecordRemoval, Diagnosis, Treatment, ClinicalNote
+from app.services.cohort_service import CohortService
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Entry type -> (MedicalRecord relationship, model, serialized fields)
+ENTRY_TYPES = {
+    'diagnosis': ('diagnoses', Diagnosis, ('diagnosis_code', 'description', 'date_recorded')),
+    'treatment': ('treatments', Treatment, ('treatment_type', 'description', 'date_started', 'date_ended')),
+    'note': ('clinical_notes', ClinicalNote, ('note_text', 'created_by', 'created_at'))
+}
+
+# Materialized contents of sealed versions, keyed by record ID. A version is
+# sealed once it has a successor, since writes only go to the latest version.
+_materialized = TTLCache(settings.RECORD_VERSION_CACHE_SECONDS, maxsize=settings.RECORD_VERSION_CACHE_SIZE)
+
+# Attempts at numbering a new version when other versions are created concurrently
+CREATE_VERSION_ATTEMPTS = 3
+
+class RecordVersionService:
+    """Service for medical record versions that share entries with their ancestors
+
+    A new version copies nothing: it starts empty and records the diagnoses,
+    treatments and notes added to it and the entries removed in it. Its contents
+    are rebuilt by replaying the deltas of every version up to it, starting from
+    the nearest ancestor already materialized in the cache, with one query per
+    child table for the whole replay. A diff between two versions reads only the
+    deltas between them.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    @staticmethod
+    def invalidate(record_id: str):
+        """Drop the cached contents of a version"""
+        _materialized.invalidate(record_id)
+
+    @staticmethod
+    def is_cached(record_id: str) -> bool:
+        """Whether the contents of a version are cached"""
+        return _materialized.get(record_id) is not None
+
+    def create_version(self, patient_id: str, created_by: str) -> MedicalRecord:
+        """Start a new version of the patient's record on top of the latest one
+
+        Version numbers are unique per patient, so a creator that loses a race for
+        the next number retries on top of the version that won.
+        """
+        for attempt in range(CREATE_VERSION_ATTEMPTS):
+            latest = self._latest(patient_id)
+            if not latest:
+                raise ValueError(f"Medical record not found for patient: {patient_id}")
+
+            record = MedicalRecord(
+                id=str(uuid.uuid4()),
+                patient_id=patient_id,
+                created_by=created_by,
+                version=latest.version + 1
+            )
+            self.db.add(record)
+            try:
+                self.db.commit()
+                break
+            except IntegrityError:
+                self.db.rollback()
+                if attempt == CREATE_VERSION_ATTEMPTS - 1:
+                    raise ValueError(f"Medical record version conflict for patient: {patient_id}")
+        self.db.refresh(record)
+        logger.info(f"Medical record version created: {patient_id} v{record.version}")
+        return record
+
+    def remove_entry(self, patient_id: str, entry_type: str, entry_id: str, removed_by: str) -> MedicalRecordRemoval:
+        """Remove a diagnosis, treatment or note from the latest version onwards"""
+        model = self._entry_model(entry_type)
+        latest = self._latest(patient_id)
+        if not latest:
+            raise ValueError(f"Medical record not found for patient: {patient_id}")
+
+        entry = self.db.query(model.id).join(MedicalRecord, MedicalRecord.id == model.record_id).filter(
+            model.id == entry_id,
+            MedicalRecord.patient_id == patient_id
+        ).first()
+        if not entry:
+            raise ValueError(f"{entry_type.capitalize()} not found in medical record: {entry_id}")
+        removed = self.db.query(MedicalRecordRemoval.id).filter(
+            MedicalRecordRemoval.entry_type == entry_type,
+            MedicalRecordRemoval.entry_id == entry_id
+        ).first()
+        if removed:
+            raise ValueError(f"{entry_type.capitalize()} already removed: {entry_id}")
+
+        removal = MedicalRecordRemoval(
+            id=str(uuid.uuid4()),
+            record_id=latest.id,
+            entry_type=entry_type,
+            entry_id=entry_id,
+            removed_by=removed_by
+        )
+        self.db.add(removal)
+        self.db.commit()
+        self.db.refresh(removal)
+        # The version may have been sealed and cached without this removal; see MedicalRecordService._check_sealed
+        if self._latest(patient_id).id != latest.id:
+            self.invalidate(latest.id)
+        if entry_type == 'diagnosis':
+            diagnosis = self.db.get(Diagnosis, entry_id)
+            CohortService(self.db).post_diagnosis(
+                entry_id, patient_id, diagnosis.diagnosis_code, diagnosis.date_recorded, added=False
+            )
+        logger.info(f"Medical record entry removed: {entry_type} {entry_id} in v{latest.version}")
+        return removal
+
+    def get_version(self, patient_id: str, version: int = None) -> dict:
+        """Full contents of a version, or of the latest one"""
+        versions = self._versions(patient_id)
+        target = self._find(versions, version) if version else versions[-1]
+        chain = [header for header in versions if header.version <= target.version]
+
+        state, start = None, 0
+        for i in range(len(chain) - 1, -1, -1):
+            cached = _materialized.get(chain[i].id)
+            if cached is not None:
+                state, start = cached, i + 1
+                break
+        state = self._replay(state, chain[start:])
+        if target.id != versions[-1].id:
+            _materialized.set(target.id, state)
+        return self._contents(patient_id, target, state)
+
+    def get_history(self, patient_id: str) -> list:
+        """Full contents of every version, newest first, from one replay of all deltas"""
+        versions = self._versions(patient_id)
+        deltas = self._load_deltas(versions)
+        history, state = [], None
+        for header in versions:
+            state = self._replay(state, [header], deltas)
+            if header.id != versions[-1].id:
+                _materialized.set(header.id, state)
+            history.append(self._contents(patient_id, header, state))
+        return history[::-1]
+
+    def diff_versions(self, patient_id: str, from_version: int, to_version: int) -> dict:
+        """Entries added and removed going from one version to another"""
+        versions = self._versions(patient_id)
+        self._find(versions, from_version)
+        self._find(versions, to_version)
+        low, high = sorted((from_version, to_version))
+        between = [header for header in versions if low < header.version <= high]
+
+        added = {relation: {} for relation, _, _ in ENTRY_TYPES.values()}
+        removed_ids = {entry_type: [] for entry_type in ENTRY_TYPES}
+        records, removals = self._load_deltas(between)
+        for header in between:
+            for relation, _, fields in ENTRY_TYPES.values():
+                for entry in getattr(records[header.id], relation):
+                    added[relation][entry.id] = self._serialize(entry, fields, header.version)
+            for removal in removals.get(header.id, []):
+                relation = ENTRY_TYPES[removal.entry_type][0]
+                # An entry added and removed within the range never shows up in either version
+                if added[relation].pop(removal.entry_id, None) is None:
+                    removed_ids[removal.entry_type].append(removal.entry_id)
+
+        removed = {relation: [] for relation, _, _ in ENTRY_TYPES.values()}
+        for entry_type, entry_ids in removed_ids.items():
+            if entry_ids:
+                relation, model, fields = ENTRY_TYPES[entry_type]
+                rows = self.db.query(model, MedicalRecord.version).join(
+                    MedicalRecord, MedicalRecord.id == model.record_id
+                ).filter(model.id.in_(entry_ids)).all()
+                removed[relation] = [self._serialize(row, fields, row_version) for row, row_version in rows]
+
+        added = {relation: list(entries.values()) for relation, entries in added.items()}
+        if from_version > to_version:
+            added, removed = removed, added
+        return {
+            'patient_id': patient_id,
+            'from_version': from_version,
+            'to_version': to_version,
+            'added': added,
+            'removed': removed
+        }
+
+    def _versions(self, patient_id: str) -> list:
+        """Headers of every version of the patient's record, oldest first"""
+        versions = self.db.query(
+            MedicalRecord.id, MedicalRecord.version, MedicalRecord.created_by,
+            MedicalRecord.created_at, MedicalRecord.updated_at
+        ).filter(MedicalRecord.patient_id == patient_id).order_by(MedicalRecord.version).all()
+        if not versions:
+            raise ValueError(f"Medical record not found for patient: {patient_id}")
+        return versions
+
+    def _latest(self, patient_id: str):
+        """Latest version of the patient's record, or None"""
+        return self.db.query(MedicalRecord).filter(
+            MedicalRecord.patient_id == patient_id
+        ).order_by(MedicalRecord.version.desc()).first()
+
+    @staticmethod
+    def _find(versions: list, version: int):
+        """Header of one version, which must exist"""
+        for header in versions:
+            if header.version == version:
+                return header
+        raise ValueError(f"Medical record version not found: {version}")
+
+    def _replay(self, state, headers: list, deltas: tuple = None) -> dict:
+        """Apply the deltas of the given versions, oldest first, to a materialized state"""
+        # Copied so a cached state is never modified
+        state = {
+            relation: dict(state[relation]) if state else {}
+            for relation, _, _ in ENTRY_TYPES.values()
+        }
+        records, removals = deltas or self._load_deltas(headers)
+        for header in headers:
+            for relation, _, fields in ENTRY_TYPES.values():
+                for entry in getattr(records[header.id], relation):
+                    state[relation][entry.id] = self._serialize(entry, fields, header.version)
+            for removal in removals.get(header.id, []):
+                state[ENTRY_TYPES[removal.entry_type][0]].pop(removal.entry_id, None)
+        return state
+
+    def _load_deltas(self, headers: list) -> tuple:
+        """Entries and removals recorded in the given versions, one query per table"""
+        if not headers:
+            return {}, {}
+        ids = [header.id for header in headers]
+        records = {
+            record.id: record for record in self.db.query(MedicalRecord)
+            .options(*self.child_loaders())
+            .filter(MedicalRecord.id.in_(ids)).populate_existing().all()
+        }
+        removals = {}
+        for removal in self.db.query(MedicalRecordRemoval).filter(
+            MedicalRecordRemoval.record_id.in_(ids)
+        ).order_by(MedicalRecordRemoval.removed_at).all():
+            removals.setdefault(removal.record_id, []).append(removal)
+        return records, removals
+
+    @staticmethod
+    def child_loaders() -> tuple:
+        """Select-in loaders for a record's children: one IN query per child table"""
+        return (
+            selectinload(MedicalRecord.diagnoses),
+            selectinload(MedicalRecord.treatments),
+            selectinload(MedicalRecord.clinical_notes)
+        )
+
+    @staticmethod
+    def _contents(patient_id: str, header, state: dict) -> dict:
+        """A version's header with its materialized entries"""
+        return {
+            'record_id': header.id,
+            'patient_id': patient_id,
+            'version': header.version,
+            'created_by': header.created_by,
+            'created_at': header.created_at,
+            'updated_at': header.updated_at,
+            **{relation: list(state[relation].values()) for relation, _, _ in ENTRY_TYPES.values()}
+        }
+
+    @staticmethod
+    def _entry_model(entry_type: str):
+        """Model for an entry type"""
+        if entry_type not in ENTRY_TYPES:
+            raise ValueError(f"Unknown medical record entry type: {entry_type}")
+        return ENTRY_TYPES[entry_type][1]
+
+    @staticmethod
+    def _serialize(entry, fields: tuple, version: int) -> dict:
+        """Entry as a dict, tagged with the version that added it"""
+        serialized = {'id': entry.id, 'version': version}
+        for field in fields:
+            serialized[field] = getattr(entry, field)
+        return serialized
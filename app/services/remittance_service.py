@@ -0,0 +1,232 @@
+"""Bulk remittance file ingestion service"""
+import csv
+import hashlib
+import json
+import uuid
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from typing import Iterable, Iterator, List, TextIO
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models.billing import BillingRecord, Payment, BillingStatus, PaymentStatus
+from app.services.billing_service import BillingService
+from app.services.outbox_service import OutboxService
+import logging
+
+logger = logging.getLogger(__name__)
+
+class RemittanceService:
+    """Service for posting insurer remittance files as payments
+
+    Every payment keeps its remittance ID and line number under a unique
+    constraint, so re-sending a file, or resuming one that failed part way,
+    skips the lines already posted. The remittance ID defaults to the SHA-256
+    of the file contents.
+    """
+
+    SUPPORTED_FORMATS = ('csv', 'ndjson')
+    DEFAULT_PAYMENT_METHOD = 'insurance_remittance'
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def ingest(self, stream: TextIO, file_format: str = 'csv', chunk_size: int = None,
+               remittance_id: str = None) -> dict:
+        """Ingest a remittance file and return a summary of applied, skipped and unmatched lines"""
+        chunk_size = chunk_size or settings.REMITTANCE_CHUNK_SIZE
+        remittance_id = remittance_id or self.file_hash(stream)
+        report = {
+            'remittance_id': remittance_id,
+            'lines_read': 0,
+            'payments_applied': 0,
+            'lines_already_posted': 0,
+            'amount_applied': Decimal('0'),
+            'bills_paid': 0,
+            'unmatched': []
+        }
+
+        lines = self.parse_lines(stream, file_format)
+        while True:
+            chunk = list(islice(lines, chunk_size))
+            if not chunk:
+                break
+            try:
+                self._apply_chunk(remittance_id, chunk, report)
+            except IntegrityError:
+                # A concurrent ingest of the same file posted some of these lines first
+                logger.warning(f"Remittance {remittance_id} chunk raced another ingest, retrying")
+                self._apply_chunk(remittance_id, chunk, report)
+
+        logger.info(
+            f"Remittance ingested: {report['payments_applied']} of {report['lines_read']} lines applied, "
+            f"{len(report['unmatched'])} unmatched"
+        )
+        return report
+
+    @staticmethod
+    def file_hash(stream: TextIO) -> str:
+        """SHA-256 of a seekable stream's contents, leaving the stream at the start"""
+        if not stream.seekable():
+            raise ValueError("A remittance ID is required for a stream that cannot be re-read")
+        digest = hashlib.sha256()
+        for block in iter(lambda: stream.read(1 << 16), ''):
+            digest.update(block.encode('utf-8'))
+        stream.seek(0)
+        return digest.hexdigest()
+
+    def parse_lines(self, stream: TextIO, file_format: str = 'csv') -> Iterator[dict]:
+        """Stream remittance lines as dicts with line number, billing ID, amount and method"""
+        if file_format not in self.SUPPORTED_FORMATS:
+            raise ValueError(f"Unsupported remittance format: {file_format}")
+
+        if file_format == 'csv':
+            reader = csv.DictReader(stream)
+            # line_num counts physical lines, so quoted newlines and blank lines keep numbers true
+            rows = ((reader.line_num, row) for row in reader)
+        else:
+            rows = self._read_ndjson(stream)
+
+        for line_no, row in rows:
+            yield {
+                'line': line_no,
+                'billing_id': (row.get('billing_id') or '').strip(),
+                'amount': row.get('amount'),
+                'payment_method': (row.get('payment_method') or '').strip() or self.DEFAULT_PAYMENT_METHOD
+            }
+
+    def _apply_chunk(self, remittance_id: str, chunk: List[dict], report: dict):
+        """Apply one chunk of lines in a single transaction; the report only changes once it commits"""
+        billing_ids = {line['billing_id'] for line in chunk if line['billing_id']}
+        records = self._load_billing_records(billing_ids)
+        paid_totals = BillingService(self.db).get_paid_totals(billing_ids)
+        posted = self._posted_lines(remittance_id, [line['line'] for line in chunk])
+
+        payment_rows = []
+        paid_ids = set()
+        unmatched = []
+        amount_applied = Decimal('0')
+        posted_at = datetime.utcnow()
+        for line in chunk:
+            if line['line'] in posted:
+                continue
+            reason = None
+            amount = self._parse_amount(line['amount'])
+            record = records.get(line['billing_id'])
+            if amount is None:
+                reason = 'invalid amount'
+            elif record is None:
+                reason = 'billing record not found'
+            elif record.is_finalized:
+                reason = 'billing record is finalized'
+
+            if reason:
+                unmatched.append({
+                    'line': line['line'],
+                    'billing_id': line['billing_id'],
+                    'amount': line['amount'],
+                    'reason': reason
+                })
+                continue
+
+            payment_rows.append({
+                'id': str(uuid.uuid4()),
+                'billing_id': record.id,
+                'amount': amount,
+                'payment_method': line['payment_method'],
+                'status': PaymentStatus.COMPLETED,
+                'remittance_id': remittance_id,
+                'remittance_line': line['line'],
+                'created_at': posted_at
+            })
+            amount_applied += amount
+
+            # Same rule as BillingService.process_payment: paid once the payments cover the responsibility
+            paid_totals[record.id] = paid_totals.get(record.id, Decimal('0')) + amount
+            if paid_totals[record.id] >= record.patient_responsibility and record.status != BillingStatus.PAID:
+                paid_ids.add(record.id)
+
+        events = [
+            ('billing_record', row['billing_id'], 'payment.completed', {
+                'payment_id': row['id'],
+                'amount': row['amount'],
+                'payment_method': row['payment_method'],
+                'billing_status': (
+                    BillingStatus.PAID.value if row['billing_id'] in paid_ids
+                    else records[row['billing_id']].status.value
+                )
+            })
+            for row in payment_rows
+        ]
+        
+        try:
+            if payment_rows:
+                self.db.execute(insert(Payment), payment_rows)
+                OutboxService(self.db).add_events(events)
+            if paid_ids:
+                self.db.execute(
+                    update(BillingRecord)
+                    .where(BillingRecord.id.in_(paid_ids))
+                    .values(status=BillingStatus.PAID, updated_at=datetime.utcnow())
+                    .execution_options(synchronize_session=False)
+                )
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            logger.error(f"Remittance {remittance_id} chunk failed after {report['lines_read']} lines")
+            raise
+
+        report['lines_read'] += len(chunk)
+        report['payments_applied'] += len(payment_rows)
+        report['lines_already_posted'] += len(posted)
+        report['amount_applied'] += amount_applied
+        report['bills_paid'] += len(paid_ids)
+        report['unmatched'].extend(unmatched)
+
+    def _posted_lines(self, remittance_id: str, line_numbers: List[int]) -> set:
+        """Line numbers of this remittance that already have a payment; lines arrive in file order"""
+        if not line_numbers:
+            return set()
+        rows = self.db.query(Payment.remittance_line).filter(
+            Payment.remittance_id == remittance_id,
+            Payment.remittance_line.between(line_numbers[0], line_numbers[-1])
+        ).all()
+        return {row.remittance_line for row in rows}
+
+    def _load_billing_records(self, billing_ids: Iterable[str]) -> dict:
+        """Resolve billing IDs with one IN-query per chunk"""
+        if not billing_ids:
+            return {}
+        rows = self.db.query(
+            BillingRecord.id,
+            BillingRecord.patient_responsibility,
+            BillingRecord.status,
+            BillingRecord.is_finalized
+        ).filter(BillingRecord.id.in_(billing_ids)).all()
+        return {row.id: row for row in rows}
+
+    @staticmethod
+    def _read_ndjson(stream: TextIO) -> Iterator[tuple]:
+        """Yield (line number, row) for each non-blank NDJSON line"""
+        for line_no, raw in enumerate(stream, start=1):
+            raw = raw.strip()
+            if not raw:
+                continue
+            try:
+                row = json.loads(raw)
+            except json.JSONDecodeError:
+                row = {}
+            yield line_no, row if isinstance(row, dict) else {}
+
+    @staticmethod
+    def _parse_amount(value) -> Decimal:
+        """Parse a positive payment amount, or None if invalid"""
+        try:
+            amount = Decimal(str(value).strip())
+        except (InvalidOperation, AttributeError):
+            return None
+        if not amount.is_finite() or amount <= 0:
+            return None
+        return amount.quantize(Decimal('0.01'))
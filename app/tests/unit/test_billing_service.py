@@ -1,8 +1,14 @@
 """Unit tests for billing service"""
 import pytest
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from decimal import Decimal
 from app.services.billing_service import BillingService
-from app.models.billing import BillingStatus, PaymentStatus
+from app.services.idempotency_service import IdempotencyService
+from app.models.idempotency import IdempotencyRecord, IdempotencyStatus
+from app.models.billing import BillingStatus, PaymentStatus, Payment
+from app.exceptions import ConflictError
 from app.database import SessionLocal
 
 @pytest.fixture
@@ -262,3 +268,179 @@ class TestBillingService:
                 Decimal('20.00'),
                 'credit_card'
             )
+    
+    def test_idempotent_payment_replays_stored_result(self, billing_service, db):
+        """Test that retrying with the same idempotency key does not record a second payment"""
+        billing_record = billing_service.create_billing_record('patient-808', [
+            {'service_type': 'consultation', 'quantity': 1, 'unit_price': 100.00, 'total_price': 100.00}
+        ])
+        key = str(uuid.uuid4())
+        
+        first = billing_service.process_payment_idempotent(billing_record.id, Decimal('20.00'), 'credit_card', key)
+        retry = billing_service.process_payment_idempotent(billing_record.id, Decimal('20.00'), 'credit_card', key)
+        
+        assert retry == first
+        assert db.query(Payment).filter(Payment.billing_id == billing_record.id).count() == 1
+    
+    def test_idempotency_key_reused_with_different_request(self, billing_service):
+        """Test that an idempotency key cannot be reused for a different payment"""
+        billing_record = billing_service.create_billing_record('patient-809', [
+            {'service_type': 'consultation', 'quantity': 1, 'unit_price': 100.00, 'total_price': 100.00}
+        ])
+        key = str(uuid.uuid4())
+        billing_service.process_payment_idempotent(billing_record.id, Decimal('20.00'), 'credit_card', key)
+        
+        with pytest.raises(ConflictError, match="different request"):
+            billing_service.process_payment_idempotent(billing_record.id, Decimal('15.00'), 'credit_card', key)
+    
+    def test_failed_idempotent_payment_can_be_retried(self, billing_service):
+        """Test that a failed request releases its idempotency key"""
+        key = str(uuid.uuid4())
+        with pytest.raises(ValueError, match="Billing record not found"):
+            billing_service.process_payment_idempotent('missing-bill', Decimal('20.00'), 'credit_card', key)
+        
+        with pytest.raises(ValueError, match="Billing record not found"):
+            billing_service.process_payment_idempotent('missing-bill', Decimal('20.00'), 'credit_card', key)
+    
+    def test_concurrent_idempotent_payments_record_once(self, billing_service, db):
+        """Test that concurrent duplicates wait for the first request instead of racing"""
+        billing_record = billing_service.create_billing_record('patient-810', [
+            {'service_type': 'consultation', 'quantity': 1, 'unit_price': 100.00, 'total_price': 100.00}
+        ])
+        key = str(uuid.uuid4())
+        
+        def pay(_):
+            session = SessionLocal()
+            try:
+                return BillingService(session).process_payment_idempotent(
+                    billing_record.id, Decimal('20.00'), 'credit_card', key
+                )
+            finally:
+                session.close()
+        
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(pay, range(8)))
+        
+        assert len({result['id'] for result in results}) == 1
+        assert db.query(Payment).filter(Payment.billing_id == billing_record.id).count() == 1
+    
+    def test_stale_idempotency_claim_is_taken_over(self, billing_service, db):
+        """Test that a retry takes over a claim left in progress past its lease"""
+        billing_record = billing_service.create_billing_record('patient-811', [
+            {'service_type': 'consultation', 'quantity': 1, 'unit_price': 100.00, 'total_price': 100.00}
+        ])
+        key = str(uuid.uuid4())
+        payload = {'billing_id': billing_record.id, 'amount': '20.00', 'payment_method': 'credit_card'}
+        db.add(IdempotencyRecord(
+            scope='billing.payments', key=key, request_hash=IdempotencyService._hash_payload(payload),
+            status=IdempotencyStatus.IN_PROGRESS, claimed_at=datetime.utcnow() - timedelta(hours=1),
+            claim_token='crashed-request', expires_at=datetime.utcnow() + timedelta(days=1)
+        ))
+        db.commit()
+        
+        result = billing_service.process_payment_idempotent(billing_record.id, Decimal('20.00'), 'credit_card', key)
+        
+        assert db.query(Payment).filter(Payment.id == result['id']).count() == 1
+        record = db.query(IdempotencyRecord).populate_existing().filter(IdempotencyRecord.key == key).one()
+        assert record.status == IdempotencyStatus.COMPLETED
+        assert record.claim_token != 'crashed-request'
+    
+    def test_request_whose_claim_was_taken_over_rolls_back(self, db):
+        """Test that a slow request does not write once a retry has taken over its claim"""
+        key = str(uuid.uuid4())
+        payments = []
+        
+        def slow_operation():
+            # A retry takes over the claim while this request is still running
+            session = SessionLocal()
+            try:
+                session.query(IdempotencyRecord).filter(IdempotencyRecord.key == key).update(
+                    {'claim_token': 'retry'}, synchronize_session=False
+                )
+                session.commit()
+            finally:
+                session.close()
+            payments.append(key)
+            return {'ok': True}
+        
+        with pytest.raises(ConflictError, match="taken over"):
+            IdempotencyService(db).execute('tests.takeover', key, {'n': 1}, slow_operation)
+        
+        assert payments == [key]
+        record = db.query(IdempotencyRecord).populate_existing().filter(IdempotencyRecord.key == key).one()
+        assert record.status == IdempotencyStatus.IN_PROGRESS
+        assert record.claim_token == 'retry'
+    
+    def test_aging_report_buckets_by_department(self, billing_service, db):
+        """Test outstanding balances are bucketed by age in one grouped query"""
+        department_id = str(uuid.uuid4())
+        as_of = datetime(2030, 1, 1)
+        items = [{'service_type': 'consultation', 'quantity': 1, 'unit_price': 100.00, 'total_price': 100.00}]
+        for age_days in [5, 45, 75, 100, 200, 200]:
+            record = billing_service.create_billing_record('patient-909', items, department_id)
+            record.created_at = as_of - timedelta(days=age_days)
+        paid = billing_service.create_billing_record('patient-909', items, department_id)
+        paid.created_at = as_of - timedelta(days=5)
+        paid.status = BillingStatus.PAID
+        db.commit()
+        billing_service.process_payment(record.id, Decimal('15.00'), 'credit_card')
+        
+        report = billing_service.get_aging_report('department', as_of=as_of)
+        
+        group = next(g for g in report['groups'] if g['department_id'] == department_id)
+        assert group['record_count'] == 6
+        assert group['buckets'] == {
+            '0-30': Decimal('20.00'),
+            '31-60': Decimal('20.00'),
+            '61-90': Decimal('20.00'),
+            '91-120': Decimal('20.00'),
+            '120+': Decimal('25.00')
+        }
+        assert group['total'] == Decimal('105.00')
+        
+        detail = [row for row in billing_service.iter_aging_detail(as_of) if row['department_id'] == department_id]
+        assert sorted(row['bucket'] for row in detail) == ['0-30', '120+', '120+', '31-60', '61-90', '91-120']
+        assert sorted(row['balance'] for row in detail)[0] == Decimal('5.00')
+    
+    def test_aging_report_invalid_grouping(self, billing_service):
+        """Test aging report rejects unsupported groupings"""
+        with pytest.raises(ValueError, match="Unsupported aging report grouping"):
+            billing_service.get_aging_report('ward')
+    
+    def test_payment_history_pagination(self, billing_service):
+        """Test payment history is returned page by page with a keyset cursor"""
+        patient_id = f'patient-{uuid.uuid4()}'
+        items = [{'service_type': 'consultation', 'quantity': 1, 'unit_price': 1000.00, 'total_price': 1000.00}]
+        billing_record = billing_service.create_billing_record(patient_id, items)
+        for _ in range(5):
+            billing_service.process_payment(billing_record.id, Decimal('1.00'), 'credit_card')
+        
+        seen = []
+        cursor = None
+        for _ in range(5):
+            page = billing_service.get_payment_history_page(patient_id, limit=2, cursor=cursor)
+            assert len(page['payments']) <= 2
+            seen.extend(payment.id for payment in page['payments'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        
+        full_history = [payment.id for payment in billing_service.get_payment_history(patient_id)]
+        assert seen == full_history
+        assert len(set(seen)) == 5
+    
+    def test_payment_history_date_bounds(self, billing_service):
+        """Test payment history can be bounded by date"""
+        patient_id = f'patient-{uuid.uuid4()}'
+        items = [{'service_type': 'consultation', 'quantity': 1, 'unit_price': 1000.00, 'total_price': 1000.00}]
+        billing_record = billing_service.create_billing_record(patient_id, items)
+        billing_service.process_payment(billing_record.id, Decimal('1.00'), 'credit_card')
+        
+        future = datetime.utcnow() + timedelta(days=1)
+        assert billing_service.get_payment_history(patient_id, start_date=future) == []
+        assert len(billing_service.get_payment_history(patient_id, end_date=future)) == 1
+    
+    def test_payment_history_invalid_cursor(self, billing_service):
+        """Test malformed cursors are rejected"""
+        with pytest.raises(ValueError, match="Invalid pagination cursor"):
+            billing_service.get_payment_history_page('patient-1', cursor='not-a-cursor')
@@ -0,0 +1,121 @@
+"""Unit tests for clinical search service"""
+import uuid
+import pytest
+from datetime import datetime, timedelta
+from app.services.clinical_search_service import ClinicalSearchService
+from app.services.medical_record_service import MedicalRecordService
+from app.services.record_version_service import RecordVersionService
+from app.models.medical_record import Diagnosis
+from app.database import SessionLocal
+
+@pytest.fixture
+def db():
+    """Database session fixture"""
+    session = SessionLocal()
+    yield session
+    session.close()
+
+@pytest.fixture
+def search_service(db):
+    """Clinical search service fixture"""
+    return ClinicalSearchService(db)
+
+@pytest.fixture
+def record_service(db):
+    """Medical record service fixture"""
+    return MedicalRecordService(db)
+
+def _patient(record_service):
+    patient_id = f"patient-{uuid.uuid4().hex[:8]}"
+    record_service.create_record(patient_id, "doctor-1")
+    return patient_id
+
+def _word():
+    """A term no other test has indexed"""
+    return f"marker{uuid.uuid4().hex[:10]}"
+
+class TestClinicalSearchService:
+    """Unit tests for ClinicalSearchService"""
+
+    def test_search_finds_new_notes_and_diagnoses(self, search_service, record_service):
+        """Test rows added through the record service are searchable, best match first"""
+        word = _word()
+        patient_id = _patient(record_service)
+        other_patient = _patient(record_service)
+        record_service.add_clinical_note(patient_id, f"Suspected {word}, {word} screen ordered", "doctor-1")
+        record_service.add_diagnosis(patient_id, "A41.9", f"{word} confirmed by culture")
+        record_service.add_clinical_note(other_patient, f"No sign of {word}", "doctor-2")
+
+        page = search_service.search(word)
+        assert sorted(r['kind'] for r in page['results']) == ['diagnosis', 'note', 'note']
+        scores = [r['score'] for r in page['results']]
+        assert scores == sorted(scores, reverse=True)
+        assert all(word in r['snippet'] for r in page['results'])
+        assert page['next_offset'] is None
+
+        filtered = search_service.search(word, patient_id=patient_id, kinds=['diagnosis'])
+        assert [(r['kind'], r['patient_id']) for r in filtered['results']] == [('diagnosis', patient_id)]
+
+    def test_search_skips_removed_entries(self, search_service, record_service):
+        """Test notes and diagnoses removed from the record no longer match"""
+        word = _word()
+        patient_id = _patient(record_service)
+        note = record_service.add_clinical_note(patient_id, f"Query {word}", "doctor-1")
+        diagnosis = record_service.add_diagnosis(patient_id, "R69", f"Possible {word}")
+        kept = record_service.add_clinical_note(patient_id, f"{word} ruled out", "doctor-1")
+        assert len(search_service.search(word)['results']) == 3
+
+        versions = RecordVersionService(record_service.db)
+        versions.create_version(patient_id, "doctor-1")
+        versions.remove_entry(patient_id, "note", note.id, "doctor-1")
+        versions.remove_entry(patient_id, "diagnosis", diagnosis.id, "doctor-1")
+        assert [r['id'] for r in search_service.search(word)['results']] == [kept.id]
+
+    def test_search_requires_every_term_and_filters_dates(self, search_service, record_service):
+        """Test all terms must match and the date range applies to when the row was recorded"""
+        word = _word()
+        patient_id = _patient(record_service)
+        record_service.add_clinical_note(patient_id, f"{word} with fever", "doctor-1")
+        record_service.add_clinical_note(patient_id, f"{word} without complications", "doctor-1")
+
+        assert len(search_service.search(f"{word} fever")['results']) == 1
+        assert len(search_service.search(f"{word} OR fever")['results']) == 0
+        tomorrow = datetime.utcnow() + timedelta(days=1)
+        assert search_service.search(word, start_date=tomorrow)['results'] == []
+        assert len(search_service.search(word, end_date=tomorrow)['results']) == 2
+
+    def test_search_paginates_with_offset(self, search_service, record_service):
+        """Test pages do not overlap and the last page has no next offset"""
+        word = _word()
+        patient_id = _patient(record_service)
+        for i in range(5):
+            record_service.add_clinical_note(patient_id, f"{word} follow-up {i}", "doctor-1")
+
+        first = search_service.search(word, limit=3)
+        second = search_service.search(word, limit=3, offset=first['next_offset'])
+        assert first['next_offset'] == 3
+        assert second['next_offset'] is None
+        ids = [r['id'] for r in first['results'] + second['results']]
+        assert len(set(ids)) == 5
+
+    def test_rebuild_indexes_existing_rows(self, search_service, record_service, db):
+        """Test the rebuild backfills rows written without going through the record service"""
+        word = _word()
+        patient_id = _patient(record_service)
+        record = record_service.get_record(patient_id)
+        db.add(Diagnosis(id=str(uuid.uuid4()), record_id=record.id, diagnosis_code="R50.9", description=f"{word} imported"))
+        db.commit()
+        assert search_service.search(word)['results'] == []
+
+        counts = search_service.rebuild_index()
+        assert counts['diagnoses'] >= 1
+        assert len(search_service.search(word)['results']) == 1
+
+    def test_search_rejects_invalid_queries(self, search_service):
+        """Test empty queries, unknown kinds and negative offsets are rejected"""
+        with pytest.raises(ValueError):
+            search_service.search('"*"')
+        with pytest.raises(ValueError):
+            search_service.search('sepsis', kinds=['treatment'])
+        with pytest.raises(ValueError):
+            search_service.search('sepsis', offset=-1)
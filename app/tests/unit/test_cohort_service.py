@@ -0,0 +1,153 @@
+"""Unit tests for cohort service"""
+import uuid
+import pytest
+from datetime import date, datetime, timedelta
+from app.services.cohort_service import CohortService
+from app.services.medical_record_service import MedicalRecordService
+from app.services.record_version_service import RecordVersionService
+from app.models.medical_record import Diagnosis
+from app.models.prescription import Prescription, PrescriptionStatus
+from app.database import SessionLocal
+
+@pytest.fixture
+def db():
+    """Database session fixture"""
+    session = SessionLocal()
+    yield session
+    session.close()
+
+@pytest.fixture
+def cohort_service(db):
+    """Cohort service fixture"""
+    return CohortService(db)
+
+@pytest.fixture
+def record_service(db):
+    """Medical record service fixture"""
+    return MedicalRecordService(db)
+
+def _patient(record_service, *codes):
+    patient_id = f"patient-{uuid.uuid4().hex[:8]}"
+    record_service.create_record(patient_id, "doctor-1")
+    for code in codes:
+        record_service.add_diagnosis(patient_id, code, "Cohort test diagnosis")
+    return patient_id
+
+def _family():
+    """A code family no other test uses"""
+    return f"Z{uuid.uuid4().hex[:4].upper()}"
+
+def _prescribe(db, patient_id, medication_id, status=PrescriptionStatus.ACTIVE):
+    db.add(Prescription(
+        id=str(uuid.uuid4()), patient_id=patient_id, doctor_id="doctor-1", medication_id=medication_id,
+        dosage="500mg", frequency="daily", duration="30 days", status=status
+    ))
+    db.commit()
+
+class TestCohortService:
+    """Unit tests for CohortService"""
+
+    def test_code_and_prefix_queries(self, cohort_service, record_service):
+        """Test exact codes, prefixes and dotted or undotted spellings select the same patients"""
+        family = _family()
+        first = _patient(record_service, f"{family}.1")
+        second = _patient(record_service, f"{family}.29", f"{family}.1")
+        _patient(record_service, f"{family[:-1]}X.1")
+        cohort_service.rebuild()
+
+        assert cohort_service.count({"code": f"{family}.*"})['count'] == 2
+        assert cohort_service.count({"code": f"{family.lower()}1"})['count'] == 2
+        assert list(cohort_service.iter_patient_ids({"code": f"{family}.2*"})) == [second]
+        assert cohort_service.count({"code": f"{family}.3"})['count'] == 0
+        assert set(cohort_service.iter_patient_ids({"code": f"{family}*"})) == {first, second}
+
+    def test_date_window(self, cohort_service, record_service, db):
+        """Test a date window only counts diagnoses recorded inside it"""
+        family = _family()
+        recent = _patient(record_service, f"{family}.1")
+        old = _patient(record_service)
+        record = record_service.get_record(old)
+        db.add(Diagnosis(id=str(uuid.uuid4()), record_id=record.id, diagnosis_code=f"{family}.1",
+                         description="Old diagnosis", date_recorded=datetime.utcnow() - timedelta(days=400)))
+        db.commit()
+        cohort_service.rebuild()
+
+        last_year = (date.today() - timedelta(days=365)).isoformat()
+        assert list(cohort_service.iter_patient_ids({"code": f"{family}*", "start_date": last_year})) == [recent]
+        assert list(cohort_service.iter_patient_ids({"code": f"{family}*", "end_date": last_year})) == [old]
+        assert cohort_service.count({"code": f"{family}*"})['count'] == 2
+
+    def test_boolean_operators_with_prescriptions(self, cohort_service, record_service, db):
+        """Test AND, OR and NOT combine codes with active prescription filters"""
+        family = _family()
+        medication_id = f"med-{uuid.uuid4().hex[:8]}"
+        treated = _patient(record_service, f"{family}.9")
+        untreated = _patient(record_service, f"{family}.9")
+        stopped = _patient(record_service, f"{family}.9", "I10")
+        _prescribe(db, treated, medication_id)
+        _prescribe(db, stopped, medication_id, PrescriptionStatus.CANCELLED)
+        cohort_service.rebuild()
+
+        diabetic = {"code": f"{family}.*"}
+        on_medication = {"prescription": medication_id}
+        assert list(cohort_service.iter_patient_ids({"and": [diabetic, on_medication]})) == [treated]
+        assert set(cohort_service.iter_patient_ids({"and": [diabetic, {"not": on_medication}]})) == {untreated, stopped}
+        assert set(cohort_service.iter_patient_ids(
+            {"and": [diabetic, {"or": [on_medication, {"code": "I10"}]}]}
+        )) == {treated, stopped}
+
+    def test_removed_diagnoses_leave_the_cohort(self, cohort_service, record_service):
+        """Test a rebuild drops diagnoses removed from the current record"""
+        family = _family()
+        patient_id = _patient(record_service)
+        diagnosis = record_service.add_diagnosis(patient_id, f"{family}.0", "Provisional")
+        cohort_service.rebuild()
+        assert cohort_service.count({"code": f"{family}.0"})['count'] == 1
+
+        RecordVersionService(record_service.db).remove_entry(patient_id, "diagnosis", diagnosis.id, "doctor-1")
+        cohort_service.rebuild()
+        assert cohort_service.count({"code": f"{family}.0"})['count'] == 0
+        assert cohort_service.stats()['codes'] >= 1
+
+    def test_changes_are_posted_without_a_rebuild(self, cohort_service, record_service):
+        """Test diagnoses added and removed after a build are queryable before the next rebuild"""
+        family = _family()
+        existing = _patient(record_service, f"{family}.1")
+        cohort_service.rebuild()
+        assert cohort_service.count({"code": f"{family}.*"})['count'] == 1
+
+        added = _patient(record_service, f"{family}.2")
+        diagnosis = record_service.add_diagnosis(existing, f"{family}.2", "Second diagnosis")
+        yesterday = (date.today() - timedelta(days=1)).isoformat()
+        assert set(cohort_service.iter_patient_ids({"code": f"{family}.*"})) == {existing, added}
+        assert set(cohort_service.iter_patient_ids({"code": f"{family}.2", "start_date": yesterday})) == {existing, added}
+        assert added in set(cohort_service.iter_patient_ids({"not": {"code": f"{family}.1"}}))
+
+        RecordVersionService(record_service.db).remove_entry(existing, "diagnosis", diagnosis.id, "doctor-1")
+        assert list(cohort_service.iter_patient_ids({"code": f"{family}.2"})) == [added]
+        assert cohort_service.count({"code": f"{family}.*"})['count'] == 2
+
+    def test_postings_are_idempotent_and_copy_on_write(self, cohort_service, record_service):
+        """Test a change already in the index is not applied twice and posting never modifies a served index"""
+        family = _family()
+        patient_id = _patient(record_service)
+        diagnosis = record_service.add_diagnosis(patient_id, f"{family}.4", "Raced with a rebuild")
+        cohort_service.rebuild()
+        served = cohort_service._index()
+        served_cohort = served.patients_with(f"{family}.*")
+
+        # The same addition posted again, as when it commits while a rebuild is reading
+        cohort_service.post_diagnosis(diagnosis.id, patient_id, diagnosis.diagnosis_code, diagnosis.date_recorded)
+        assert cohort_service.count({"code": f"{family}.4"})['count'] == 1
+
+        RecordVersionService(record_service.db).remove_entry(patient_id, "diagnosis", diagnosis.id, "doctor-1")
+        assert cohort_service.count({"code": f"{family}.*"})['count'] == 0
+        assert cohort_service._index() is not served
+        assert served.patients_with(f"{family}.*") is served_cohort and len(served_cohort) == 1
+
+    def test_invalid_expressions(self, cohort_service):
+        """Test malformed expressions are rejected"""
+        for expression in ({}, {"and": []}, {"code": "*"}, {"code": "E11", "or": []},
+                           {"code": "E11", "start_date": "last year"}, {"xor": []}):
+            with pytest.raises(ValueError):
+                cohort_service.count(expression)
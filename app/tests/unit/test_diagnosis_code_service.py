@@ -0,0 +1,105 @@
+"""Unit tests for diagnosis code service"""
+import io
+import uuid
+import pytest
+from fastapi.testclient import TestClient
+from app.services import diagnosis_code_service
+from app.services.diagnosis_code_service import DiagnosisCodeService
+from app.services.medical_record_service import MedicalRecordService
+from app.config import settings
+from app.database import SessionLocal
+from app.main import create_app
+
+CODES_CSV = """code,description
+E11,Type 2 diabetes mellitus
+E119,Type 2 diabetes mellitus without complications
+E1165,Type 2 diabetes mellitus with hyperglycemia
+E10,Type 1 diabetes mellitus
+I10,Essential (primary) hypertension
+J45909,"Unspecified asthma, uncomplicated"
+A419,"Sepsis, unspecified organism"
+"""
+
+@pytest.fixture
+def db():
+    """Database session fixture"""
+    session = SessionLocal()
+    yield session
+    session.close()
+
+@pytest.fixture
+def code_service():
+    """Diagnosis code service fixture with a small catalog loaded"""
+    service = DiagnosisCodeService()
+    service.load(io.StringIO(CODES_CSV))
+    yield service
+    # Other tests add free-text codes, which only pass without a catalog
+    diagnosis_code_service._state.catalog = None
+
+class TestDiagnosisCodeService:
+    """Unit tests for DiagnosisCodeService"""
+
+    def test_prefix_search_ranks_categories_first(self, code_service):
+        """Test code prefixes match in any spelling and shorter codes come first"""
+        results = code_service.search("E1")
+        assert [r['code'] for r in results] == ["E10", "E11", "E11.9", "E11.65"]
+        assert [r['code'] for r in code_service.search("e11.6")] == ["E11.65"]
+        assert code_service.search("E11", limit=2)[1]['code'] == "E11.9"
+        assert code_service.search("Z99") == []
+
+    def test_word_search_matches_every_word(self, code_service):
+        """Test description words match with the last word as a prefix, shortest description first"""
+        results = code_service.search("diabetes mell")
+        assert [r['code'] for r in results] == ["E10", "E11", "E11.65", "E11.9"]
+        assert [r['code'] for r in code_service.search("type 2 diabetes hyper")] == ["E11.65"]
+        assert [r['code'] for r in code_service.search("seps")] == ["A41.9"]
+        assert code_service.search("diabetes asthma") == []
+
+    def test_add_diagnosis_validates_codes(self, code_service, db):
+        """Test add_diagnosis rejects unknown codes and stores the catalog form"""
+        record_service = MedicalRecordService(db)
+        patient_id = f"patient-{uuid.uuid4().hex[:8]}"
+        record_service.create_record(patient_id, "doctor-1")
+
+        diagnosis = record_service.add_diagnosis(patient_id, "e119", "Type 2 diabetes")
+        assert diagnosis.diagnosis_code == "E11.9"
+        with pytest.raises(ValueError):
+            record_service.add_diagnosis(patient_id, "ICD-10-001", "Hypertension")
+
+    def test_load_reports_footprint_and_rejects_bad_files(self, code_service):
+        """Test the catalog reports its size and a file without the expected columns is rejected"""
+        stats = code_service.stats()
+        assert stats['codes'] == 7
+        assert stats['memory_bytes'] > 0
+        with pytest.raises(ValueError):
+            code_service.load(io.StringIO("icd,text\nE11,Diabetes\n"))
+        assert code_service.stats()['codes'] == 7
+
+    def test_app_startup_loads_configured_file(self, tmp_path, monkeypatch):
+        """Test the application builds the catalog from the configured file at startup"""
+        codes_file = tmp_path / "codes.csv"
+        codes_file.write_text(CODES_CSV, encoding="utf-8")
+        monkeypatch.setattr(settings, "DIAGNOSIS_CODES_FILE", str(codes_file))
+        diagnosis_code_service._state.catalog = None
+        try:
+            with TestClient(create_app()):
+                assert diagnosis_code_service._state.catalog is not None
+                assert len(diagnosis_code_service._state.catalog) == 7
+        finally:
+            diagnosis_code_service._state.catalog = None
+
+    def test_unreadable_file_falls_back_to_no_validation(self, db, tmp_path, monkeypatch):
+        """Test a missing codes file is logged once and diagnoses are stored as entered"""
+        monkeypatch.setattr(settings, "DIAGNOSIS_CODES_FILE", str(tmp_path / "missing.csv"))
+        diagnosis_code_service._state.catalog = None
+        record_service = MedicalRecordService(db)
+        patient_id = f"patient-{uuid.uuid4().hex[:8]}"
+        record_service.create_record(patient_id, "doctor-1")
+        try:
+            with TestClient(create_app()):
+                assert diagnosis_code_service._state.failed
+            diagnosis = record_service.add_diagnosis(patient_id, "ICD-10-001", "Hypertension")
+            assert diagnosis.diagnosis_code == "ICD-10-001"
+            assert DiagnosisCodeService().search("E1") == []
+        finally:
+            diagnosis_code_service._state.failed = False
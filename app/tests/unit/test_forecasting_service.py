@@ -0,0 +1,113 @@
+"""Unit tests for forecasting service"""
+import uuid
+import pytest
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+import numpy as np
+from sqlalchemy import insert
+from app.services.forecasting_service import ForecastingService
+from app.services.inventory_service import InventoryService
+from app.models.inventory import InventoryTransaction, InventoryTransactionType
+from app.config import settings
+from app.database import SessionLocal
+
+@pytest.fixture
+def db():
+    """Database session fixture"""
+    session = SessionLocal()
+    yield session
+    session.close()
+
+@pytest.fixture
+def forecasting_service(db):
+    """Forecasting service fixture"""
+    return ForecastingService(db)
+
+@pytest.fixture
+def inventory_service(db):
+    """Inventory service fixture"""
+    return InventoryService(db)
+
+def _add_item(inventory_service, quantity=100, min_threshold=10):
+    return inventory_service.add_inventory_item({
+        'name': 'Forecast Item',
+        'quantity': quantity,
+        'unit_cost': Decimal('1.00'),
+        'storage_location': 'Central Store',
+        'min_threshold': min_threshold
+    })
+
+def _add_history(db, item_id, daily_units, as_of):
+    """Write one CONSUME transaction per day ending the day before as_of"""
+    start = as_of - timedelta(days=len(daily_units))
+    rows = [
+        {
+            'id': str(uuid.uuid4()),
+            'item_id': item_id,
+            'transaction_type': InventoryTransactionType.CONSUME,
+            'quantity': units,
+            'timestamp': datetime.combine(start + timedelta(days=i), datetime.min.time()) + timedelta(hours=10)
+        }
+        for i, units in enumerate(daily_units) if units
+    ]
+    db.execute(insert(InventoryTransaction), rows)
+    db.commit()
+
+class TestForecastingService:
+    """Unit tests for ForecastingService"""
+
+    def test_constant_demand_forecast(self, forecasting_service, inventory_service, db):
+        """Test steady consumption gives demand x lead time with no safety stock"""
+        as_of = date.today()
+        item = _add_item(inventory_service)
+        _add_history(db, item.id, [10] * 60, as_of)
+
+        for method in ('sma', 'ses'):
+            result = next(forecasting_service.forecast(as_of, 60, method, item_ids=[item.id]))
+            assert result['daily_demand'] == pytest.approx(10)
+            assert result['safety_stock'] == 0
+            assert result['reorder_point'] == 10 * settings.FORECAST_LEAD_TIME_DAYS
+
+    def test_variable_demand_adds_safety_stock(self, forecasting_service, inventory_service, db):
+        """Test demand variability raises the reorder point above expected lead-time demand"""
+        as_of = date.today()
+        item = _add_item(inventory_service)
+        daily = [5, 15] * 30
+        _add_history(db, item.id, daily, as_of)
+
+        result = next(forecasting_service.forecast(as_of, 60, 'sma', item_ids=[item.id]))
+
+        expected_std = np.std(daily[-settings.FORECAST_WINDOW_DAYS:], ddof=1)
+        assert result['daily_demand'] == pytest.approx(10)
+        assert result['demand_std'] == pytest.approx(expected_std, abs=1e-3)
+        assert result['reorder_point'] > 10 * settings.FORECAST_LEAD_TIME_DAYS
+
+    def test_smoothing_weights_sum_to_one(self):
+        """Test exponential smoothing weights are normalised and favour recent days"""
+        weights = ForecastingService._smoothing_weights(730, 0.2)
+
+        assert weights.sum() == pytest.approx(1)
+        assert weights[-1] > weights[-2]
+
+    def test_apply_reorder_points_writes_thresholds(self, forecasting_service, inventory_service, db):
+        """Test reorder points are stored as min_threshold and refresh the low-stock flag"""
+        as_of = date.today()
+        item = _add_item(inventory_service, quantity=50, min_threshold=10)
+        _add_history(db, item.id, [20] * 30, as_of)
+
+        preview = forecasting_service.apply_reorder_points(as_of, 30, 'sma', dry_run=True)
+        db.expire_all()
+        assert preview['thresholds_changed'] >= 1
+        assert inventory_service.get_inventory_item(item.id).min_threshold == 10
+
+        forecasting_service.apply_reorder_points(as_of, 30, 'sma')
+        db.expire_all()
+
+        updated = inventory_service.get_inventory_item(item.id)
+        assert updated.min_threshold == 20 * settings.FORECAST_LEAD_TIME_DAYS
+        assert updated.is_low_stock is True
+
+    def test_unsupported_method(self, forecasting_service):
+        """Test unknown forecasting methods are rejected"""
+        with pytest.raises(ValueError, match="Unsupported forecast method"):
+            list(forecasting_service.forecast(method='arima'))
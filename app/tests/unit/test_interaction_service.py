@@ -0,0 +1,103 @@
+"""Unit tests for drug interaction service"""
+import io
+import uuid
+import pytest
+from app.services.interaction_service import DrugInteractionService, InteractionMatrix
+from app.services.prescription_service import PrescriptionService
+from app.services.inventory_service import InventoryService
+from app.models.prescription import DrugInteraction, InteractionSeverity
+from app.database import SessionLocal
+
+@pytest.fixture
+def db():
+    """Database session fixture"""
+    session = SessionLocal()
+    yield session
+    session.close()
+
+@pytest.fixture
+def interaction_service(db):
+    """Drug interaction service fixture"""
+    return DrugInteractionService(db)
+
+def _medication_ids(count):
+    return [f'med-{uuid.uuid4()}' for _ in range(count)]
+
+class TestDrugInteractionService:
+    """Unit tests for DrugInteractionService"""
+
+    def test_matrix_lookup_is_order_independent(self):
+        """Test a pair is found whichever medication comes first"""
+        class Row:
+            medication_a_id, medication_b_id = 'a', 'b'
+            severity, description = InteractionSeverity.MAJOR, 'bleeding risk'
+        matrix = InteractionMatrix([Row()])
+
+        assert matrix.lookup('a', 'b') == (InteractionSeverity.MAJOR, 'bleeding risk')
+        assert matrix.lookup('b', 'a') == (InteractionSeverity.MAJOR, 'bleeding risk')
+        assert matrix.lookup('a', 'c') is None
+
+    def test_check_medication_list_orders_by_severity(self, interaction_service):
+        """Test a batch check finds every interacting pair, most severe first"""
+        warfarin, aspirin, ibuprofen, other = _medication_ids(4)
+        interaction_service.add_interaction(warfarin, aspirin, 'major', 'bleeding risk')
+        interaction_service.add_interaction(ibuprofen, aspirin, 'moderate', 'reduced cardioprotection')
+
+        warnings = interaction_service.check_medication_list([warfarin, aspirin, ibuprofen, other])
+
+        assert [w['severity'] for w in warnings] == ['major', 'moderate']
+        assert {w['medication_id'] for w in warnings} | {w['interacts_with'] for w in warnings} == {warfarin, aspirin, ibuprofen}
+
+    def test_import_upserts_pairs(self, interaction_service):
+        """Test a CSV import adds pairs and replaces the severity of known ones"""
+        first, second = _medication_ids(2)
+        interaction_service.add_interaction(first, second, 'minor', 'initial')
+        csv_text = (
+            "medication_a_id,medication_b_id,severity,description\n"
+            f"{second},{first},Contraindicated,updated\n"
+        )
+
+        assert interaction_service.import_interactions(io.StringIO(csv_text)) == 1
+        warnings = interaction_service.check_medication_list([first, second])
+        assert [(w['severity'], w['description']) for w in warnings] == [('contraindicated', 'updated')]
+        with pytest.raises(ValueError, match="Unknown interaction severity"):
+            interaction_service.add_interaction(first, second, 'fatal', 'bad')
+
+    def test_import_upserts_in_chunks(self, interaction_service, db, monkeypatch):
+        """Test an import spanning several chunks keeps one row per pair, the last entry winning"""
+        monkeypatch.setattr(DrugInteractionService, 'UPSERT_CHUNK_SIZE', 2)
+        first, second, third = _medication_ids(3)
+        csv_text = (
+            "medication_a_id,medication_b_id,severity,description\n"
+            f"{first},{second},minor,one\n"
+            f"{second},{first},moderate,two\n"
+            f"{first},{third},minor,three\n"
+            f"{second},{first},major,four\n"
+            f"{third},{second},minor,five\n"
+        )
+
+        assert interaction_service.import_interactions(io.StringIO(csv_text)) == 5
+        rows = db.query(DrugInteraction).filter(DrugInteraction.medication_a_id.in_([first, second, third])).all()
+        assert len(rows) == 3
+        pair = next(row for row in rows if {row.medication_a_id, row.medication_b_id} == {first, second})
+        assert (pair.severity, pair.description) == (InteractionSeverity.MAJOR, 'four')
+
+    def test_create_prescription_returns_warnings(self, db, interaction_service):
+        """Test a new prescription is checked against the patient's active prescriptions"""
+        inventory = InventoryService(db)
+        warfarin, aspirin = (
+            inventory.add_inventory_item({
+                'name': name, 'quantity': 10, 'unit_cost': 1.00, 'storage_location': 'Pharmacy I'
+            }).id
+            for name in ('Warfarin', 'Aspirin')
+        )
+        interaction_service.add_interaction(warfarin, aspirin, 'major', 'bleeding risk')
+        service = PrescriptionService(db)
+        base = {'patient_id': f'patient-{uuid.uuid4()}', 'doctor_id': 'doctor-1',
+                'dosage': '5mg', 'frequency': 'daily', 'duration': '30 days'}
+
+        first = service.create_prescription({**base, 'medication_id': warfarin})
+        second = service.create_prescription({**base, 'medication_id': aspirin})
+
+        assert first.interaction_warnings == []
+        assert [w['interacts_with'] for w in second.interaction_warnings] == [warfarin]
@@ -0,0 +1,95 @@
+"""Unit tests for inventory expiry service"""
+import uuid
+import pytest
+from datetime import date, timedelta
+from decimal import Decimal
+from app.services.inventory_service import InventoryService
+from app.services.inventory_expiry_service import InventoryExpiryService
+from app.services.inventory_snapshot_service import InventorySnapshotService
+from app.models.inventory import InventoryTransaction, InventoryTransactionType, InventoryQuarantine
+from app.database import SessionLocal
+
+@pytest.fixture
+def db():
+    """Database session fixture"""
+    session = SessionLocal()
+    yield session
+    session.close()
+
+@pytest.fixture
+def expiry_service(db):
+    """Inventory expiry service fixture"""
+    return InventoryExpiryService(db)
+
+@pytest.fixture
+def inventory_service(db):
+    """Inventory service fixture"""
+    return InventoryService(db)
+
+def _add_item(inventory_service, quantity, expiration_date, location='Expiry Store'):
+    return inventory_service.add_inventory_item({
+        'name': f'Expiry Item {uuid.uuid4()}',
+        'quantity': quantity,
+        'unit_cost': Decimal('2.00'),
+        'expiration_date': expiration_date,
+        'storage_location': location
+    })
+
+class TestInventoryExpiryService:
+    """Unit tests for InventoryExpiryService"""
+
+    def test_sweep_quarantines_expired_stock(self, db, expiry_service, inventory_service):
+        """Test expired stock leaves every location through RETURN transactions"""
+        item = _add_item(inventory_service, 30, date.today() - timedelta(days=1), 'Expiry Home')
+        inventory_service.transfer_stock(item.id, 'Expiry Home', 'Expiry Ward', 10)
+
+        summary = expiry_service.sweep()
+
+        assert summary['units_quarantined'] >= 30
+        db.expire_all()
+        assert inventory_service.get_inventory_item(item.id).quantity == 0
+        assert [row.quantity for row in inventory_service.get_item_locations(item.id)] == [0, 0]
+        returns = db.query(InventoryTransaction).filter(
+            InventoryTransaction.item_id == item.id,
+            InventoryTransaction.transaction_type == InventoryTransactionType.RETURN
+        ).all()
+        assert sorted((row.location, row.quantity) for row in returns) == [('Expiry Home', -20), ('Expiry Ward', -10)]
+        quarantine = db.query(InventoryQuarantine).filter(InventoryQuarantine.item_id == item.id).one()
+        assert quarantine.quantity == 30
+        assert quarantine.reference_id == returns[0].reference_id
+        assert InventorySnapshotService(db).check_consistency([item.id])['mismatches'] == []
+
+    def test_sweep_quarantines_only_expired_lots(self, db, expiry_service, inventory_service):
+        """Test a lot-tracked item keeps its unexpired lots"""
+        item = _add_item(inventory_service, 0, None)
+        expired = inventory_service.receive_lot(item.id, 5, date.today() - timedelta(days=2))
+        fresh_expiry = date.today() + timedelta(days=60)
+        inventory_service.receive_lot(item.id, 8, fresh_expiry)
+
+        result = inventory_service.quarantine_expired_stock(item.id)
+
+        assert result == {'item_id': item.id, 'quantity': 5, 'lots': 1}
+        db.expire_all()
+        refreshed = inventory_service.get_inventory_item(item.id)
+        assert refreshed.quantity == 8
+        assert refreshed.expiration_date == fresh_expiry
+        assert db.get(type(expired), expired.id).quantity == 0
+        assert inventory_service.quarantine_expired_stock(item.id)['quantity'] == 0
+
+    def test_expiring_view_is_refreshed_by_sweep(self, expiry_service, inventory_service):
+        """Test the expiring-soon view serves the last sweep and slices by window"""
+        soon = _add_item(inventory_service, 4, date.today() + timedelta(days=5))
+        later = _add_item(inventory_service, 4, date.today() + timedelta(days=40))
+        expiry_service.sweep()
+
+        within_ten = {row['item_id'] for row in expiry_service.get_expiring_items(10)['items']}
+        assert soon.id in within_ten
+        assert later.id not in within_ten
+
+        newer = _add_item(inventory_service, 4, date.today() + timedelta(days=3))
+        assert newer.id not in {row['item_id'] for row in expiry_service.get_expiring_items(10)['items']}
+        expiry_service.sweep()
+        assert newer.id in {row['item_id'] for row in expiry_service.get_expiring_items(10)['items']}
+
+        with pytest.raises(ValueError, match="Expiry window"):
+            expiry_service.get_expiring_items(10000)
@@ -1,9 +1,12 @@
 """Unit tests for inventory service"""
 import pytest
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
 from decimal import Decimal
 from app.services.inventory_service import InventoryService
-from app.models.inventory import InventoryTransactionType
+from app.models.inventory import InventoryItem, InventoryTransaction, InventoryTransactionType, InventoryCounterShard
+from app.models.outbox import OutboxEvent
 from app.database import SessionLocal
 
 @pytest.fixture
@@ -146,6 +149,66 @@ class TestInventoryService:
         
         assert len(low_stock) >= 1
     
+    def test_low_stock_flag_follows_threshold_crossings(self, inventory_service, db):
+        """Test consume, adjust and receive keep the low-stock flag current and emit crossing events"""
+        item = inventory_service.add_inventory_item({
+            'name': 'Flagged Item',
+            'quantity': 15,
+            'unit_cost': Decimal('1.00'),
+            'storage_location': 'Pharmacy H',
+            'min_threshold': 10
+        })
+        assert item.is_low_stock is False
+        
+        inventory_service.consume_inventory(item.id, 3)
+        assert item.id not in {i.id for i in inventory_service.get_low_stock_items()}
+        inventory_service.consume_inventory(item.id, 4)
+        assert item.id in {i.id for i in inventory_service.get_low_stock_items()}
+        inventory_service.consume_inventory(item.id, 1)
+        inventory_service.update_stock_level(item.id, 40)
+        assert item.id not in {i.id for i in inventory_service.get_low_stock_items()}
+        inventory_service.update_stock_level(item.id, 2)
+        inventory_service.receive_lot(item.id, 20)
+        
+        events = db.query(OutboxEvent).filter(
+            OutboxEvent.aggregate_id == item.id
+        ).order_by(OutboxEvent.id).all()
+        assert [event.event_type for event in events] == [
+            'inventory.low_stock', 'inventory.restocked', 'inventory.low_stock', 'inventory.restocked'
+        ]
+    
+    def test_batch_and_lot_consumption_flag_low_stock(self, inventory_service):
+        """Test batch and lot-tracked consumption set the low-stock flag"""
+        plain = inventory_service.add_inventory_item({
+            'name': 'Batch Flag', 'quantity': 12, 'unit_cost': Decimal('1.00'),
+            'storage_location': 'Theatre', 'min_threshold': 10
+        })
+        lotted = inventory_service.add_inventory_item({
+            'name': 'Lot Flag', 'quantity': 0, 'unit_cost': Decimal('1.00'),
+            'storage_location': 'Theatre', 'min_threshold': 10
+        })
+        inventory_service.receive_lot(lotted.id, 15, date.today() + timedelta(days=30))
+        
+        inventory_service.consume_batch([
+            {'item_id': plain.id, 'quantity': 2},
+            {'item_id': lotted.id, 'quantity': 5}
+        ])
+        
+        flagged = {i.id for i in inventory_service.get_low_stock_items()}
+        assert {plain.id, lotted.id} <= flagged
+    
+    def test_rebuild_low_stock_flags(self, inventory_service, db):
+        """Test rebuilding corrects flags written outside the service"""
+        item = inventory_service.add_inventory_item({
+            'name': 'Imported Item', 'quantity': 50, 'unit_cost': Decimal('1.00'),
+            'storage_location': 'Pharmacy H', 'min_threshold': 10
+        })
+        db.query(InventoryItem).filter(InventoryItem.id == item.id).update({'quantity': 1})
+        db.commit()
+        
+        assert inventory_service.rebuild_low_stock_flags() >= 1
+        assert item.id in {i.id for i in inventory_service.get_low_stock_items()}
+    
     def test_get_expired_items(self, inventory_service):
         """Test getting expired items"""
         yesterday = date.today() - timedelta(days=1)
@@ -198,4 +261,473 @@ class TestInventoryService:
         assert 'total_value' in report
         assert 'low_stock_count' in report
         assert 'expired_count' in report
-        assert len(report['items']) >= 3
+        assert 'items' not in report
+        assert {'Pharmacy 0', 'Pharmacy 1', 'Pharmacy 2'} <= {row['key'] for row in report['by_location']}
+    
+    def test_inventory_report_aggregates_and_invalidates(self, inventory_service):
+        """Test report totals match the items and refresh after a stock change"""
+        before = inventory_service.get_inventory_report(use_cache=False)
+        category = f'report-{uuid.uuid4()}'
+        low = inventory_service.add_inventory_item({
+            'name': 'Gauze', 'quantity': 5, 'unit_cost': Decimal('2.00'),
+            'storage_location': 'Ward A', 'category': category, 'min_threshold': 10
+        })
+        inventory_service.add_inventory_item({
+            'name': 'Saline', 'quantity': 50, 'unit_cost': Decimal('1.50'),
+            'expiration_date': date.today() - timedelta(days=1),
+            'storage_location': 'Ward A', 'category': category, 'min_threshold': 10
+        })
+        
+        report = inventory_service.get_inventory_report()
+        
+        assert report['total_items'] == before['total_items'] + 2
+        assert report['total_value'] == before['total_value'] + Decimal('85.00')
+        group = next(row for row in report['by_category'] if row['key'] == category)
+        assert group['total_items'] == 2
+        assert group['total_value'] == Decimal('85.00')
+        assert group['low_stock_count'] == 1
+        assert group['expired_count'] == 1
+        
+        inventory_service.consume_inventory(low.id, 5)
+        report = inventory_service.get_inventory_report()
+        group = next(row for row in report['by_category'] if row['key'] == category)
+        assert group['total_value'] == Decimal('75.00')
+    
+    def test_inventory_report_by_location_follows_stock(self, inventory_service):
+        """Test the location breakdown values the units held at each location, not each item's home"""
+        pharmacy = f'Pharmacy {uuid.uuid4()}'
+        cabinet = f'Cabinet {uuid.uuid4()}'
+        item = inventory_service.add_inventory_item({
+            'name': 'Ibuprofen 400mg', 'quantity': 100, 'unit_cost': Decimal('0.50'),
+            'storage_location': pharmacy
+        })
+        inventory_service.transfer_stock(item.id, pharmacy, cabinet, 30)
+        
+        by_location = {row['key']: row for row in inventory_service.get_inventory_report()['by_location']}
+        
+        assert by_location[pharmacy]['total_value'] == Decimal('35.00')
+        assert by_location[cabinet]['total_value'] == Decimal('15.00')
+        assert by_location[cabinet]['total_items'] == 1
+        
+        inventory_service.transfer_stock(item.id, pharmacy, cabinet, 70)
+        by_location = {row['key']: row for row in inventory_service.get_inventory_report()['by_location']}
+        assert by_location[pharmacy]['total_value'] == Decimal('0.00')
+        assert by_location[cabinet]['total_value'] == Decimal('50.00')
+    
+    def test_inventory_items_page(self, inventory_service):
+        """Test item detail is paged by ID"""
+        category = f'paged-{uuid.uuid4()}'
+        created = [
+            inventory_service.add_inventory_item({
+                'name': f'Paged {i}', 'quantity': 20, 'unit_cost': Decimal('1.00'),
+                'storage_location': 'Store', 'category': category
+            })
+            for i in range(5)
+        ]
+        
+        seen = []
+        after_id = None
+        for _ in range(5):
+            page = inventory_service.get_inventory_items_page(limit=2, after_id=after_id, category=category)
+            seen.extend(item.id for item in page['items'])
+            after_id = page['next_after_id']
+            if after_id is None:
+                break
+        
+        assert seen == sorted(item.id for item in created)
+    
+    def test_consume_inventory_logs_transaction(self, inventory_service, db):
+        """Test consumption and its transaction log row are committed together"""
+        item = inventory_service.add_inventory_item({
+            'name': 'Omeprazole',
+            'quantity': 30,
+            'unit_cost': Decimal('0.40'),
+            'storage_location': 'Pharmacy K'
+        })
+        
+        inventory_service.consume_inventory(item.id, 4, user_id='nurse-1')
+        
+        consumed = db.query(InventoryTransaction).filter(
+            InventoryTransaction.item_id == item.id,
+            InventoryTransaction.transaction_type == InventoryTransactionType.CONSUME
+        ).one()
+        assert consumed.quantity == 4
+        assert consumed.user_id == 'nurse-1'
+    
+    def test_consume_inventory_rejects_non_positive_quantity(self, inventory_service):
+        """Test consumption quantity must be positive"""
+        item = inventory_service.add_inventory_item({
+            'name': 'Cetirizine',
+            'quantity': 30,
+            'unit_cost': Decimal('0.20'),
+            'storage_location': 'Pharmacy L'
+        })
+        
+        with pytest.raises(ValueError, match="must be positive"):
+            inventory_service.consume_inventory(item.id, -5)
+    
+    def test_concurrent_consumption_never_oversells(self, inventory_service, db):
+        """Stress test: concurrent dispenses of one item never take stock below zero"""
+        item = inventory_service.add_inventory_item({
+            'name': 'Saline 0.9%',
+            'quantity': 100,
+            'unit_cost': Decimal('1.10'),
+            'storage_location': 'Central Store'
+        })
+        
+        def dispense(_):
+            session = SessionLocal()
+            try:
+                InventoryService(session).consume_inventory(item.id, 1)
+                return True
+            except ValueError:
+                return False
+            finally:
+                session.close()
+        
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(dispense, range(160)))
+        
+        assert results.count(True) == 100
+        assert results.count(False) == 60
+        db.expire_all()
+        assert inventory_service.get_inventory_item(item.id).quantity == 0
+        consumed = db.query(InventoryTransaction).filter(
+            InventoryTransaction.item_id == item.id,
+            InventoryTransaction.transaction_type == InventoryTransactionType.CONSUME
+        ).count()
+        assert consumed == 100
+    
+    def _add_batch_items(self, inventory_service, quantities):
+        return [
+            inventory_service.add_inventory_item({
+                'name': f'Batch Item {i}',
+                'quantity': quantity,
+                'unit_cost': Decimal('2.00'),
+                'storage_location': 'Theatre 1'
+            })
+            for i, quantity in enumerate(quantities)
+        ]
+    
+    def test_consume_batch_applies_all_items(self, inventory_service, db):
+        """Test batch consumption decrements every item and logs transactions in bulk"""
+        items = self._add_batch_items(inventory_service, [10, 20, 30])
+        lines = [{'item_id': item.id, 'quantity': 5} for item in items]
+        lines.append({'item_id': items[0].id, 'quantity': 1})
+        
+        report = inventory_service.consume_batch(lines, user_id='theatre-nurse')
+        
+        assert report['committed'] is True
+        assert report['failed'] == []
+        db.expire_all()
+        assert [inventory_service.get_inventory_item(item.id).quantity for item in items] == [4, 15, 25]
+        logged = db.query(InventoryTransaction).filter(
+            InventoryTransaction.item_id.in_([item.id for item in items]),
+            InventoryTransaction.transaction_type == InventoryTransactionType.CONSUME
+        ).count()
+        assert logged == 3
+    
+    def test_consume_batch_all_or_nothing_rejects_batch(self, inventory_service, db):
+        """Test a single failing line rejects an all-or-nothing batch"""
+        items = self._add_batch_items(inventory_service, [10, 2])
+        lines = [{'item_id': items[0].id, 'quantity': 5}, {'item_id': items[1].id, 'quantity': 5}]
+        
+        report = inventory_service.consume_batch(lines, mode='all_or_nothing')
+        
+        assert report['committed'] is False
+        assert report['failed'] == [{'item_id': items[1].id, 'quantity': 5, 'reason': 'insufficient inventory'}]
+        db.expire_all()
+        assert inventory_service.get_inventory_item(items[0].id).quantity == 10
+    
+    def test_consume_batch_partial_reports_failures(self, inventory_service, db):
+        """Test partial mode applies valid lines and reports the rest"""
+        items = self._add_batch_items(inventory_service, [10, 2])
+        lines = [
+            {'item_id': items[0].id, 'quantity': 5},
+            {'item_id': items[1].id, 'quantity': 5},
+            {'item_id': 'missing-item', 'quantity': 1}
+        ]
+        
+        report = inventory_service.consume_batch(lines, mode='partial')
+        
+        assert report['committed'] is True
+        assert report['applied'] == [{'item_id': items[0].id, 'quantity': 5}]
+        assert {line['reason'] for line in report['failed']} == {'insufficient inventory', 'item not found'}
+        db.expire_all()
+        assert inventory_service.get_inventory_item(items[0].id).quantity == 5
+    
+    def test_consume_batch_checks_lines_before_merging(self, inventory_service, db):
+        """Test a non-positive line is rejected rather than netted against another line of the item"""
+        items = self._add_batch_items(inventory_service, [10, 10])
+        lines = [
+            {'item_id': items[0].id, 'quantity': 8},
+            {'item_id': items[0].id, 'quantity': -5},
+            {'item_id': items[1].id, 'quantity': 0}
+        ]
+        
+        rejected = inventory_service.consume_batch(lines)
+        
+        assert rejected['committed'] is False
+        assert [line['reason'] for line in rejected['failed']] == ['quantity must be positive'] * 2
+        
+        report = inventory_service.consume_batch(lines, mode='partial')
+        
+        assert report['applied'] == [{'item_id': items[0].id, 'quantity': 8}]
+        db.expire_all()
+        assert [inventory_service.get_inventory_item(item.id).quantity for item in items] == [2, 10]
+    
+    def test_consume_batch_invalid_mode(self, inventory_service):
+        """Test unsupported batch modes are rejected"""
+        with pytest.raises(ValueError, match="Unsupported batch mode"):
+            inventory_service.consume_batch([{'item_id': 'x', 'quantity': 1}], mode='best_effort')
+    
+    def test_receive_lot_keeps_item_totals(self, inventory_service):
+        """Test receiving lots adds stock without overwriting earlier expiry"""
+        soon = date.today() + timedelta(days=10)
+        later = date.today() + timedelta(days=200)
+        item = inventory_service.add_inventory_item({
+            'name': 'Amoxicillin 500mg',
+            'quantity': 20,
+            'unit_cost': Decimal('0.30'),
+            'storage_location': 'Pharmacy M',
+            'expiration_date': soon
+        })
+        
+        inventory_service.receive_lot(item.id, 50, later, 'LOT-B')
+        
+        lots = inventory_service.get_item_lots(item.id)
+        assert [(lot.lot_number, lot.quantity) for lot in lots] == [('OPENING', 20), ('LOT-B', 50)]
+        updated = inventory_service.get_inventory_item(item.id)
+        assert updated.quantity == 70
+        assert updated.expiration_date == soon
+    
+    def test_consume_lot_tracked_item_fefo(self, inventory_service):
+        """Test consumption draws from the soonest-expiring unexpired lots first"""
+        item = inventory_service.add_inventory_item({
+            'name': 'Insulin Glargine',
+            'quantity': 0,
+            'unit_cost': Decimal('25.00'),
+            'storage_location': 'Fridge 1'
+        })
+        expired = inventory_service.receive_lot(item.id, 5, date.today() - timedelta(days=1), 'OLD')
+        late = inventory_service.receive_lot(item.id, 10, date.today() + timedelta(days=90), 'LATE')
+        early = inventory_service.receive_lot(item.id, 4, date.today() + timedelta(days=30), 'EARLY')
+        
+        assert [a['lot_id'] for a in inventory_service.allocate_fefo(item.id, 6)] == [early.id, late.id]
+        consumed = inventory_service.consume_inventory(item.id, 6)
+        
+        assert consumed.quantity == 13
+        remaining = {lot.id: lot.quantity for lot in inventory_service.get_item_lots(item.id, include_empty=True)}
+        assert remaining == {expired.id: 5, early.id: 0, late.id: 8}
+    
+    def test_consume_lot_tracked_item_ignores_expired_lots(self, inventory_service):
+        """Test expired lots cannot cover a consumption"""
+        item = inventory_service.add_inventory_item({
+            'name': 'Tetanus Vaccine',
+            'quantity': 0,
+            'unit_cost': Decimal('12.00'),
+            'storage_location': 'Fridge 2'
+        })
+        inventory_service.receive_lot(item.id, 5, date.today() - timedelta(days=3), 'OLD')
+        inventory_service.receive_lot(item.id, 2, date.today() + timedelta(days=60), 'NEW')
+        
+        assert inventory_service.allocate_fefo(item.id, 4) is None
+        with pytest.raises(ValueError, match="Insufficient unexpired stock.*2 of 4 available, short 2"):
+            inventory_service.consume_inventory(item.id, 4)
+        assert inventory_service.consume_batch([{'item_id': item.id, 'quantity': 2}])['committed'] is True
+    
+    def test_consume_batch_partial_rejects_short_lot_line(self, inventory_service, db):
+        """Test partial mode rejects only the line whose lots cannot cover it"""
+        fridge = f'Fridge {uuid.uuid4()}'
+        lot_item = inventory_service.add_inventory_item({
+            'name': 'Hepatitis B Vaccine',
+            'quantity': 0,
+            'unit_cost': Decimal('15.00'),
+            'storage_location': fridge
+        })
+        soon = inventory_service.receive_lot(lot_item.id, 3, date.today() + timedelta(days=20), 'SOON')
+        inventory_service.receive_lot(lot_item.id, 6, date.today() - timedelta(days=2), 'LAPSED')
+        plain = self._add_batch_items(inventory_service, [10])[0]
+        
+        report = inventory_service.consume_batch([
+            {'item_id': lot_item.id, 'quantity': 5},
+            {'item_id': plain.id, 'quantity': 4}
+        ], mode='partial')
+        
+        assert report['committed'] is True
+        assert report['applied'] == [{'item_id': plain.id, 'quantity': 4}]
+        assert report['failed'] == [{'item_id': lot_item.id, 'quantity': 5, 'reason': 'insufficient unexpired lot stock'}]
+        db.expire_all()
+        assert inventory_service.get_inventory_item(plain.id).quantity == 6
+        assert inventory_service.get_inventory_item(lot_item.id).quantity == 9
+        assert {lot.id: lot.quantity for lot in inventory_service.get_item_lots(lot_item.id)}[soon.id] == 3
+        assert [row['quantity'] for row in inventory_service.get_location_stock(fridge)] == [9]
+    
+    def test_new_item_stocks_home_location(self, inventory_service):
+        """Test a new item's stock is held at its storage location"""
+        item = inventory_service.add_inventory_item({
+            'name': 'Located Item', 'quantity': 40, 'unit_cost': Decimal('1.00'),
+            'storage_location': f'Ward {uuid.uuid4()}'
+        })
+        
+        locations = inventory_service.get_item_locations(item.id)
+        
+        assert [(row.location, row.quantity) for row in locations] == [(item.storage_location, 40)]
+    
+    def test_transfer_and_consume_by_location(self, inventory_service, db):
+        """Test transfers move stock between locations with paired transactions and keep the item total"""
+        pharmacy = f'Pharmacy {uuid.uuid4()}'
+        cabinet = f'Cabinet {uuid.uuid4()}'
+        item = inventory_service.add_inventory_item({
+            'name': 'Amoxicillin 500mg', 'quantity': 100, 'unit_cost': Decimal('0.20'),
+            'storage_location': pharmacy
+        })
+        
+        inventory_service.transfer_stock(item.id, pharmacy, cabinet, 30, user_id='porter')
+        inventory_service.consume_inventory(item.id, 10, location=cabinet)
+        with pytest.raises(ValueError, match=f"Insufficient inventory at {cabinet}"):
+            inventory_service.consume_inventory(item.id, 25, location=cabinet)
+        
+        stock = {row.location: row.quantity for row in inventory_service.get_item_locations(item.id)}
+        assert stock == {pharmacy: 70, cabinet: 20}
+        db.expire_all()
+        assert inventory_service.get_inventory_item(item.id).quantity == 90
+        legs = db.query(InventoryTransaction).filter(
+            InventoryTransaction.item_id == item.id,
+            InventoryTransaction.transaction_type == InventoryTransactionType.TRANSFER
+        ).all()
+        assert sorted(leg.quantity for leg in legs) == [-30, 30]
+        assert legs[0].reference_id == legs[1].reference_id
+    
+    def test_location_rollups(self, inventory_service):
+        """Test per-location and facility-wide totals"""
+        name = f'Syringe {uuid.uuid4()}'
+        store = f'Store {uuid.uuid4()}'
+        first = inventory_service.add_inventory_item({
+            'name': name, 'quantity': 50, 'unit_cost': Decimal('0.10'), 'storage_location': store
+        })
+        inventory_service.add_inventory_item({
+            'name': name, 'quantity': 20, 'unit_cost': Decimal('0.10'), 'storage_location': store
+        })
+        inventory_service.transfer_stock(first.id, store, f'{store}-ward', 5)
+        
+        totals = {row['location']: row for row in inventory_service.get_location_totals()}
+        assert totals[store]['item_count'] == 2
+        assert totals[store]['total_units'] == 65
+        assert [row['quantity'] for row in inventory_service.get_location_stock(f'{store}-ward')] == [5]
+        by_item = inventory_service.get_item_totals(name)
+        assert sum(row['quantity'] for row in by_item) == 70
+        assert max(row['location_count'] for row in by_item) == 2
+    
+    def test_transfer_rejects_short_source(self, inventory_service):
+        """Test a transfer cannot move more than the source location holds"""
+        item = inventory_service.add_inventory_item({
+            'name': 'Short Item', 'quantity': 5, 'unit_cost': Decimal('1.00'), 'storage_location': 'Ward S'
+        })
+        
+        with pytest.raises(ValueError, match="Insufficient inventory at Ward S"):
+            inventory_service.transfer_stock(item.id, 'Ward S', 'Ward T', 6)
+    
+    def test_sharded_counter_splits_stock(self, inventory_service):
+        """Test enabling a sharded counter spreads stock evenly and keeps the total"""
+        item = inventory_service.add_inventory_item({
+            'name': 'Hot Gloves', 'quantity': 10, 'unit_cost': Decimal('0.05'), 'storage_location': 'Ward H'
+        })
+        
+        inventory_service.enable_sharded_counter(item.id, 4)
+        shards = inventory_service.db.query(InventoryCounterShard).filter(
+            InventoryCounterShard.item_id == item.id
+        ).order_by(InventoryCounterShard.shard).all()
+        
+        assert [shard.quantity for shard in shards] == [3, 3, 2, 2]
+        assert inventory_service.get_available_quantity(item.id) == 10
+        with pytest.raises(ValueError, match="at least 2 shards"):
+            inventory_service.enable_sharded_counter(item.id, 1)
+    
+    def test_sharded_counter_never_oversells(self, db, inventory_service):
+        """Test concurrent consumers of a sharded item stop exactly at zero"""
+        item = inventory_service.add_inventory_item({
+            'name': 'Hot Masks', 'quantity': 60, 'unit_cost': Decimal('0.20'), 'storage_location': 'Ward H'
+        })
+        inventory_service.enable_sharded_counter(item.id, 8)
+        
+        def dispense(_):
+            session = SessionLocal()
+            try:
+                InventoryService(session).consume_inventory(item.id, 1)
+                return True
+            except ValueError:
+                return False
+            finally:
+                session.close()
+        
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(dispense, range(90)))
+        
+        assert results.count(True) == 60
+        assert inventory_service.get_available_quantity(item.id) == 0
+        inventory_service.compact_sharded_counters()
+        db.expire_all()
+        assert inventory_service.get_inventory_item(item.id).quantity == 0
+    
+    def test_sharded_consume_drains_across_shards(self, inventory_service):
+        """Test a consumption larger than any one shard draws from several"""
+        item = inventory_service.add_inventory_item({
+            'name': 'Hot Swabs', 'quantity': 12, 'unit_cost': Decimal('0.02'), 'storage_location': 'Ward H'
+        })
+        inventory_service.enable_sharded_counter(item.id, 4)
+        before = inventory_service.get_inventory_report()
+        
+        consumed = inventory_service.consume_inventory(item.id, 10)
+        
+        assert consumed.quantity == 2
+        assert inventory_service.db.is_modified(consumed) is False
+        assert inventory_service.get_inventory_report() is not before
+        assert inventory_service.get_available_quantity(item.id) == 2
+        with pytest.raises(ValueError, match="Insufficient inventory"):
+            inventory_service.consume_inventory(item.id, 3)
+        assert inventory_service.get_available_quantity(item.id) == 2
+    
+    def test_compaction_folds_shards_into_item(self, db, inventory_service):
+        """Test compaction updates item stock, home location stock and the low-stock flag"""
+        item = inventory_service.add_inventory_item({
+            'name': 'Hot Gauze', 'quantity': 40, 'unit_cost': Decimal('0.30'),
+            'storage_location': 'Ward C', 'min_threshold': 10
+        })
+        inventory_service.enable_sharded_counter(item.id, 4)
+        inventory_service.consume_inventory(item.id, 32)
+        db.expire_all()
+        assert inventory_service.get_inventory_item(item.id).quantity == 40
+        
+        inventory_service.compact_sharded_counters()
+        db.expire_all()
+        
+        refreshed = inventory_service.get_inventory_item(item.id)
+        assert refreshed.quantity == 8
+        assert refreshed.is_low_stock is True
+        assert [row.quantity for row in inventory_service.get_item_locations(item.id)] == [8]
+        event = db.query(OutboxEvent).filter(OutboxEvent.aggregate_id == item.id).one()
+        assert event.event_type == 'inventory.low_stock'
+    
+    def test_sharded_stock_level_update_and_disable(self, db, inventory_service):
+        """Test setting stock on a sharded item and folding its shards back"""
+        item = inventory_service.add_inventory_item({
+            'name': 'Hot Tape', 'quantity': 20, 'unit_cost': Decimal('0.40'), 'storage_location': 'Ward D'
+        })
+        inventory_service.enable_sharded_counter(item.id, 2)
+        inventory_service.consume_inventory(item.id, 5)
+        
+        inventory_service.update_stock_level(item.id, 30)
+        adjust = db.query(InventoryTransaction).filter(
+            InventoryTransaction.item_id == item.id,
+            InventoryTransaction.transaction_type == InventoryTransactionType.ADJUST
+        ).one()
+        assert adjust.quantity == 15
+        
+        inventory_service.disable_sharded_counter(item.id)
+        inventory_service.consume_inventory(item.id, 4)
+        db.expire_all()
+        refreshed = inventory_service.get_inventory_item(item.id)
+        assert refreshed.shard_count == 0
+        assert refreshed.quantity == 26
+        assert [row.quantity for row in inventory_service.get_item_locations(item.id)] == [26]
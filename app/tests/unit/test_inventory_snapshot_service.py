@@ -0,0 +1,89 @@
+"""Unit tests for inventory snapshot service"""
+import uuid
+import pytest
+from datetime import datetime, timedelta
+from decimal import Decimal
+from app.services.inventory_service import InventoryService
+from app.services.inventory_snapshot_service import InventorySnapshotService
+from app.models.inventory import InventoryItem, InventoryCheckpoint
+from app.database import SessionLocal
+
+@pytest.fixture
+def db():
+    """Database session fixture"""
+    session = SessionLocal()
+    yield session
+    session.close()
+
+@pytest.fixture
+def snapshot_service(db):
+    """Inventory snapshot service fixture"""
+    return InventorySnapshotService(db)
+
+@pytest.fixture
+def inventory_service(db):
+    """Inventory service fixture"""
+    return InventoryService(db)
+
+def _add_item(inventory_service, quantity=100):
+    return inventory_service.add_inventory_item({
+        'name': 'Snapshot Item',
+        'quantity': quantity,
+        'unit_cost': Decimal('1.00'),
+        'storage_location': 'Central Store'
+    })
+
+class TestInventorySnapshotService:
+    """Unit tests for InventorySnapshotService"""
+
+    def test_stock_as_of_replays_transactions(self, snapshot_service, inventory_service):
+        """Test as-of quantities follow consumption and adjustments"""
+        item = _add_item(inventory_service, 100)
+        inventory_service.consume_inventory(item.id, 30)
+        after_consume = datetime.utcnow()
+        inventory_service.update_stock_level(item.id, 90)
+        after_adjust = datetime.utcnow()
+
+        assert snapshot_service.get_item_stock_as_of(item.id, after_consume) == 70
+        assert snapshot_service.get_item_stock_as_of(item.id, after_adjust) == 90
+        assert snapshot_service.get_item_stock_as_of(item.id, item.created_at - timedelta(days=1)) == 0
+
+    def test_checkpoint_folds_log_and_later_transactions_replay(self, snapshot_service, inventory_service, db):
+        """Test as-of queries start from a checkpoint and replay only later transactions"""
+        item = _add_item(inventory_service, 50)
+        inventory_service.consume_inventory(item.id, 5)
+        cutoff = datetime.utcnow()
+        checkpoint = snapshot_service.take_checkpoint(cutoff)
+        inventory_service.consume_inventory(item.id, 10)
+
+        assert checkpoint.item_count >= 1
+        assert snapshot_service.get_item_stock_as_of(item.id, cutoff) == 45
+        assert snapshot_service.get_item_stock_as_of(item.id, datetime.utcnow()) == 35
+
+        with pytest.raises(ValueError, match="Checkpoint already exists"):
+            snapshot_service.take_checkpoint(cutoff)
+
+    def test_consistency_check_detects_drift(self, snapshot_service, inventory_service, db):
+        """Test quantities changed outside the transaction log are reported"""
+        clean = _add_item(inventory_service, 20)
+        drifted = _add_item(inventory_service, 20)
+        inventory_service.consume_inventory(clean.id, 5)
+        db.query(InventoryItem).filter(InventoryItem.id == drifted.id).update({'quantity': 25})
+        db.commit()
+
+        report = snapshot_service.check_consistency([clean.id, drifted.id])
+
+        assert report['checked'] == 2
+        assert report['mismatches'] == [{'item_id': drifted.id, 'quantity': 25, 'replayed': 20}]
+
+    def test_purge_checkpoints_keeps_recent(self, snapshot_service, inventory_service, db):
+        """Test purging keeps the newest checkpoints and as-of results stay correct"""
+        item = _add_item(inventory_service, 10)
+        base = datetime.utcnow()
+        for i in range(3):
+            snapshot_service.take_checkpoint(base + timedelta(microseconds=i + 1))
+
+        snapshot_service.purge_checkpoints(keep=1)
+
+        assert db.query(InventoryCheckpoint).count() == 1
+        assert snapshot_service.get_item_stock_as_of(item.id, datetime.utcnow()) == 10
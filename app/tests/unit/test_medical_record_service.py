@@ -1,9 +1,10 @@
 """Unit tests for medical record service"""
 import pytest
+from sqlalchemy import event
 from datetime import datetime, date
 from app.services.medical_record_service import MedicalRecordService
 from app.models.medical_record import MedicalRecord
-from app.database import SessionLocal
+from app.database import SessionLocal, engine
 import uuid
 
 @pytest.fixture
@@ -18,6 +19,16 @@ def medical_record_service(db):
     """Medical record service fixture"""
     return MedicalRecordService(db)
 
+@pytest.fixture
+def statements():
+    """Record SQL statements run on the engine"""
+    executed = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+    event.listen(engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(engine, "before_cursor_execute", record)
+
 class TestMedicalRecordService:
     """Unit tests for MedicalRecordService"""
     
@@ -127,3 +138,47 @@ class TestMedicalRecordService:
         # Currently returns True for all users (TODO in service)
         result = medical_record_service.verify_access(user_id, patient_id)
         assert result is True
+    
+    def test_get_full_record_loads_children(self, medical_record_service, db, statements):
+        """Test full record holds every entry carried into the latest version, read in six queries"""
+        patient_id = f"patient-{str(uuid.uuid4())[:8]}"
+        first = medical_record_service.create_record(patient_id, "doctor-1")
+        medical_record_service.add_diagnosis(patient_id, "E11.9", "Type 2 diabetes")
+        db.add(MedicalRecord(id=str(uuid.uuid4()), patient_id=patient_id, created_by="doctor-1", version=2))
+        db.commit()
+        medical_record_service.add_diagnosis(patient_id, "I10", "Hypertension")
+        medical_record_service.add_treatment(patient_id, "medication", "Lisinopril", datetime(2024, 1, 1))
+        medical_record_service.add_clinical_note(patient_id, "Blood pressure stable", "doctor-1")
+        db.expunge_all()
+        
+        statements.clear()
+        record = medical_record_service.get_full_record(patient_id)
+        assert record['version'] == 2
+        assert [d['diagnosis_code'] for d in record['diagnoses']] == ["E11.9", "I10"]
+        assert len(record['treatments']) == 1
+        assert len(record['clinical_notes']) == 1
+        assert len(statements) == 6
+        
+        first_version = medical_record_service.get_full_record(patient_id, version=1)
+        assert first_version['id'] == first.id
+        assert [d['diagnosis_code'] for d in first_version['diagnoses']] == ["E11.9"]
+        assert medical_record_service.get_full_record(patient_id, version=9) is None
+        assert medical_record_service.get_full_record("nonexistent-patient") is None
+    
+    def test_get_full_record_history_loads_children_in_bulk(self, medical_record_service, db, statements):
+        """Test full history reads each child table once regardless of version count"""
+        patient_id = f"patient-{str(uuid.uuid4())[:8]}"
+        medical_record_service.create_record(patient_id, "doctor-1")
+        for version in range(2, 5):
+            medical_record_service.add_diagnosis(patient_id, f"J0{version}", "Respiratory infection")
+            db.add(MedicalRecord(id=str(uuid.uuid4()), patient_id=patient_id, created_by="doctor-1", version=version))
+            db.commit()
+        db.expunge_all()
+        
+        statements.clear()
+        history = medical_record_service.get_full_record_history(patient_id)
+        assert [record['version'] for record in history] == [4, 3, 2, 1]
+        assert [len(record['diagnoses']) for record in history] == [3, 3, 2, 1]
+        assert all(record['treatments'] == [] and record['clinical_notes'] == [] for record in history)
+        assert len(statements) == 6
+        assert medical_record_service.get_full_record_history("nonexistent-patient") == []
@@ -0,0 +1,125 @@
+"""Unit tests for medication catalog service"""
+import uuid
+import pytest
+from datetime import datetime
+from decimal import Decimal
+from fastapi.testclient import TestClient
+from sqlalchemy import event, update
+from app.main import create_app
+from app.services.inventory_service import InventoryService
+from app.services.medication_catalog_service import MedicationCatalogService, _catalog
+from app.models.inventory import InventoryItem
+from app.database import SessionLocal, engine
+
+@pytest.fixture
+def db():
+    """Database session fixture"""
+    session = SessionLocal()
+    yield session
+    session.close()
+
+@pytest.fixture
+def catalog_service(db):
+    """Medication catalog service fixture"""
+    return MedicationCatalogService(db)
+
+@pytest.fixture
+def inventory_service(db):
+    """Inventory service fixture"""
+    return InventoryService(db)
+
+@pytest.fixture
+def statements():
+    """Record SQL statements run on the engine"""
+    executed = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+    event.listen(engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(engine, "before_cursor_execute", record)
+
+def _add_medication(inventory_service, name='Amoxicillin'):
+    return inventory_service.add_inventory_item({
+        'name': name,
+        'quantity': 50,
+        'unit_cost': Decimal('0.40'),
+        'storage_location': 'Pharmacy Catalog',
+        'category': 'antibiotic'
+    })
+
+class TestMedicationCatalogService:
+    """Unit tests for MedicationCatalogService"""
+
+    def test_bulk_validate_hit_runs_no_queries(self, catalog_service, inventory_service, statements):
+        """Test a warm catalog validates a medication list without touching the database"""
+        medications = [_add_medication(inventory_service, f'Catalog Med {i}') for i in range(3)]
+        ids = [medication.id for medication in medications]
+        catalog_service.validate_medications(ids)
+        statements.clear()
+
+        result = catalog_service.validate_medications(ids)
+
+        assert result == {medication_id: True for medication_id in ids}
+        assert statements == []
+
+    def test_new_item_is_visible_after_invalidation(self, catalog_service, inventory_service):
+        """Test adding an inventory item invalidates the catalog"""
+        catalog_service.refresh(full=True)
+        medication = _add_medication(inventory_service)
+
+        entry = catalog_service.get_medication(medication.id)
+
+        assert entry['name'] == 'Amoxicillin'
+        assert entry['category'] == 'antibiotic'
+
+    def test_miss_reads_missing_ids(self, db, catalog_service):
+        """Test an item written by another process behind the watermark is found on a miss"""
+        catalog_service.refresh(full=True)
+        other = SessionLocal()
+        try:
+            item_id = str(uuid.uuid4())
+            # Committed long after its timestamp, so an incremental refresh would skip it
+            other.add(InventoryItem(
+                id=item_id, name='External Med', quantity=5, unit_cost=Decimal('1.00'),
+                storage_location='Pharmacy Catalog', updated_at=datetime(2000, 1, 1)
+            ))
+            other.commit()
+        finally:
+            other.close()
+
+        assert catalog_service.validate_medications([item_id, 'missing-med']) == {
+            item_id: True, 'missing-med': False
+        }
+
+    def test_unknown_ids_do_not_refresh_every_lookup(self, catalog_service, statements):
+        """Test a repeated lookup of an unknown ID is answered from the negative cache"""
+        unknown = f'unknown-{uuid.uuid4()}'
+        assert catalog_service.get_medication(unknown) is None
+        statements.clear()
+
+        assert catalog_service.get_medication(unknown) is None
+
+        assert statements == []
+
+    def test_app_startup_loads_catalog(self, inventory_service):
+        """Test the application loads the catalog at startup"""
+        medication = _add_medication(inventory_service, 'Startup Med')
+        _catalog.refreshed_at = None
+
+        with TestClient(create_app()):
+            assert _catalog.refreshed_at is not None
+            assert medication.id in _catalog.entries
+
+    def test_refresh_picks_up_changed_rows(self, db, catalog_service, inventory_service):
+        """Test an incremental refresh reads rows updated since the watermark"""
+        medication = _add_medication(inventory_service, 'Old Name')
+        catalog_service.get_medication(medication.id)
+        db.execute(
+            update(InventoryItem).where(InventoryItem.id == medication.id)
+            .values(name='New Name', updated_at=InventoryItem.updated_at)
+        )
+        db.commit()
+
+        catalog_service.refresh()
+
+        assert catalog_service.get_medication(medication.id)['name'] == 'New Name'
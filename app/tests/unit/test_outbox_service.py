@@ -0,0 +1,150 @@
+"""Unit tests for outbox service and relay"""
+import json
+import queue
+import pytest
+from datetime import datetime, timedelta
+from decimal import Decimal
+from app.services.billing_service import BillingService
+from app.services.outbox_service import OutboxService, OutboxRelay, OutboxSink, QueueSink, FileSink
+from app.models.outbox import OutboxEvent
+
+class FlakySink(OutboxSink):
+    """Sink that fails the first delivery for one aggregate"""
+
+    def __init__(self, failing_aggregate_id):
+        self.failing_aggregate_id = failing_aggregate_id
+        self.delivered = []
+
+    def publish(self, event):
+        if event['aggregate_id'] == self.failing_aggregate_id:
+            self.failing_aggregate_id = None
+            raise RuntimeError("sink unavailable")
+        self.delivered.append(event)
+
+class DownSink(OutboxSink):
+    """Sink that always fails one aggregate and records whether a transaction was open"""
+
+    def __init__(self, db, failing_aggregate_id):
+        self.db = db
+        self.failing_aggregate_id = failing_aggregate_id
+        self.delivered = []
+        self.in_transaction = []
+
+    def publish(self, event):
+        self.in_transaction.append(self.db.in_transaction())
+        if event['aggregate_id'] == self.failing_aggregate_id:
+            raise RuntimeError("sink unavailable")
+        self.delivered.append(event)
+
+@pytest.fixture
+def outbox_service(test_db):
+    """Outbox service fixture on an isolated database"""
+    return OutboxService(test_db)
+
+class TestOutboxService:
+    """Unit tests for OutboxService and OutboxRelay"""
+
+    def test_billing_changes_write_events_in_same_transaction(self, test_db, outbox_service):
+        """Test billing and payment writes add outbox events"""
+        service = BillingService(test_db)
+        record = service.create_billing_record('patient-outbox', [
+            {'service_type': 'consultation', 'quantity': 1, 'unit_price': 100.00, 'total_price': 100.00}
+        ])
+        service.process_payment(record.id, Decimal('20.00'), 'credit_card')
+
+        events = test_db.query(OutboxEvent).order_by(OutboxEvent.id).all()
+        assert [event.event_type for event in events] == ['billing.created', 'payment.completed']
+        assert all(event.aggregate_id == record.id for event in events)
+        assert json.loads(events[1].payload)['billing_status'] == 'paid'
+
+    def test_failed_payment_writes_no_event(self, test_db, outbox_service):
+        """Test a rejected change leaves no event behind"""
+        with pytest.raises(ValueError):
+            BillingService(test_db).process_payment('missing-bill', Decimal('20.00'), 'credit_card')
+        test_db.rollback()
+
+        assert outbox_service.get_pending_count() == 0
+
+    def test_relay_publishes_in_order(self, test_db, outbox_service):
+        """Test relay delivers pending events in insertion order and marks them published"""
+        for i in range(5):
+            outbox_service.add_event('bill', 'b1', 'billing.created', {'n': i})
+        test_db.commit()
+        sink = QueueSink(queue.Queue())
+
+        stats = OutboxRelay(test_db, [sink], batch_size=2).drain()
+
+        assert stats['published'] == 5
+        assert [sink.queue.get_nowait()['payload']['n'] for _ in range(5)] == [0, 1, 2, 3, 4]
+        assert outbox_service.get_pending_count() == 0
+
+    def test_relay_holds_back_stream_after_failure(self, test_db, outbox_service):
+        """Test a failed event blocks later events of its aggregate but not other aggregates"""
+        outbox_service.add_event('bill', 'b1', 'billing.created', {'n': 1})
+        outbox_service.add_event('bill', 'b2', 'billing.created', {'n': 2})
+        outbox_service.add_event('bill', 'b1', 'payment.completed', {'n': 3})
+        test_db.commit()
+        sink = FlakySink('b1')
+        relay = OutboxRelay(test_db, [sink])
+
+        first = relay.drain_once()
+        assert first == {'published': 1, 'failed': 1, 'deferred': 1}
+        assert [event['payload']['n'] for event in sink.delivered] == [2]
+
+        relay.drain_once()
+        assert [event['payload']['n'] for event in sink.delivered] == [2, 1, 3]
+        failed = test_db.query(OutboxEvent).filter(OutboxEvent.aggregate_id == 'b1').first()
+        assert failed.attempts == 1
+
+    def test_blocked_aggregate_does_not_starve_others(self, test_db, outbox_service):
+        """Test a stalled aggregate filling whole batches is skipped so later aggregates drain"""
+        for i in range(5):
+            outbox_service.add_event('bill', 'stalled', 'billing.created', {'n': i})
+        outbox_service.add_event('bill', 'b2', 'billing.created', {'n': 5})
+        test_db.commit()
+        sink = DownSink(test_db, 'stalled')
+
+        stats = OutboxRelay(test_db, [sink], batch_size=2).drain()
+
+        assert [event['payload']['n'] for event in sink.delivered] == [5]
+        assert stats['failed'] == 1
+        assert sink.in_transaction and not any(sink.in_transaction)
+        stalled = test_db.query(OutboxEvent).filter(OutboxEvent.aggregate_id == 'stalled').all()
+        assert all(event.claimed_until is None and event.published_at is None for event in stalled)
+
+    def test_relay_skips_events_claimed_by_another_relay(self, test_db, outbox_service):
+        """Test a leased event and the later events of its aggregate are left to their claimant"""
+        claimed = outbox_service.add_event('bill', 'b1', 'billing.created', {'n': 1})
+        outbox_service.add_event('bill', 'b1', 'payment.completed', {'n': 2})
+        outbox_service.add_event('bill', 'b2', 'billing.created', {'n': 3})
+        claimed.claimed_until = datetime.utcnow() + timedelta(minutes=1)
+        test_db.commit()
+        sink = QueueSink(queue.Queue())
+
+        OutboxRelay(test_db, [sink]).drain()
+
+        assert [sink.queue.get_nowait()['payload']['n'] for _ in range(sink.queue.qsize())] == [3]
+
+    def test_sink_must_implement_publish(self):
+        """Test a sink without publish cannot be created"""
+        with pytest.raises(TypeError):
+            OutboxSink()
+
+    def test_file_sink_appends_ndjson(self, test_db, outbox_service, tmp_path):
+        """Test file sink writes one JSON line per event"""
+        outbox_service.add_event('prescription', 'rx1', 'prescription.created', {'patient_id': 'p1'})
+        test_db.commit()
+        path = tmp_path / 'events.ndjson'
+        sink = FileSink(str(path))
+
+        OutboxRelay(test_db, [sink]).drain()
+        sink.close()
+
+        lines = path.read_text().splitlines()
+        assert len(lines) == 1
+        assert json.loads(lines[0])['event_type'] == 'prescription.created'
+
+    def test_relay_requires_sink(self, test_db):
+        """Test relay cannot be created without sinks"""
+        with pytest.raises(ValueError, match="at least one sink"):
+            OutboxRelay(test_db, [])
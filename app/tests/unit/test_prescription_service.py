@@ -1,9 +1,15 @@
 """Unit tests for prescription service"""
+import uuid
 import pytest
-from datetime import datetime
-from app.services.prescription_service import PrescriptionService
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy.exc import IntegrityError
+from app.services.prescription_service import PrescriptionService, parse_duration
 from app.services.inventory_service import InventoryService
-from app.models.prescription import PrescriptionStatus
+from app.services.billing_service import BillingService
+from app.models.prescription import Prescription, PrescriptionStatus
+from app.models.billing import BillingRecord
+from app.models.outbox import OutboxEvent
 from app.database import SessionLocal
 
 @pytest.fixture
@@ -23,6 +29,17 @@ def inventory_service(db):
     """Inventory service fixture"""
     return InventoryService(db)
 
+def _prescribe(prescription_service, medication_id, quantity, patient_id=None):
+    return prescription_service.create_prescription({
+        'patient_id': patient_id or f'patient-{uuid.uuid4()}',
+        'doctor_id': 'doctor-dispense',
+        'medication_id': medication_id,
+        'dosage': '10mg',
+        'frequency': 'daily',
+        'duration': '10 days',
+        'items': [{'quantity': quantity}]
+    })
+
 class TestPrescriptionService:
     """Unit tests for PrescriptionService"""
     
@@ -206,3 +223,238 @@ class TestPrescriptionService:
         
         assert history is not None
         assert len(history) >= 1
+    
+    def test_dispense_prescription(self, db, prescription_service, inventory_service):
+        """Test dispensing decrements stock, bills the items and fills the prescription"""
+        medication = inventory_service.add_inventory_item({
+            'name': 'Dispense Med', 'quantity': 40, 'unit_cost': Decimal('2.50'), 'storage_location': 'Pharmacy G'
+        })
+        prescription = _prescribe(prescription_service, medication.id, 10)
+        
+        result = prescription_service.dispense_prescription(prescription.id)
+        
+        db.expire_all()
+        assert result['status'] == 'filled'
+        assert prescription_service.get_prescription(prescription.id).status == PrescriptionStatus.FILLED
+        assert inventory_service.get_inventory_item(medication.id).quantity == 30
+        billing = db.get(BillingRecord, result['billing_id'])
+        assert billing.total_amount == Decimal('25.00')
+        assert billing.patient_id == prescription.patient_id
+        events = db.query(OutboxEvent).filter(OutboxEvent.aggregate_id == prescription.id).all()
+        assert 'prescription.dispensed' in {event.event_type for event in events}
+        with pytest.raises(ValueError, match="not active"):
+            prescription_service.dispense_prescription(prescription.id)
+    
+    def test_dispense_short_stock_changes_nothing(self, db, prescription_service, inventory_service):
+        """Test a prescription that cannot be filled leaves stock, billing and status untouched"""
+        medication = inventory_service.add_inventory_item({
+            'name': 'Scarce Med', 'quantity': 3, 'unit_cost': Decimal('4.00'), 'storage_location': 'Pharmacy G'
+        })
+        prescription = _prescribe(prescription_service, medication.id, 5)
+        
+        with pytest.raises(ValueError, match="Cannot dispense"):
+            prescription_service.dispense_prescription(prescription.id)
+        
+        db.expire_all()
+        assert prescription_service.get_prescription(prescription.id).status == PrescriptionStatus.ACTIVE
+        assert inventory_service.get_inventory_item(medication.id).quantity == 3
+        assert db.query(BillingRecord).filter(BillingRecord.patient_id == prescription.patient_id).count() == 0
+    
+    def test_dispense_failure_after_stock_step_rolls_back_stock(self, db, prescription_service, inventory_service,
+                                                                monkeypatch):
+        """Test a failure after the stock decrement leaves stock unchanged and the prescription active"""
+        medication = inventory_service.add_inventory_item({
+            'name': 'Atomic Med', 'quantity': 20, 'unit_cost': Decimal('1.00'), 'storage_location': 'Pharmacy G'
+        })
+        prescription = _prescribe(prescription_service, medication.id, 5)
+        
+        def fail_billing(*args, **kwargs):
+            raise RuntimeError("billing unavailable")
+        monkeypatch.setattr(BillingService, 'stage_billing_record', fail_billing)
+        
+        with pytest.raises(RuntimeError, match="billing unavailable"):
+            prescription_service.dispense_prescription(prescription.id)
+        
+        check = SessionLocal()
+        try:
+            assert check.get(Prescription, prescription.id).status == PrescriptionStatus.ACTIVE
+            assert InventoryService(check).get_inventory_item(medication.id).quantity == 20
+        finally:
+            check.close()
+    
+    def test_dispense_batch_isolates_failures(self, db, prescription_service, inventory_service):
+        """Test a ward round dispenses what it can and reports the rest"""
+        medication = inventory_service.add_inventory_item({
+            'name': 'Ward Med', 'quantity': 12, 'unit_cost': Decimal('1.00'), 'storage_location': 'Ward Pharmacy'
+        })
+        filled = [_prescribe(prescription_service, medication.id, 5) for _ in range(2)]
+        short = _prescribe(prescription_service, medication.id, 5)
+        
+        report = prescription_service.dispense_prescriptions(
+            [prescription.id for prescription in filled + [short]] + ['missing-rx']
+        )
+        
+        db.expire_all()
+        dispensed = {line['prescription_id'] for line in report['dispensed']}
+        failed = {line['prescription_id'] for line in report['failed']}
+        assert len(dispensed) == 2
+        assert len(failed) == 2 and 'missing-rx' in failed
+        assert inventory_service.get_inventory_item(medication.id).quantity == 2
+        statuses = [prescription_service.get_prescription(p.id).status for p in filled + [short]]
+        assert statuses.count(PrescriptionStatus.FILLED) == 2
+    
+    def _fail_second_billing(self, monkeypatch, error):
+        """Make the second billing record staged from now on raise an error"""
+        stage_billing_record = BillingService.stage_billing_record
+        calls = []
+        def stage(service, *args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise error
+            return stage_billing_record(service, *args, **kwargs)
+        monkeypatch.setattr(BillingService, 'stage_billing_record', stage)
+    
+    def test_dispense_batch_reports_database_errors(self, db, prescription_service, inventory_service, monkeypatch):
+        """Test a database error fails only its own prescription in a round"""
+        medication = inventory_service.add_inventory_item({
+            'name': 'Round Med', 'quantity': 30, 'unit_cost': Decimal('1.00'), 'storage_location': 'Pharmacy H'
+        })
+        first, second = sorted((_prescribe(prescription_service, medication.id, 5) for _ in range(2)),
+                               key=lambda prescription: prescription.id)
+        self._fail_second_billing(monkeypatch, IntegrityError("INSERT", {}, Exception("duplicate")))
+        
+        report = prescription_service.dispense_prescriptions([first.id, second.id])
+        
+        assert [line['prescription_id'] for line in report['dispensed']] == [first.id]
+        assert report['failed'] == [{'prescription_id': second.id, 'reason': 'database error: IntegrityError'}]
+        db.expire_all()
+        assert inventory_service.get_inventory_item(medication.id).quantity == 25
+    
+    def test_aborted_dispense_batch_commits_nothing(self, db, prescription_service, inventory_service, monkeypatch):
+        """Test a round aborted after its first prescription leaves every prescription undispensed"""
+        medication = inventory_service.add_inventory_item({
+            'name': 'Aborted Round Med', 'quantity': 30, 'unit_cost': Decimal('1.00'), 'storage_location': 'Pharmacy H'
+        })
+        prescriptions = [_prescribe(prescription_service, medication.id, 5) for _ in range(2)]
+        self._fail_second_billing(monkeypatch, RuntimeError("billing unavailable"))
+        
+        with pytest.raises(RuntimeError, match="billing unavailable"):
+            prescription_service.dispense_prescriptions([prescription.id for prescription in prescriptions])
+        db.rollback()
+        
+        check = SessionLocal()
+        try:
+            assert InventoryService(check).get_inventory_item(medication.id).quantity == 30
+            assert {check.get(Prescription, p.id).status for p in prescriptions} == {PrescriptionStatus.ACTIVE}
+        finally:
+            check.close()
+    
+    def test_parse_duration(self):
+        """Test free-text durations parse to a length, or None without one"""
+        assert parse_duration('30 days') == timedelta(days=30)
+        assert parse_duration('take for 2 Weeks') == timedelta(days=14)
+        assert parse_duration('3 months') == timedelta(days=90)
+        assert parse_duration('until symptoms resolve') is None
+    
+    def test_expiry_sweep_expires_in_batches(self, db, prescription_service, inventory_service):
+        """Test the sweep expires past-due prescriptions and leaves the rest active"""
+        medication = inventory_service.add_inventory_item({
+            'name': 'Expiry Med', 'quantity': 10, 'unit_cost': 1.00, 'storage_location': 'Pharmacy H'
+        })
+        patient_id = f'patient-{uuid.uuid4()}'
+        short = [_prescribe(prescription_service, medication.id, 1, patient_id) for _ in range(3)]
+        ongoing = prescription_service.create_prescription({
+            'patient_id': patient_id, 'doctor_id': 'doctor-1', 'medication_id': medication.id,
+            'dosage': '1mg', 'frequency': 'daily', 'duration': 'ongoing'
+        })
+        assert ongoing.expires_at is None
+        
+        expired = prescription_service.expire_prescriptions(batch_size=2, now=datetime.utcnow() + timedelta(days=11))
+        
+        assert expired >= 3
+        db.expire_all()
+        assert all(prescription_service.get_prescription(p.id).status == PrescriptionStatus.EXPIRED for p in short)
+        assert [p.id for p in prescription_service.get_active_prescriptions(patient_id)] == [ongoing.id]
+    
+    def test_expiry_sweep_counts_only_rows_it_expired(self, db, prescription_service, inventory_service, monkeypatch):
+        """Test a prescription another worker changes between the select and the update is not counted"""
+        medication = inventory_service.add_inventory_item({
+            'name': 'Raced Expiry Med', 'quantity': 10, 'unit_cost': 1.00, 'storage_location': 'Pharmacy H'
+        })
+        patient_id = f'patient-{uuid.uuid4()}'
+        raced, kept = [_prescribe(prescription_service, medication.id, 1, patient_id) for _ in range(2)]
+        now = datetime.utcnow() + timedelta(days=11)
+        due = db.query(Prescription).filter(
+            Prescription.status == PrescriptionStatus.ACTIVE, Prescription.expires_at <= now
+        ).count()
+        
+        execute = db.execute
+        def execute_after_other_worker(statement, *args, **kwargs):
+            if getattr(statement, 'is_update', False):
+                other = SessionLocal()
+                try:
+                    other.get(Prescription, raced.id).status = PrescriptionStatus.CANCELLED
+                    other.commit()
+                finally:
+                    other.close()
+            return execute(statement, *args, **kwargs)
+        monkeypatch.setattr(db, 'execute', execute_after_other_worker)
+        
+        expired = prescription_service.expire_prescriptions(batch_size=1000, now=now)
+        
+        assert expired == due - 1
+        db.expire_all()
+        assert prescription_service.get_prescription(raced.id).status == PrescriptionStatus.CANCELLED
+        assert prescription_service.get_prescription(kept.id).status == PrescriptionStatus.EXPIRED
+        assert db.query(OutboxEvent).filter(OutboxEvent.aggregate_id == raced.id,
+                                            OutboxEvent.event_type == 'prescription.status_changed').count() == 0
+    
+    def test_backfill_expires_at(self, db, prescription_service, inventory_service):
+        """Test rows written before expires_at existed get it from their duration"""
+        medication = inventory_service.add_inventory_item({
+            'name': 'Backfill Med', 'quantity': 10, 'unit_cost': 1.00, 'storage_location': 'Pharmacy H'
+        })
+        prescription = _prescribe(prescription_service, medication.id, 1)
+        db.query(Prescription).filter(Prescription.id == prescription.id).update({'expires_at': None})
+        db.commit()
+        
+        assert prescription_service.backfill_expires_at(batch_size=1) >= 1
+        
+        db.expire_all()
+        refreshed = prescription_service.get_prescription(prescription.id)
+        assert refreshed.expires_at == refreshed.created_at + timedelta(days=10)
+    
+    def test_prescription_history_pagination(self, db, prescription_service, inventory_service):
+        """Test history is filtered by status and returned page by page with a keyset cursor"""
+        medication = inventory_service.add_inventory_item({
+            'name': 'History Med', 'quantity': 10, 'unit_cost': 1.00, 'storage_location': 'Pharmacy J'
+        })
+        patient_id = f'patient-{uuid.uuid4()}'
+        created = [_prescribe(prescription_service, medication.id, 1, patient_id) for _ in range(5)]
+        prescription_service.update_prescription_status(created[0].id, 'cancelled')
+        
+        first = prescription_service.get_prescriptions_page(patient_id, ['active'], limit=3)
+        second = prescription_service.get_prescriptions_page(patient_id, ['active'], limit=3, cursor=first['next_cursor'])
+        
+        seen = [p.id for p in first['prescriptions'] + second['prescriptions']]
+        assert len(first['prescriptions']) == 3
+        assert second['next_cursor'] is None
+        assert sorted(seen) == sorted(p.id for p in created[1:])
+        assert len(prescription_service.get_prescription_history(patient_id)) == 5
+        with pytest.raises(ValueError):
+            prescription_service.get_prescriptions_page(patient_id, ['unknown'])
+    
+    def test_active_prescriptions_for_patients(self, prescription_service, inventory_service):
+        """Test active prescriptions for a ward list come back grouped by patient"""
+        medication = inventory_service.add_inventory_item({
+            'name': 'Ward List Med', 'quantity': 10, 'unit_cost': 1.00, 'storage_location': 'Pharmacy J'
+        })
+        patients = [f'patient-{uuid.uuid4()}' for _ in range(3)]
+        for patient_id in patients[:2]:
+            _prescribe(prescription_service, medication.id, 1, patient_id)
+        filled = _prescribe(prescription_service, medication.id, 1, patients[0])
+        prescription_service.update_prescription_status(filled.id, 'filled')
+        
+        grouped = prescription_service.get_active_prescriptions_for_patients(patients)
+        
+        assert [len(grouped[patient_id]) for patient_id in patients] == [1, 1, 0]
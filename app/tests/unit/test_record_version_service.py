@@ -0,0 +1,153 @@
+"""Unit tests for record version service"""
+import uuid
+import pytest
+from datetime import datetime
+from app.services.medical_record_service import MedicalRecordService
+from app.services.record_version_service import RecordVersionService
+from app.models.medical_record import Diagnosis, MedicalRecord
+from app.database import SessionLocal
+
+@pytest.fixture
+def db():
+    """Database session fixture"""
+    session = SessionLocal()
+    yield session
+    session.close()
+
+@pytest.fixture
+def record_service(db):
+    """Medical record service fixture"""
+    return MedicalRecordService(db)
+
+@pytest.fixture
+def version_service(db):
+    """Record version service fixture"""
+    return RecordVersionService(db)
+
+def _patient(record_service):
+    patient_id = f"patient-{uuid.uuid4().hex[:8]}"
+    record_service.create_record(patient_id, "doctor-1")
+    return patient_id
+
+class TestRecordVersionService:
+    """Unit tests for RecordVersionService"""
+
+    def test_versions_share_entries_without_copying(self, version_service, record_service, db):
+        """Test a new version stores only its own changes and older versions are unchanged"""
+        patient_id = _patient(record_service)
+        hypertension = record_service.add_diagnosis(patient_id, "I10", "Hypertension")
+        record_service.add_clinical_note(patient_id, "Initial visit", "doctor-1")
+
+        v2 = version_service.create_version(patient_id, "doctor-2")
+        assert v2.version == 2
+        assert db.query(Diagnosis).filter(Diagnosis.record_id == v2.id).count() == 0
+        diabetes = record_service.add_diagnosis(patient_id, "E11.9", "Type 2 diabetes")
+        version_service.remove_entry(patient_id, "diagnosis", hypertension.id, "doctor-2")
+
+        latest = version_service.get_version(patient_id)
+        assert latest['version'] == 2
+        assert [d['id'] for d in latest['diagnoses']] == [diabetes.id]
+        assert len(latest['clinical_notes']) == 1
+
+        first = version_service.get_version(patient_id, 1)
+        assert [d['id'] for d in first['diagnoses']] == [hypertension.id]
+
+    def test_sealed_versions_are_cached(self, version_service, record_service):
+        """Test a version with a successor is cached and later versions replay from it"""
+        patient_id = _patient(record_service)
+        record_service.add_diagnosis(patient_id, "J45", "Asthma")
+        version_service.create_version(patient_id, "doctor-1")
+        record_service.add_treatment(patient_id, "medication", "Inhaler", datetime(2024, 1, 1))
+
+        latest = version_service.get_version(patient_id)
+        assert len(latest['diagnoses']) == 1 and len(latest['treatments']) == 1
+        assert not RecordVersionService.is_cached(latest['record_id'])
+
+        first = version_service.get_version(patient_id, 1)
+        assert RecordVersionService.is_cached(first['record_id'])
+        version_service.create_version(patient_id, "doctor-1")
+        record_service.add_clinical_note(patient_id, "Symptoms controlled", "doctor-1")
+
+        third = version_service.get_version(patient_id, 3)
+        assert (len(third['diagnoses']), len(third['treatments']), len(third['clinical_notes'])) == (1, 1, 1)
+        assert version_service.get_version(patient_id, 1)['treatments'] == []
+
+    def test_diff_versions(self, version_service, record_service):
+        """Test a diff lists what was added and removed in either direction"""
+        patient_id = _patient(record_service)
+        asthma = record_service.add_diagnosis(patient_id, "J45", "Asthma")
+        version_service.create_version(patient_id, "doctor-1")
+        note = record_service.add_clinical_note(patient_id, "Follow-up", "doctor-1")
+        temporary = record_service.add_diagnosis(patient_id, "R05", "Cough")
+        version_service.remove_entry(patient_id, "diagnosis", asthma.id, "doctor-1")
+        version_service.create_version(patient_id, "doctor-1")
+        version_service.remove_entry(patient_id, "diagnosis", temporary.id, "doctor-1")
+
+        diff = version_service.diff_versions(patient_id, 1, 3)
+        assert [n['id'] for n in diff['added']['clinical_notes']] == [note.id]
+        assert diff['added']['diagnoses'] == []
+        assert [d['id'] for d in diff['removed']['diagnoses']] == [asthma.id]
+        assert diff['removed']['diagnoses'][0]['version'] == 1
+
+        reverse = version_service.diff_versions(patient_id, 3, 1)
+        assert reverse['added'] == diff['removed'] and reverse['removed'] == diff['added']
+
+    def test_remove_entry_validation(self, version_service, record_service):
+        """Test removals are rejected for unknown types, other patients' entries and repeats"""
+        patient_id = _patient(record_service)
+        other_patient = _patient(record_service)
+        diagnosis = record_service.add_diagnosis(patient_id, "I10", "Hypertension")
+
+        with pytest.raises(ValueError):
+            version_service.remove_entry(patient_id, "allergy", diagnosis.id, "doctor-1")
+        with pytest.raises(ValueError):
+            version_service.remove_entry(other_patient, "diagnosis", diagnosis.id, "doctor-1")
+        version_service.remove_entry(patient_id, "diagnosis", diagnosis.id, "doctor-1")
+        with pytest.raises(ValueError):
+            version_service.remove_entry(patient_id, "diagnosis", diagnosis.id, "doctor-1")
+        with pytest.raises(ValueError):
+            version_service.get_version(patient_id, 7)
+
+    def test_version_numbers_are_unique(self, version_service, record_service, db, monkeypatch):
+        """Test a repeated create returns the record and a version race retries on the winner"""
+        patient_id = _patient(record_service)
+        first = record_service.get_record(patient_id)
+        assert record_service.create_record(patient_id, "doctor-2").id == first.id
+
+        # Another writer takes version 2 between our read of the latest version and our commit
+        original = RecordVersionService._latest
+        calls = []
+        def stale(self, patient):
+            calls.append(patient)
+            if len(calls) == 1:
+                rival = MedicalRecord(id=str(uuid.uuid4()), patient_id=patient_id, created_by="doctor-3", version=2)
+                self.db.add(rival)
+                self.db.commit()
+                return first
+            return original(self, patient)
+        monkeypatch.setattr(RecordVersionService, "_latest", stale)
+
+        created = version_service.create_version(patient_id, "doctor-1")
+        assert created.version == 3
+        assert [header.version for header in version_service._versions(patient_id)] == [1, 2, 3]
+
+    def test_late_write_to_sealed_version_drops_cache(self, version_service, record_service, monkeypatch):
+        """Test a write that lands after its version was sealed and cached is not hidden by the cache"""
+        patient_id = _patient(record_service)
+        first = record_service.get_record(patient_id)
+        version_service.create_version(patient_id, "doctor-1")
+        assert version_service.get_version(patient_id, 1)['diagnoses'] == []
+        assert RecordVersionService.is_cached(first.id)
+
+        # The writer read version 1 as latest before version 2 was created
+        original = MedicalRecordService.get_record
+        calls = []
+        def stale(self, patient, version=None):
+            calls.append(patient)
+            return first if len(calls) == 1 else original(self, patient, version)
+        monkeypatch.setattr(MedicalRecordService, "get_record", stale)
+        diagnosis = record_service.add_diagnosis(patient_id, "I10", "Hypertension")
+
+        assert diagnosis.record_id == first.id
+        assert not RecordVersionService.is_cached(first.id)
+        assert [d['id'] for d in version_service.get_version(patient_id, 1)['diagnoses']] == [diagnosis.id]
@@ -0,0 +1,156 @@
+"""Unit tests for remittance service"""
+import io
+import json
+import pytest
+from decimal import Decimal
+from app.services.billing_service import BillingService
+from app.services.remittance_service import RemittanceService
+from app.models.billing import BillingStatus, Payment
+from app.database import SessionLocal
+
+@pytest.fixture
+def db():
+    """Database session fixture"""
+    session = SessionLocal()
+    yield session
+    session.close()
+
+@pytest.fixture
+def remittance_service(db):
+    """Remittance service fixture"""
+    return RemittanceService(db)
+
+@pytest.fixture
+def billing_service(db):
+    """Billing service fixture"""
+    return BillingService(db)
+
+def _create_bill(billing_service, patient_id='patient-rem'):
+    return billing_service.create_billing_record(patient_id, [
+        {'service_type': 'consultation', 'quantity': 1, 'unit_price': 100.00, 'total_price': 100.00}
+    ])
+
+class TestRemittanceService:
+    """Unit tests for RemittanceService"""
+
+    def test_ingest_csv(self, remittance_service, billing_service, db):
+        """Test CSV remittance lines are applied as payments"""
+        full = _create_bill(billing_service)
+        partial = _create_bill(billing_service)
+        csv_data = (
+            "billing_id,amount,payment_method\n"
+            f"{full.id},20.00,eft\n"
+            f"{partial.id},5.00,\n"
+        )
+
+        report = remittance_service.ingest(io.StringIO(csv_data), 'csv')
+
+        assert report['lines_read'] == 2
+        assert report['payments_applied'] == 2
+        assert report['amount_applied'] == Decimal('25.00')
+        assert report['bills_paid'] == 1
+        assert report['unmatched'] == []
+        db.expire_all()
+        assert billing_service.get_billing_record(full.id).status == BillingStatus.PAID
+        assert billing_service.get_billing_record(partial.id).status == BillingStatus.PENDING
+        payment = db.query(Payment).filter(Payment.billing_id == partial.id).one()
+        assert payment.payment_method == RemittanceService.DEFAULT_PAYMENT_METHOD
+
+    def test_ingest_reports_unmatched_lines(self, remittance_service, billing_service):
+        """Test unknown, finalized and malformed lines are reported, not applied"""
+        finalized = _create_bill(billing_service)
+        billing_service.finalize_billing_record(finalized.id)
+        ok = _create_bill(billing_service)
+        csv_data = (
+            "billing_id,amount\n"
+            "no-such-bill,10.00\n"
+            f"{finalized.id},10.00\n"
+            f"{ok.id},abc\n"
+            f"{ok.id},-5\n"
+            f"{ok.id},10.00\n"
+        )
+
+        report = remittance_service.ingest(io.StringIO(csv_data), 'csv')
+
+        assert report['payments_applied'] == 1
+        reasons = {line['line']: line['reason'] for line in report['unmatched']}
+        assert reasons == {
+            2: 'billing record not found',
+            3: 'billing record is finalized',
+            4: 'invalid amount',
+            5: 'invalid amount'
+        }
+
+    def test_ingest_ndjson(self, remittance_service, billing_service):
+        """Test NDJSON remittance lines are applied"""
+        bill = _create_bill(billing_service)
+        ndjson_data = "\n".join([
+            json.dumps({'billing_id': bill.id, 'amount': '7.50'}),
+            "",
+            "not json"
+        ])
+
+        report = remittance_service.ingest(io.StringIO(ndjson_data), 'ndjson')
+
+        assert report['lines_read'] == 2
+        assert report['payments_applied'] == 1
+        assert report['unmatched'][0]['line'] == 3
+
+    def test_partial_lines_add_up_to_paid(self, remittance_service, billing_service, db):
+        """Test a bill is paid once the sum of its lines, across chunks, covers the responsibility"""
+        bill = _create_bill(billing_service)
+        csv_data = "billing_id,amount\n" + "".join(f"{bill.id},5.00\n" for _ in range(4))
+
+        report = remittance_service.ingest(io.StringIO(csv_data), 'csv', chunk_size=3)
+
+        assert report['payments_applied'] == 4
+        assert report['bills_paid'] == 1
+        db.expire_all()
+        assert billing_service.get_billing_record(bill.id).status == BillingStatus.PAID
+
+    def test_resent_file_posts_nothing_twice(self, remittance_service, billing_service, db):
+        """Test re-ingesting a file skips its lines already posted"""
+        bill = _create_bill(billing_service)
+        csv_data = f"billing_id,amount\n{bill.id},5.00\n{bill.id},6.00\n"
+        first = remittance_service.ingest(io.StringIO(csv_data), 'csv')
+
+        again = remittance_service.ingest(io.StringIO(csv_data), 'csv')
+
+        assert again['remittance_id'] == first['remittance_id']
+        assert again['payments_applied'] == 0
+        assert again['lines_already_posted'] == 2
+        assert db.query(Payment).filter(Payment.billing_id == bill.id).count() == 2
+
+    def test_csv_line_numbers_count_physical_lines(self, remittance_service, billing_service):
+        """Test unmatched lines report their line in the file, past blank lines and quoted newlines"""
+        bill = _create_bill(billing_service)
+        csv_data = (
+            "billing_id,amount,payment_method\n"
+            f"{bill.id},1.00,\"eft\nbatch 7\"\n"
+            "\n"
+            "no-such-bill,1.00,eft\n"
+        )
+
+        report = remittance_service.ingest(io.StringIO(csv_data), 'csv')
+
+        assert [line['line'] for line in report['unmatched']] == [5]
+
+    def test_ingest_unsupported_format(self, remittance_service):
+        """Test unsupported file formats are rejected"""
+        with pytest.raises(ValueError, match="Unsupported remittance format"):
+            remittance_service.ingest(io.StringIO(""), 'xml')
+
+    def test_ingest_large_file_in_chunks(self, remittance_service, billing_service, db):
+        """Test a large file is posted in chunked transactions"""
+        bills = [_create_bill(billing_service, 'patient-rem-bulk') for _ in range(20)]
+        lines = ["billing_id,amount"]
+        for i in range(10000):
+            lines.append(f"{bills[i % len(bills)].id},0.50")
+
+        report = remittance_service.ingest(io.StringIO("\n".join(lines)), 'csv', chunk_size=2500)
+
+        assert report['lines_read'] == 10000
+        assert report['payments_applied'] == 10000
+        assert report['amount_applied'] == Decimal('5000.00')
+        assert report['bills_paid'] == 20
+        assert db.query(Payment).filter(Payment.billing_id.in_([b.id for b in bills])).count() == 10000